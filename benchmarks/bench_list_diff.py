@@ -0,0 +1,61 @@
+"""
+Compares the scalar list diff against the previous quadratic implementation.
+
+    python -m benchmarks.bench_list_diff [--sizes 1000 10000 30000]
+"""
+import argparse
+import random
+import time
+
+from kronos.diff import DiffHelper
+
+
+def quadratic_list_diff(new_value, old_value):
+    added = [nv for nv in new_value if nv not in old_value]
+    deleted = [ov for ov in old_value if ov not in new_value]
+    return added, deleted
+
+
+def make_lists(size, changes=0.01, seed=0):
+    rnd = random.Random(seed)
+    old_value = ['tag-{}'.format(i) for i in range(size)]
+    new_value = list(old_value)
+
+    for _ in range(max(1, int(size * changes))):
+        new_value[rnd.randrange(size)] = 'new-tag-{}'.format(rnd.random())
+
+    rnd.shuffle(new_value)
+    return new_value, old_value
+
+
+def timeit(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 30000])
+    args = parser.parse_args(argv)
+
+    helper = DiffHelper()
+
+    print('{:>10} {:>14} {:>14} {:>10}'.format('size', 'quadratic (s)', 'multiset (s)', 'speedup'))
+
+    for size in args.sizes:
+        new_value, old_value = make_lists(size)
+
+        quadratic = timeit(lambda: quadratic_list_diff(new_value, old_value), repeat=1)
+        multiset = timeit(lambda: helper.diff(dict(tags=new_value), dict(tags=old_value)))
+
+        print('{:>10} {:>14.4f} {:>14.4f} {:>9.1f}x'.format(size, quadratic, multiset, quadratic / multiset))
+
+
+if __name__ == '__main__':
+    main()
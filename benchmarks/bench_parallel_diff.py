@@ -0,0 +1,58 @@
+"""
+Compares diffing a batch of (current, snapshot) pairs serially and in a process pool
+with the ParallelDiffHelper, for a varying number of workers.
+
+    python -m benchmarks.bench_parallel_diff [--entities 20000] [--fields 50] [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import time
+
+from kronos.diff import DiffHelper
+from kronos.parallel_diff import ParallelDiffHelper
+
+
+def make_pairs(entities, fields):
+    pairs = []
+    for i in range(entities):
+        old = {'field_{}'.format(f): f for f in range(fields)}
+        old.update(id=i, items=[dict(id=j, price=j) for j in range(10)], tags=['tag {}'.format(j) for j in range(10)])
+
+        new = dict(old, field_0=i, tags=old['tags'][1:] + ['new tag'])
+        new['items'] = [dict(item, price=item['price'] + 1) for item in old['items']]
+        pairs.append((new, old))
+
+    return pairs
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entities', type=int, default=20000)
+    parser.add_argument('--fields', type=int, default=50)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+
+    pairs = make_pairs(args.entities, args.fields)
+    serial = timed(lambda: DiffHelper().diff_many(pairs))
+
+    print('{} cpus, {} entities of {} fields'.format(os.cpu_count(), args.entities, args.fields))
+    print('{:>8} {:>10} {:>10}'.format('workers', 'time (s)', 'speedup'))
+    print('{:>8} {:>10.3f} {:>10.2f}'.format('serial', serial, 1.0))
+
+    for workers in args.workers:
+        with ParallelDiffHelper(max_workers=workers, min_batch_size=0) as helper:
+            # start the workers before timing
+            helper.diff_many(pairs[:workers * 10])
+            elapsed = timed(lambda: helper.diff_many(pairs))
+
+        print('{:>8} {:>10.3f} {:>10.2f}'.format(workers, elapsed, serial / elapsed))
+
+
+if __name__ == '__main__':
+    main()
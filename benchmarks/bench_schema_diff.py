@@ -0,0 +1,49 @@
+"""
+Compares the generic DiffHelper.diff with a diff compiled for the entity schema on
+wide entities.
+
+    python -m benchmarks.bench_schema_diff [--fields 200] [--number 2000]
+"""
+import argparse
+import timeit
+
+from kronos.diff import DiffHelper
+from kronos.schema import compile_diff, infer_schema
+
+
+def make_entities(fields):
+    old_entity = {'field_{}'.format(i): i for i in range(fields)}
+    old_entity['address'] = dict(city='city', zip='1234', street='street')
+    old_entity['tags'] = ['a', 'b', 'c']
+
+    new_entity = dict(old_entity)
+    new_entity['field_3'] = -1
+    new_entity['address'] = dict(old_entity['address'], city='new city')
+
+    return new_entity, old_entity
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fields', type=int, nargs='+', default=[20, 200, 1000])
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    helper = DiffHelper()
+
+    print('{:>8} {:>14} {:>14} {:>10}'.format('fields', 'generic (us)', 'compiled (us)', 'speedup'))
+
+    for fields in args.fields:
+        new_entity, old_entity = make_entities(fields)
+        compiled_diff = compile_diff(infer_schema(old_entity), helper)
+
+        generic = min(timeit.repeat(lambda: helper.diff(new_entity, old_entity), number=args.number, repeat=3))
+        compiled = min(timeit.repeat(lambda: compiled_diff(new_entity, old_entity), number=args.number, repeat=3))
+
+        print('{:>8} {:>14.2f} {:>14.2f} {:>9.1f}x'.format(
+            fields, generic / args.number * 1e6, compiled / args.number * 1e6, generic / compiled
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the size and the encoding time of a diff with pickle, json of the objects
+__dict__ (what loggers did before), and the kronos JSON and binary encodings.
+
+    python -m benchmarks.bench_serialization [--fields 50] [--number 2000]
+"""
+import argparse
+import json
+import pickle
+import timeit
+
+from datetime import datetime
+from decimal import Decimal
+
+from kronos.diff import DiffHelper
+from kronos.serialization import decode_binary, decode_json, encode_binary, encode_json
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    elif hasattr(value, '__dict__'):
+        return vars(value)
+
+    return repr(value)
+
+
+def make_diff(fields):
+    old = {'field_{}'.format(i): i for i in range(fields)}
+    old.update(
+        price=Decimal('10.5'),
+        updated_at=datetime(2020, 1, 1),
+        items=[dict(id=i, price=i * 10, name='item {}'.format(i)) for i in range(20)],
+        tags=['tag {}'.format(i) for i in range(20)],
+    )
+
+    new = {k: (v + 1 if isinstance(v, int) else v) for k, v in old.items()}
+    new.update(
+        price=Decimal('11.5'),
+        updated_at=datetime(2020, 1, 2),
+        items=[dict(item, price=item['price'] + 1) for item in old['items']],
+        tags=old['tags'][5:] + ['new tag'],
+    )
+
+    return DiffHelper().diff(new, old)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fields', type=int, default=50)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    diff = make_diff(args.fields)
+
+    encodings = [
+        ('pickle', lambda: pickle.dumps(diff, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ('json __dict__', lambda: json.dumps(diff, default=_json_default).encode(), json.loads),
+        ('kronos json', lambda: encode_json(diff).encode(), decode_json),
+        ('kronos binary', lambda: encode_binary(diff), decode_binary),
+    ]
+
+    print('{:>14} {:>10} {:>14} {:>14}'.format('encoding', 'bytes', 'encode (us)', 'decode (us)'))
+
+    for name, encode, decode in encodings:
+        data = encode()
+        encode_time = min(timeit.repeat(encode, number=args.number, repeat=3)) / args.number
+        decode_time = min(timeit.repeat(lambda: decode(data), number=args.number, repeat=3)) / args.number
+
+        print('{:>14} {:>10} {:>14.2f} {:>14.2f}'.format(name, len(data), encode_time * 1e6, decode_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
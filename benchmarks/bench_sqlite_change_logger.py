@@ -0,0 +1,120 @@
+"""
+Grows a SQLiteChangeLogger up to --rows change records and measures the latency of
+the history queries at several sizes. With the indexes, the latency shouldn't grow
+with the size of the log.
+
+    python -m benchmarks.bench_sqlite_change_logger [--rows 10000000] [--steps 5]
+
+A run with the defaults (10M rows, 100k entities, one CPU) gave p50 / p99 in ms:
+
+        rows  insert/s   last 100       last change    entity history  1h range
+     2000000     27173   2.38 / 5.26    0.036 / 0.069  0.14 / 0.46     22.1 / 26.7
+     4000000     21500   2.59 / 3.08    0.038 / 0.087  0.33 / 1.23     17.3 / 25.0
+     6000000     21868   2.52 / 3.15    0.038 / 0.895  0.49 / 0.72     24.0 / 29.0
+     8000000     21774   2.53 / 3.82    0.023 / 0.039  0.42 / 0.89     22.3 / 27.2
+    10000000     20488   1.76 / 4.54    0.024 / 0.036  0.74 / 2.20     24.5 / 29.8
+
+The entity history returns every record of an entity, 5 times more of them at 10M rows
+than at 2M, so its latency grows with the records returned, not with the log size.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from kronos.diff import Change, Diff
+from kronos.sqlite_change_logger import SQLiteChangeLogger
+
+
+class Entity(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+ENTITY_TYPES = [type(name, (Entity,), {}) for name in ['Order', 'Customer', 'Product', 'Invoice']]
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(seconds=1)
+        return self.now
+
+
+def make_entries(count, entities):
+    diff = Diff()
+    diff.updated.append(Change('status', value='paid', old_value='pending'))
+
+    for i in range(count):
+        entity = ENTITY_TYPES[i % len(ENTITY_TYPES)](random.randrange(entities))
+        yield entity, diff, dict(user='user {}'.format(i % 100))
+
+
+def measure(func, number=50):
+    latencies = []
+    for _ in range(number):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--entities', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=50000)
+    parser.add_argument('--path', help='Database file, a temporary one by default')
+    args = parser.parse_args(argv)
+
+    tmp_dir = None if args.path else tempfile.mkdtemp()
+    path = args.path or os.path.join(tmp_dir, 'changes.db')
+    clock = Clock()
+    change_logger = SQLiteChangeLogger(path, clock=clock)
+
+    queries = [
+        ('last 100', lambda: change_logger.history('Order', limit=100)),
+        ('last change', lambda: change_logger.last_change('Order')),
+        ('entity history', lambda: change_logger.history('Order', entity_id=random.randrange(args.entities))),
+        ('1h range', lambda: change_logger.history(
+            'Order', date_from=clock.now - timedelta(hours=2), date_to=clock.now - timedelta(hours=1)
+        )),
+    ]
+
+    print('{:>12} {:>12}  {}'.format('rows', 'insert/s', '  '.join('{:>22}'.format(q) for q, _ in queries)))
+    print('{:>12} {:>12}  {}'.format('', '', '  '.join('{:>22}'.format('p50 / p99 (ms)') for _ in queries)))
+
+    rows = 0
+    for step in range(1, args.steps + 1):
+        target = args.rows * step // args.steps
+        started = time.perf_counter()
+
+        while rows < target:
+            count = min(args.batch, target - rows)
+            change_logger.log_many(make_entries(count, args.entities))
+            rows += count
+
+        insert_rate = (target - args.rows * (step - 1) // args.steps) / (time.perf_counter() - started)
+        latencies = ['{:>10.3f} / {:>9.3f}'.format(*measure(query)) for _, query in queries]
+
+        print('{:>12} {:>12.0f}  {}'.format(rows, insert_rate, '  '.join(latencies)))
+
+    change_logger.close()
+
+    if tmp_dir:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Synthetic entities for the benchmark suite. Every shape builds a (new, old) pair of
+entity dicts that differ in a few places, and an Entity object to track.
+"""
+import random
+
+from copy import deepcopy
+
+
+class Entity(object):
+
+    def __init__(self, id, **fields):
+        self.id = id
+        self.__dict__.update(fields)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def wide(rnd, fields=300):
+    """
+    A flat entity with many scalar fields
+    """
+    entity = {'field_{}'.format(i): rnd.randrange(1000000) for i in range(fields)}
+    entity.update(('text_{}'.format(i), 'value {}'.format(rnd.random())) for i in range(fields // 3))
+    return entity
+
+
+def deep(rnd, depth=8, width=4):
+    """
+    An entity of nested dicts
+    """
+    def level(d):
+        node = {'value_{}'.format(i): rnd.randrange(1000) for i in range(width)}
+        if d:
+            node.update(('child_{}'.format(i), level(d - 1)) for i in range(2))
+        return node
+
+    return dict(name='deep', tree=level(depth))
+
+
+def lists(rnd, items=500, tags=500):
+    """
+    An entity with a long list of entities and a long list of scalars
+    """
+    return dict(
+        name='lists',
+        items=[dict(id=i, price=rnd.randrange(100), name='item {}'.format(i)) for i in range(items)],
+        tags=['tag {}'.format(i) for i in range(tags)],
+    )
+
+
+def blobs(rnd, size=1024 * 1024, count=2):
+    """
+    An entity with large text and bytes fields
+    """
+    entity = dict(name='blobs', version=1)
+    for i in range(count):
+        entity['text_{}'.format(i)] = ''.join(rnd.choice('abcdefgh') for _ in range(64)) * (size // 64)
+        entity['data_{}'.format(i)] = bytes(rnd.getrandbits(8) for _ in range(64)) * (size // 64)
+
+    return entity
+
+
+SHAPES = dict(wide=wide, deep=deep, lists=lists, blobs=blobs)
+
+
+def change_value(rnd, value):
+    """
+    Changes a random value of a nested dict, other than the id
+    """
+    while True:
+        key = rnd.choice([k for k in value if k != 'id'])
+        if isinstance(value[key], dict):
+            value = value[key]
+            continue
+
+        if isinstance(value[key], int):
+            value[key] += 1
+        elif isinstance(value[key], list):
+            if value[key] and isinstance(value[key][0], dict):
+                rnd.choice(value[key])['price'] += 1
+            else:
+                value[key].append('new {}'.format(rnd.random()))
+        elif isinstance(value[key], bytes):
+            value[key] = value[key][:-1] + b'\x00'
+        else:
+            value[key] = value[key][:-1] + 'x'
+        return
+
+
+def mutate(entity_dict, rnd, changes=3):
+    """
+    Returns a copy of an entity dict with a few changed values
+    """
+    changed = deepcopy(entity_dict)
+    for _ in range(changes):
+        change_value(rnd, changed)
+
+    return changed
+
+
+def make_pair(shape, seed=0):
+    rnd = random.Random(seed)
+    old = SHAPES[shape](rnd)
+    return mutate(old, rnd), old
+
+
+def make_entity(shape, id=1, seed=0):
+    return Entity(id, **SHAPES[shape](random.Random(seed)))
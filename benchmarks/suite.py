@@ -0,0 +1,389 @@
+"""
+Benchmark suite of the diff, conversion, tracker, store and change logger paths.
+
+Every case runs an operation a number of times in several rounds, and reports the median
+ops/sec of the rounds, the 50/95/99 percentiles of its latency over all the rounds and the
+peak memory allocated while running it (measured with tracemalloc in a separate run, so
+tracing doesn't affect the timings). The results can be saved as a JSON baseline, and
+compared with a baseline to fail when any case regressed more than a threshold. Comparing
+medians of rounds keeps a single slow round (a GC pause, another process) from being
+reported as a regression.
+
+    python -m benchmarks [-k diff] [--iterations 50] [--rounds 5] [--save baseline.json]
+    python -m benchmarks --baseline baseline.json [--threshold 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fnmatch import fnmatch
+
+from kronos.bounded_store import BoundedStore
+from kronos.buffered_change_logger import BufferedChangeLogger
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.dict_store import DictStore
+from kronos.memory_change_logger import MemoryChangeLogger
+from kronos.segment_change_logger import SegmentChangeLogger
+from kronos.sqlite_change_logger import SQLiteChangeLogger
+from kronos.sqlite_store import SQLiteStore
+from kronos.tracker import Tracker
+
+from .data import SHAPES, Entity, change_value, make_entity, make_pair, wide
+
+from kronos import columnar_store
+
+
+BASELINE_VERSION = 2
+
+# differences in peak memory smaller than this are noise
+_MEMORY_SLACK = 16 * 1024
+
+# number of distinct entities the store and logger cases cycle through
+_KEYS = 1000
+
+CASES = []
+
+
+def case(name):
+    """
+    Registers a benchmark case. The decorated function sets the case up and returns the
+    operation to measure, and optionally a function to clean up after it
+    """
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+
+def _register_shape_cases(shape):
+    @case('diff/{}'.format(shape))
+    def diff_case():
+        new, old = make_pair(shape)
+        helper = DiffHelper()
+        return lambda: helper.diff(new, old)
+
+    @case('entity_to_dict/{}'.format(shape))
+    def entity_to_dict_case():
+        entity = make_entity(shape)
+        comparator = EntityComparator()
+        return lambda: comparator.entity_to_dict(entity)
+
+    for fingerprints in (False, True):
+        suffix = '/fingerprints' if fingerprints else ''
+        case('tracker/{}{}'.format(shape, suffix))(_tracker_case(shape, True, fingerprints))
+        case('tracker_unchanged/{}{}'.format(shape, suffix))(_tracker_case(shape, False, fingerprints))
+
+
+def _tracker_case(shape, change, fingerprints):
+    """
+    Tracks an entity and logs its changes, after changing a value or, to measure the
+    no-op path, without changing it
+    """
+    def setup():
+        entity = make_entity(shape)
+        tracker = Tracker(EntityComparator(), MemoryChangeLogger(), store=DictStore(), fingerprints=fingerprints)
+        rnd = random.Random(1)
+
+        def cycle():
+            tracker.track_entity(entity, override=True)
+            if change:
+                change_value(rnd, entity.__dict__)
+            tracker.log_changes(entity)
+
+        return cycle
+
+    return setup
+
+
+for _shape in SHAPES:
+    _register_shape_cases(_shape)
+
+
+def _temp_dir():
+    directory = tempfile.mkdtemp(prefix='kronos-bench-')
+    return directory, lambda: shutil.rmtree(directory, ignore_errors=True)
+
+
+def _store_case(make_store):
+    def setup():
+        store, cleanup = make_store()
+
+        if store is None:
+            return None
+
+        snapshot = wide(random.Random(0), fields=30)
+        keys = ['Entity-{}'.format(i) for i in range(_KEYS)]
+        position = [0]
+
+        def save_and_get():
+            key = keys[position[0] % _KEYS]
+            position[0] += 1
+            store.save(key, snapshot)
+            store.get(key)
+
+        return save_and_get, cleanup
+
+    return setup
+
+
+def _sqlite_store():
+    directory, cleanup = _temp_dir()
+    store = SQLiteStore(os.path.join(directory, 'snapshots.db'))
+
+    def close():
+        store.close()
+        cleanup()
+
+    return store, close
+
+
+def _columnar_store():
+    if columnar_store.np is None:
+        # numpy is not installed
+        return None, None
+
+    return columnar_store.ColumnarStore(), None
+
+
+case('store/dict')(_store_case(lambda: (DictStore(), None)))
+case('store/bounded')(_store_case(lambda: (BoundedStore(max_entries=_KEYS // 2), None)))
+case('store/columnar')(_store_case(_columnar_store))
+case('store/sqlite')(_store_case(_sqlite_store))
+
+
+def _logger_case(make_logger):
+    def setup():
+        logger, cleanup = make_logger()
+        diff = DiffHelper().diff(*make_pair('wide'))
+        entities = [Entity(i) for i in range(_KEYS)]
+        position = [0]
+
+        def log():
+            logger.log(entities[position[0] % _KEYS], diff)
+            position[0] += 1
+
+        return log, cleanup
+
+    return setup
+
+
+def _file_logger(logger_class, name):
+    def make_logger():
+        directory, cleanup = _temp_dir()
+        logger = logger_class(os.path.join(directory, name))
+
+        def close():
+            if hasattr(logger, 'close'):
+                logger.close()
+            cleanup()
+
+        return logger, close
+
+    return make_logger
+
+
+def _buffered_logger():
+    logger = BufferedChangeLogger(MemoryChangeLogger())
+    return logger, logger.close
+
+
+case('logger/memory')(_logger_case(lambda: (MemoryChangeLogger(), None)))
+case('logger/buffered')(_logger_case(_buffered_logger))
+case('logger/sqlite')(_logger_case(_file_logger(SQLiteChangeLogger, 'changes.db')))
+case('logger/segment')(_logger_case(_file_logger(SegmentChangeLogger, 'changes')))
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_case(setup, iterations, warmup, memory_iterations, rounds=5):
+    """
+    Runs a case, `rounds` times `iterations` operations. Returns its results, or None when
+    it can't run here (setup returned no operation, e.g. for a missing optional dependency)
+    """
+    result = setup()
+    op, cleanup = result if isinstance(result, tuple) else (result, None)
+
+    if op is None:
+        return None
+
+    try:
+        for _ in range(warmup):
+            op()
+
+        latencies = []
+        round_ops_per_sec = []
+
+        for _ in range(rounds):
+            started = time.perf_counter()
+
+            for _ in range(iterations):
+                op_started = time.perf_counter()
+                op()
+                latencies.append(time.perf_counter() - op_started)
+
+            round_ops_per_sec.append(iterations / (time.perf_counter() - started))
+
+        tracemalloc.start()
+        try:
+            for _ in range(memory_iterations):
+                op()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    latencies.sort()
+
+    return dict(
+        iterations=iterations,
+        rounds=rounds,
+        ops_per_sec=statistics.median(round_ops_per_sec),
+        round_ops_per_sec=round_ops_per_sec,
+        p50_us=_percentile(latencies, 0.50) * 1e6,
+        p95_us=_percentile(latencies, 0.95) * 1e6,
+        p99_us=_percentile(latencies, 0.99) * 1e6,
+        peak_kb=peak / 1024.0,
+    )
+
+
+def run(patterns=None, iterations=50, warmup=10, memory_iterations=20, rounds=5, out=None):
+    """
+    Runs the cases whose name matches any of the patterns (fnmatch patterns or substrings),
+    printing their results as they finish. Returns the results by case name
+    """
+    results = {}
+
+    if out is not None:
+        out.write('{:<24} {:>12} {:>11} {:>11} {:>11} {:>11}\n'.format(
+            'case', 'ops/sec', 'p50 (us)', 'p95 (us)', 'p99 (us)', 'peak (KB)'
+        ))
+
+    for name, setup in CASES:
+        if patterns and not any(p in name or fnmatch(name, p) for p in patterns):
+            continue
+
+        result = run_case(setup, iterations, warmup, min(memory_iterations, iterations), rounds)
+
+        if result is None:
+            if out is not None:
+                out.write('{:<24} skipped\n'.format(name))
+            continue
+
+        results[name] = result
+
+        if out is not None:
+            out.write('{:<24} {ops_per_sec:>12.1f} {p50_us:>11.1f} {p95_us:>11.1f} {p99_us:>11.1f} '
+                      '{peak_kb:>11.1f}\n'.format(name, **result))
+            out.flush()
+
+    return results
+
+
+def save_baseline(path, results):
+    """
+    Saves results as a JSON baseline, with the Python version and machine they ran on
+    """
+    with open(path, 'w') as f:
+        json.dump(dict(
+            version=BASELINE_VERSION,
+            python=platform.python_version(),
+            machine=platform.machine(),
+            results=results,
+        ), f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    """
+    Returns the results of a baseline saved with `save_baseline`
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError("Unsupported baseline version {}".format(baseline.get('version')))
+
+    return baseline['results']
+
+
+def regressions(results, baseline, threshold):
+    """
+    Compares results with a baseline. Returns a description of every case whose median
+    ops/sec of the rounds dropped, or whose peak memory grew, more than the threshold (a
+    fraction)
+    """
+    found = []
+
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            found.append('{}: {:.1f} ops/sec, baseline {:.1f} ({:+.0%})'.format(
+                name, result['ops_per_sec'], base['ops_per_sec'], result['ops_per_sec'] / base['ops_per_sec'] - 1
+            ))
+
+        peak, base_peak = result['peak_kb'] * 1024, base['peak_kb'] * 1024
+        if peak > base_peak * (1 + threshold) and peak - base_peak > _MEMORY_SLACK:
+            found.append('{}: peak memory {:.1f} KB, baseline {:.1f} KB'.format(
+                name, result['peak_kb'], base['peak_kb']
+            ))
+
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-k', dest='patterns', action='append',
+                        help='Only run the cases matching this pattern (can be repeated)')
+    parser.add_argument('--list', action='store_true', help='List the cases and exit')
+    parser.add_argument('--iterations', type=int, default=50, help='Iterations of every round')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Rounds of iterations, cases are compared by their median round')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--memory-iterations', type=int, default=20,
+                        help='Iterations of the peak memory run')
+    parser.add_argument('--save', metavar='PATH', help='Save the results as a baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='Compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed regression against the baseline, as a fraction (default 0.25)')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _ in CASES:
+            print(name)
+        return 0
+
+    results = run(args.patterns, args.iterations, args.warmup, args.memory_iterations, args.rounds, out=sys.stdout)
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.baseline:
+        found = regressions(results, load_baseline(args.baseline), args.threshold)
+
+        if found:
+            print('\nRegressions over {:.0%}:'.format(args.threshold))
+            for line in found:
+                print('  ' + line)
+            return 1
+
+        print('\nNo regressions over {:.0%}'.format(args.threshold))
+
+    return 0
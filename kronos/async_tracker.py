@@ -0,0 +1,466 @@
+import asyncio
+import inspect
+
+from functools import partial
+
+from .diff import Diff
+from .dict_store import DictStore
+from .dirty import select_paths
+from .tracker import Tracker, EntityConflictError, _same_state
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+
+    return value
+
+
+class AsyncAdapter(object):
+
+    """
+    Exposes the methods of a synchronous object as coroutines. By default the calls run in
+    a thread pool executor so blocking I/O doesn't block the event loop.
+    Only the methods the wrapped object implements are exposed, so optional methods
+    (like get_many or log_many) are still detected with hasattr
+    """
+
+    def __init__(self, wrapped, executor=None, in_executor=True):
+        """
+        Parameters:
+          - wrapped (object): The synchronous store or change logger
+          - executor (Executor, optional): The executor used to run the calls. Defaults
+                to the event loop's default executor
+          - in_executor (bool, optional): If False, calls run inline in the event loop.
+                Only meant for in-memory objects that never block
+        """
+        self._wrapped = wrapped
+        self._executor = executor
+        self._in_executor = in_executor
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            if not self._in_executor:
+                return attr(*args, **kwargs)
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(attr, *args, **kwargs))
+
+        return call
+
+
+class AsyncStoreAdapter(AsyncAdapter):
+    pass
+
+
+class AsyncChangeLoggerAdapter(AsyncAdapter):
+    pass
+
+
+class AsyncTracker(Tracker):
+
+    """
+    Asyncio version of the Tracker. The store and the change logger have the same interface
+    the Tracker expects, but their methods are coroutines. Use AsyncStoreAdapter and
+    AsyncChangeLoggerAdapter to use synchronous stores and change loggers.
+    """
+
+    def __init__(self, comparator, change_logger, store=None, merkle=False, large_value_size=None,
+                 instrumentation=None, fingerprints=False):
+        """
+        Builds an async tracker
+
+        Parameters:
+          - comparator (object): An object used to compare entities. See Tracker
+          - change_logger (object): The object in charge of keeping a record of the
+                entity's changes. Same as in the Tracker but `log` and `log_many` are coroutines
+          - store (object, optional): The backend used to store the entities snapshots. Same
+                as in the Tracker but its methods are coroutines. Defaults to an in-memory store
+          - merkle (bool, optional): Save hashes of the nested values. See Tracker
+          - large_value_size (int, optional): Save the digests of texts and bytes longer
+                than this in the snapshots. See Tracker
+          - instrumentation (Instrumentation, optional): Receives the time spent in each
+                phase and the tracker counters. Store and change logger spans last until
+                their coroutines finish. See Tracker
+          - fingerprints (bool, optional): Save content fingerprints along with the
+                snapshots. See Tracker
+        """
+        store = store or AsyncStoreAdapter(DictStore(), in_executor=False)
+        super(AsyncTracker, self).__init__(
+            comparator, change_logger, store, merkle=merkle, large_value_size=large_value_size,
+            instrumentation=instrumentation, fingerprints=fingerprints
+        )
+
+    async def _store_get_many(self, keys):
+        if hasattr(self._store, 'get_many'):
+            return await self._store.get_many(keys)
+
+        values = await asyncio.gather(*[self._store.get(key) for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def _store_get_fingerprints(self, keys):
+        if not self._use_fingerprints:
+            return {}
+
+        if hasattr(self._store, 'get_fingerprints'):
+            return await self._store.get_fingerprints(keys)
+
+        values = await asyncio.gather(*[self._store.get_fingerprint(key) for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def _store_save(self, key, entity_dict, entity_fingerprint):
+        await self._store_save_many([self._snapshot_item(key, entity_dict, entity_fingerprint)])
+
+    async def _store_save_many(self, items):
+        if hasattr(self._store, 'save_many'):
+            await self._store.save_many(items)
+
+        else:
+            await asyncio.gather(*[
+                self._store.save(item[0], item[1], fingerprint=item[2]) if len(item) > 2
+                else self._store.save(*item)
+                for item in items
+            ])
+
+    async def _unchanged_keys(self, snapshots):
+        if hasattr(self._store, 'changes'):
+            changed = await self._store.changes([(key, entity_dict) for _, key, entity_dict, _ in snapshots])
+            return set(key for key, fields in changed.items() if not fields), {}
+
+        fingerprints = await self._store_get_fingerprints([key for _, key, _, _ in snapshots])
+
+        unchanged = set(
+            key for _, key, _, entity_fingerprint in snapshots
+            if key in fingerprints and fingerprints[key] == entity_fingerprint
+        )
+
+        return unchanged, fingerprints
+
+    async def _is_tracked_unchanged(self, entity_key, entity_fingerprint):
+        if entity_fingerprint is None:
+            return None
+
+        stored_fingerprint = await self._store.get_fingerprint(entity_key)
+
+        if stored_fingerprint is None:
+            return None
+
+        return stored_fingerprint == entity_fingerprint
+
+    async def _log_many(self, entries):
+        if hasattr(self.change_logger, 'log_many'):
+            await self.change_logger.log_many(entries)
+
+        else:
+            await asyncio.gather(*[
+                self.change_logger.log(entity, changes, **log_kwargs)
+                for entity, changes, log_kwargs in entries
+            ])
+
+    async def track_entity(self, entity, override=False):
+        """
+        Start tracking the state of an entity. See Tracker.track_entity
+        """
+        await self._track_snapshot(self._snapshot(entity), override=override)
+
+    async def _track_snapshot(self, snapshot, override=False):
+        entity, entity_key, entity_dict, entity_fingerprint = snapshot
+
+        if not override and await self._store.has_key(entity_key):
+            unchanged = await self._is_tracked_unchanged(entity_key, entity_fingerprint)
+
+            if unchanged is None:
+                tracked_entity = await self._store.get(entity_key)
+                unchanged = tracked_entity is None or _same_state(tracked_entity, entity_dict)
+
+            if not unchanged:
+                self.instrumentation.increment('conflicts')
+                raise EntityConflictError(
+                    "The entity is already been tracked and has changes. " \
+                    "Save it to track those changes or log the current changes first"
+                )
+
+        await self._store_save(entity_key, entity_dict, entity_fingerprint)
+        self._start_dirty_tracking(entity, entity_key)
+        self.instrumentation.increment('entities_tracked')
+
+    async def track_many(self, entities, override=False):
+        """
+        Start tracking the state of several entities at once. See Tracker.track_many
+        """
+        snapshots = self._snapshots(entities)
+
+        if not override:
+            unchanged, _ = await self._unchanged_keys(snapshots)
+            tracked = await self._store_get_many([key for _, key, _, _ in snapshots if key not in unchanged])
+
+            for _, key, entity_dict, _ in snapshots:
+                if key in tracked and not _same_state(tracked[key], entity_dict):
+                    self.instrumentation.increment('conflicts')
+                    raise EntityConflictError(
+                        "The entity is already been tracked and has changes. " \
+                        "Save it to track those changes or log the current changes first"
+                    )
+
+        await self._store_save_many([self._snapshot_item(*snapshot[1:]) for snapshot in snapshots])
+
+        for entity, key, _, _ in snapshots:
+            self._start_dirty_tracking(entity, key)
+
+        self.instrumentation.increment('entities_tracked', len(snapshots))
+
+    async def get_entity_diff(self, entity):
+        """
+        Calculates the diff of the entity against its tracked snapshot. See Tracker.get_entity_diff
+        """
+        return await self._snapshot_diff(self._snapshot(entity))
+
+    async def _snapshot_diff(self, snapshot):
+        entity, entity_key, entity_dict, entity_fingerprint = snapshot
+
+        stored_fingerprint = None
+        if entity_fingerprint is not None:
+            stored_fingerprint = await self._store.get_fingerprint(entity_key)
+
+            if stored_fingerprint is not None and stored_fingerprint == entity_fingerprint:
+                return Diff()
+
+        tracked_entity = await self._store.get(entity_key)
+
+        if tracked_entity:
+            return self._tracked_diff(entity, entity_dict, tracked_entity, entity_fingerprint, stored_fingerprint)
+
+    async def has_changes(self, entity):
+        """
+        Tells if the entity changed since it was tracked, without building the diff.
+        See Tracker.has_changes
+        """
+        state = self._dirty_state(entity)
+
+        if state is not None and not state[1]:
+            return False
+
+        entity, entity_key, entity_dict, entity_fingerprint = self._snapshot(entity)
+
+        if await self._is_tracked_unchanged(entity_key, entity_fingerprint):
+            return False
+
+        tracked_entity = await self._store.get(entity_key)
+
+        if tracked_entity is None:
+            return None
+
+        if state is not None:
+            entity_dict, tracked_entity = select_paths(entity_dict, tracked_entity, state[1])
+
+        if hasattr(self.comparator, 'has_changes'):
+            return self.comparator.has_changes(entity, tracked_entity, entity_dict=entity_dict)
+
+        return not self._tracked_diff(entity, entity_dict, tracked_entity).empty
+
+    async def log_changes(self, entity, created=False, deleted=False, **log_data):
+        """
+        Logs any existing changes between the current state of the entity and its tracked
+        snapshot. See Tracker.log_changes
+        """
+        state = self._dirty_state(entity)
+
+        if not created and not deleted and state is not None and not state[1]:
+            # untouched dirty trackable entities don't need to be converted
+            diff = Diff()
+            self._count_empty_diffs([diff])
+            await self.change_logger.log(entity, diff, **log_data)
+            return diff
+
+        snapshot = None if created or deleted else self._snapshot(entity)
+        return await self._log_snapshot_changes(entity, snapshot, created, deleted, log_data)
+
+    async def _log_snapshot_changes(self, entity, snapshot, created, deleted, log_data):
+        diff = None
+
+        if created:
+            diff = self.comparator.diff(entity, {})
+            await self.change_logger.log(entity, diff, created=created, **log_data)
+
+        elif deleted:
+            await self.change_logger.log(entity, None, deleted=deleted, **log_data)
+
+        else:
+            diff = await self._log_snapshot_diff(entity, snapshot, await self._snapshot_diff(snapshot), log_data)
+
+        return diff
+
+    async def _log_snapshot_diff(self, entity, snapshot, diff, log_data):
+        self._count_empty_diffs([diff])
+
+        if diff:
+            await self.change_logger.log(entity, diff, **log_data)
+
+            if not getattr(diff, 'empty', False):
+                # update the tracked entity with the latest state
+                await self._track_snapshot(snapshot, override=True)
+
+            else:
+                self._start_dirty_tracking(entity, snapshot[1])
+
+        return diff
+
+    async def log_changes_many(self, entities, created=False, deleted=False, **log_data):
+        """
+        Logs any existing changes of several entities at once. See Tracker.log_changes_many
+        """
+        entities = list(entities)
+        diffs = [None] * len(entities)
+        entries = []
+
+        if created:
+            for i, entity in enumerate(entities):
+                diffs[i] = self.comparator.diff(entity, {})
+                entries.append((entity, diffs[i], dict(log_data, created=created)))
+
+            await self._log_many(entries)
+
+        elif deleted:
+            entries = [(entity, None, dict(log_data, deleted=deleted)) for entity in entities]
+            await self._log_many(entries)
+
+        else:
+            diffs = await self._log_snapshots_changes(self._snapshots(entities), log_data)
+
+        return diffs
+
+    async def _log_snapshots_changes(self, snapshots, log_data):
+        return await self._log_snapshots_diffs(snapshots, await self._snapshots_diffs(snapshots), log_data)
+
+    async def _snapshots_diffs(self, snapshots):
+        diffs = [None] * len(snapshots)
+
+        unchanged, fingerprints = await self._unchanged_keys(snapshots)
+        tracked = await self._store_get_many([key for _, key, _, _ in snapshots if key not in unchanged])
+
+        changed = [i for i, (_, key, _, _) in enumerate(snapshots) if key not in unchanged and tracked.get(key)]
+        changed_diffs = self._tracked_diffs([
+            (snapshots[i][0], snapshots[i][2], tracked[snapshots[i][1]], snapshots[i][3],
+             fingerprints.get(snapshots[i][1]))
+            for i in changed
+        ])
+        changed_diffs = dict(zip(changed, changed_diffs))
+
+        for i, (_, key, _, _) in enumerate(snapshots):
+            if key in unchanged:
+                diffs[i] = Diff()
+            elif i in changed_diffs:
+                diffs[i] = changed_diffs[i]
+
+        return diffs
+
+    async def _log_snapshots_diffs(self, snapshots, diffs, log_data):
+        entries = []
+        updated = []
+
+        for (entity, key, entity_dict, entity_fingerprint), diff in zip(snapshots, diffs):
+            if diff is None:
+                continue
+
+            entries.append((entity, diff, dict(log_data)))
+
+            if not getattr(diff, 'empty', False):
+                updated.append(self._snapshot_item(key, entity_dict, entity_fingerprint))
+
+            self._start_dirty_tracking(entity, key)
+
+        self._count_empty_diffs(diffs)
+
+        # the change log and the snapshots are independent, write them concurrently
+        await asyncio.gather(
+            self._log_many(entries) if entries else _maybe_await(None),
+            self._store_save_many(updated) if updated else _maybe_await(None),
+        )
+
+        return diffs
+
+
+class AsyncTrackedEntityManager(AsyncTracker):
+
+    """
+    Asyncio version of the TrackedEntityManager. The entity manager methods can be either
+    coroutines or regular methods.
+
+    When saving, the changes are calculated concurrently with the entity manager's save, and
+    logged once the save succeeded. The entity state is captured before handing the entity
+    to the entity manager. Deletions are logged once the entity manager deleted the entities.
+    """
+
+    def __init__(self, entity_manager, comparator, change_logger, store=None, **tracker_kwargs):
+        """
+        Parameters:
+          - entity_manager (object): The entity manager the calls are passed to
+          - comparator, change_logger, store: See AsyncTracker
+          - tracker_kwargs: The other AsyncTracker arguments (merkle, large_value_size,
+                instrumentation, fingerprints)
+        """
+        self.manager = entity_manager
+        super(AsyncTrackedEntityManager, self).__init__(comparator, change_logger, store, **tracker_kwargs)
+
+    async def get_by_id(self, _id):
+        entity = await _maybe_await(self.manager.get_by_id(_id))
+        await self.track_entity(entity)
+        return entity
+
+    async def get_one(self, query):
+        entity = await _maybe_await(self.manager.get_one(query))
+        await self.track_entity(entity)
+        return entity
+
+    async def get_many(self, query):
+        entities = list(await _maybe_await(self.manager.get_many(query)))
+        await self.track_many(entities)
+        return entities
+
+    async def _manager_call(self, method, *args):
+        return await _maybe_await(getattr(self.manager, method)(*args))
+
+    async def save(self, entity, **log_data):
+        snapshot = self._snapshot(entity)
+
+        diff, saved_entity = await asyncio.gather(self._snapshot_diff(snapshot), self._manager_call('save', entity))
+        await self._log_snapshot_diff(entity, snapshot, diff, log_data)
+
+        return saved_entity
+
+    async def delete(self, entity, **log_data):
+        deleted_entity = await self._manager_call('delete', entity)
+        await self._log_snapshot_changes(entity, None, False, True, log_data)
+
+        return deleted_entity
+
+    async def save_many(self, entities, **log_data):
+        entities = list(entities)
+        snapshots = self._snapshots(entities)
+
+        if hasattr(self.manager, 'save_many'):
+            saving = self._manager_call('save_many', entities)
+        else:
+            saving = asyncio.gather(*[self._manager_call('save', entity) for entity in entities])
+
+        diffs, saved_entities = await asyncio.gather(self._snapshots_diffs(snapshots), saving)
+        await self._log_snapshots_diffs(snapshots, diffs, log_data)
+
+        return saved_entities
+
+    async def delete_many(self, entities, **log_data):
+        entities = list(entities)
+
+        if hasattr(self.manager, 'delete_many'):
+            deleted_entities = await self._manager_call('delete_many', entities)
+        else:
+            deleted_entities = await asyncio.gather(*[self._manager_call('delete', entity) for entity in entities])
+
+        await self.log_changes_many(entities, deleted=True, **log_data)
+
+        return deleted_entities
@@ -0,0 +1,143 @@
+import sys
+import time
+
+from collections import OrderedDict
+
+from .dict_store import DictStore
+
+
+def _estimate_size(value):
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, set, frozenset, tuple)):
+        size += sum(_estimate_size(e) for e in value)
+
+    return size
+
+
+class BoundedStore(DictStore):
+
+    """
+    An in-memory snapshot store with a bounded size. Snapshots are evicted in least
+    recently used order when the store exceeds its maximum number of entries or its
+    maximum estimated size in bytes, and expire once they are older than the ttl.
+
+    An evicted or expired snapshot is just not tracked anymore, the store behaves as if
+    it had never been saved.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, clock=None, **kwargs):
+        """
+        Parameters:
+          - max_entries (int, optional): Maximum number of snapshots to keep
+          - max_bytes (int, optional): Maximum estimated size in bytes of the kept snapshots
+          - ttl (float, optional): Seconds a snapshot is kept after being saved
+          - clock (callable, optional): Returns the current time in seconds. Defaults
+                to time.monotonic
+        """
+        super(BoundedStore, self).__init__(**kwargs)
+        self._data = OrderedDict()
+        self._expires_at = {}
+        self._sizes = {}
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock or time.monotonic
+
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def stats(self):
+        return dict(
+            entries=len(self._data),
+            size_bytes=self.size_bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
+
+    def _remove(self, key):
+        del self._data[key]
+        self._fingerprints.pop(key, None)
+        self._expires_at.pop(key, None)
+        self.size_bytes -= self._sizes.pop(key)
+
+    def _is_expired(self, key):
+        return self.ttl is not None and self._clock() >= self._expires_at[key]
+
+    def _lookup(self, key):
+        if key not in self._data:
+            return False
+
+        if self._is_expired(key):
+            self._remove(key)
+            self.expirations += 1
+            return False
+
+        self._data.move_to_end(key)
+        return True
+
+    def _evict(self):
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries) or
+            (self.max_bytes is not None and self.size_bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def has_key(self, key):
+        return self._lookup(key)
+
+    def get(self, key):
+        if self._lookup(key):
+            self.hits += 1
+            return self._data[key]
+
+        self.misses += 1
+
+    def get_many(self, keys):
+        snapshots = {}
+        for key in keys:
+            snapshot = self.get(key)
+            if snapshot is not None:
+                snapshots[key] = snapshot
+
+        return snapshots
+
+    def get_fingerprint(self, key):
+        return self._fingerprints.get(key) if self._lookup(key) else None
+
+    def get_fingerprints(self, keys):
+        fingerprints = {}
+        for key in keys:
+            fingerprint = self.get_fingerprint(key)
+            if fingerprint is not None:
+                fingerprints[key] = fingerprint
+
+        return fingerprints
+
+    def save(self, key, value, fingerprint=None):
+        if key in self._data:
+            self._remove(key)
+
+        super(BoundedStore, self).save(key, value, fingerprint=fingerprint)
+
+        if self.max_bytes is not None:
+            self._sizes[key] = _estimate_size(value)
+        else:
+            self._sizes[key] = 0
+
+        self.size_bytes += self._sizes[key]
+
+        if self.ttl is not None:
+            self._expires_at[key] = self._clock() + self.ttl
+
+        self._evict()
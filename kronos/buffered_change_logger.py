@@ -0,0 +1,333 @@
+import atexit
+import threading
+import time
+import weakref
+
+from collections import deque
+from datetime import datetime
+from functools import partial
+
+from .change_logger import ChangeLogger, EntityRef
+from .errors import KronosError
+from .memory_change_logger import entity_type_name
+
+
+class BufferedChangeLoggerError(KronosError):
+    pass
+
+
+class ChangeLoggerQueueFull(BufferedChangeLoggerError):
+    pass
+
+
+class ChangeLoggerWriteError(BufferedChangeLoggerError):
+    pass
+
+
+def _close_at_exit(logger_ref):
+    logger = logger_ref()
+
+    if logger is not None:
+        logger.close()
+
+
+class BufferedChangeLogger(ChangeLogger):
+
+    """
+    Wraps a change logger to write the change records from a background thread. Logging
+    a change just appends it to a bounded queue, and the background thread writes the
+    queued records in batches, either when there's a full batch or when the oldest queued
+    record has waited for `flush_interval` seconds.
+
+    Batches are written with the wrapped logger's `log_many` when available. A batch that
+    fails is retried, and its records are given up after `max_retries` failed retries, so
+    a batch the wrapped logger partially wrote can be written twice. `flush` and `close`
+    raise a ChangeLoggerWriteError when records were given up since the last check.
+    Queries (history, last_change, first_change) flush the queue before reaching the
+    wrapped logger.
+
+    The records keep the time they were logged at as their `created_at`, not the time
+    they were written. The wrapped logger gets it in the `created_at` argument.
+
+    The queue doesn't keep the logged entities: the wrapped logger gets an EntityRef with
+    their type name and id (from `entity_id`), which loggers read like an entity with an
+    `id` attribute. Loggers that need the entity itself, like the CheckpointChangeLogger,
+    should wrap the buffered logger instead.
+
+    Loggers that are still open at interpreter exit are closed then, writing their queued
+    records (the background thread is a daemon thread, so it wouldn't otherwise).
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    RAISE = 'raise'
+
+    def __init__(self, change_logger, max_queue_size=10000, batch_size=100, flush_interval=1.0,
+                 on_full=BLOCK, block_timeout=None, max_retries=3, retry_interval=0.1, clock=datetime.now,
+                 entity_id=None):
+        """
+        Parameters:
+          - change_logger (ChangeLogger): The logger the records are written to
+          - max_queue_size (int, optional): Maximum number of queued records
+          - batch_size (int, optional): Maximum number of records written at once
+          - flush_interval (float, optional): Maximum seconds a record waits in the queue
+          - on_full (str, optional): What to do when logging with a full queue. One of:
+                - block: wait until there's room in the queue (up to block_timeout seconds)
+                - drop_oldest: discard the oldest queued record
+                - raise: raise a ChangeLoggerQueueFull error, without queueing any of the
+                  logged records
+          - block_timeout (float, optional): Seconds to wait with the block policy before
+                raising a ChangeLoggerQueueFull error. Waits forever by default
+          - max_retries (int, optional): Times a failed batch is written again before giving
+                up its records
+          - retry_interval (float, optional): Seconds to wait before the first retry, doubled
+                on every following retry
+          - clock (callable, optional): Returns the creation time of the records
+          - entity_id (callable, optional): Returns the id of a logged entity. Defaults to
+                its `id` attribute
+        """
+        if on_full not in (self.BLOCK, self.DROP_OLDEST, self.RAISE):
+            raise BufferedChangeLoggerError("Unknown queue full policy '{}'".format(on_full))
+
+        self.change_logger = change_logger
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._entity_id = entity_id or (lambda entity: getattr(entity, 'id', None))
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._flush_requests = 0
+        self._closed = False
+
+        self.logged = 0
+        self.dropped = 0
+        self.failed = 0
+        self._unreported_failures = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+        self._worker = threading.Thread(target=self._run, name='kronos-buffered-change-logger')
+        self._worker.daemon = True
+        self._worker.start()
+
+        # the exit hook only keeps a weak reference to the logger
+        self._exit_hook = partial(_close_at_exit, weakref.ref(self))
+        atexit.register(self._exit_hook)
+
+    @property
+    def stats(self):
+        with self._condition:
+            return dict(
+                queue_depth=len(self._queue),
+                in_flight=self._in_flight,
+                logged=self.logged,
+                dropped=self.dropped,
+                failed=self.failed,
+                batches=self.batches,
+                errors=self.errors,
+                last_flush_latency=self.last_flush_latency,
+                max_flush_latency=self.max_flush_latency,
+                avg_flush_latency=self.total_flush_latency / self.batches if self.batches else 0.0,
+            )
+
+    def _enqueue(self, entries):
+        with self._condition:
+            if self._closed:
+                raise BufferedChangeLoggerError("The change logger is closed")
+
+            if self.on_full == self.RAISE and len(self._queue) + len(entries) > self.max_queue_size:
+                raise ChangeLoggerQueueFull("The change logger queue is full")
+
+            for entry in entries:
+                if len(self._queue) >= self.max_queue_size:
+                    self._make_room()
+
+                self._queue.append((time.monotonic(), entry))
+
+            self._condition.notify_all()
+
+    def _make_room(self):
+        if self.on_full == self.DROP_OLDEST:
+            self._queue.popleft()
+            self.dropped += 1
+
+        elif self.on_full == self.RAISE:
+            raise ChangeLoggerQueueFull("The change logger queue is full")
+
+        else:
+            self._condition.notify_all()
+            has_room = self._condition.wait_for(
+                lambda: len(self._queue) < self.max_queue_size or self._closed, self.block_timeout
+            )
+
+            if not has_room:
+                raise ChangeLoggerQueueFull("Timed out waiting for room in the change logger queue")
+
+            if self._closed:
+                raise BufferedChangeLoggerError("The change logger is closed")
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._queue:
+                    wait = self._queue[0][0] + self.flush_interval - time.monotonic()
+
+                    if len(self._queue) >= self.batch_size or self._flush_requests or self._closed or wait <= 0:
+                        break
+
+                    self._condition.wait(wait)
+
+                elif self._closed:
+                    return None
+
+                else:
+                    self._condition.wait()
+
+            size = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft()[1] for _ in range(size)]
+            self._in_flight = size
+            self._condition.notify_all()
+
+            return batch
+
+    def _write(self, batch):
+        if hasattr(self.change_logger, 'log_many'):
+            self.change_logger.log_many(batch)
+
+        else:
+            for entity_type, changes, kwargs in batch:
+                self.change_logger.log(entity_type, changes, **kwargs)
+
+    def _write_with_retries(self, batch):
+        """
+        Writes a batch, retrying it when it fails. Returns True if it was written
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_interval * 2 ** (attempt - 1))
+
+            try:
+                self._write(batch)
+                return True
+            except Exception as e:
+                with self._condition:
+                    self.errors += 1
+                    self.last_error = e
+
+        return False
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            if batch is None:
+                return
+
+            started = time.monotonic()
+            written = self._write_with_retries(batch)
+            latency = time.monotonic() - started
+
+            with self._condition:
+                if written:
+                    self.logged += len(batch)
+                else:
+                    self.failed += len(batch)
+                    self._unreported_failures += len(batch)
+
+                self.batches += 1
+                self.last_flush_latency = latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+                self.total_flush_latency += latency
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _entity_ref(self, entity):
+        if isinstance(entity, (str, type)):
+            return entity
+
+        return EntityRef(entity_type_name(entity), self._entity_id(entity))
+
+    def log(self, entity_type, changes, **kwargs):
+        self._enqueue([(self._entity_ref(entity_type), changes, dict(kwargs, created_at=self._clock()))])
+
+    def log_many(self, entries):
+        created_at = self._clock()
+        self._enqueue([
+            (self._entity_ref(entity_type), changes, dict(kwargs, created_at=created_at))
+            for entity_type, changes, kwargs in entries
+        ])
+
+    def _check_failures(self):
+        with self._condition:
+            failures, self._unreported_failures = self._unreported_failures, 0
+
+        if failures:
+            raise ChangeLoggerWriteError(
+                "{} change records could not be written: {!r}".format(failures, self.last_error)
+            )
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued record has been written
+
+        Parameters:
+          - timeout (float, optional): Maximum seconds to wait
+
+        Returns:
+          True if the queue was flushed, False if the timeout expired
+
+        Raises:
+          ChangeLoggerWriteError: If records were given up since the last flush or close
+        """
+        flushed = self._wait_flushed(timeout)
+        self._check_failures()
+        return flushed
+
+    def _wait_flushed(self, timeout=None):
+        with self._condition:
+            self._flush_requests += 1
+            self._condition.notify_all()
+
+            try:
+                return self._condition.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+            finally:
+                self._flush_requests -= 1
+
+    def close(self, timeout=None):
+        """
+        Writes the queued records and stops the background thread. No more records can be
+        logged after closing
+
+        Raises:
+          ChangeLoggerWriteError: If records were given up since the last flush or close
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        atexit.unregister(self._exit_hook)
+        self._worker.join(timeout)
+        self._check_failures()
+
+    def last_change(self, entity_type):
+        self._wait_flushed()
+        return self.change_logger.last_change(entity_type)
+
+    def first_change(self, entity_type):
+        self._wait_flushed()
+        return self.change_logger.first_change(entity_type)
+
+    def history(self, entity_type, *args, **kwargs):
+        self._wait_flushed()
+        return self.change_logger.history(entity_type, *args, **kwargs)
@@ -1,11 +1,36 @@
 
 
 
+class EntityRef(object):
+
+    """
+    Stands for a logged entity by its type name and id, for the change records written
+    after the call that logged them, when the entity could have changed or be gone
+    """
+
+    __slots__ = ('type_name', 'id')
+
+    def __init__(self, type_name, id):
+        self.type_name = type_name
+        self.id = id
+
+    def __repr__(self):
+        return 'EntityRef({!r}, {!r})'.format(self.type_name, self.id)
+
+
 class ChangeLogger:
 
     def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
         raise NotImplementedError
 
+    def log_many(self, entries):
+        """
+        Logs several changes at once. Each entry is an (entity_type, changes, kwargs) tuple,
+        where kwargs are the extra arguments for `log`. Override it to batch the writes
+        """
+        for entity_type, changes, kwargs in entries:
+            self.log(entity_type, changes, **kwargs)
+
     def last_change(self, entity_type):
         raise NotImplementedError
 
@@ -15,3 +40,26 @@ class ChangeLogger:
     def history(self, entity_type, limit=None, date_from=None, date_to=None, asc=False, desc=True):
         raise NotImplementedError
 
+
+
+class AsyncChangeLogger:
+
+    async def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
+        raise NotImplementedError
+
+    async def log_many(self, entries):
+        """
+        Logs several changes at once. Each entry is an (entity_type, changes, kwargs) tuple,
+        where kwargs are the extra arguments for `log`. Override it to batch the writes
+        """
+        for entity_type, changes, kwargs in entries:
+            await self.log(entity_type, changes, **kwargs)
+
+    async def last_change(self, entity_type):
+        raise NotImplementedError
+
+    async def first_change(self, entity_type):
+        raise NotImplementedError
+
+    async def history(self, entity_type, limit=None, date_from=None, date_to=None, asc=False, desc=True):
+        raise NotImplementedError
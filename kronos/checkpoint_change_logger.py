@@ -0,0 +1,173 @@
+from collections import Counter
+
+from .change_logger import ChangeLogger
+from .memory_change_logger import entity_type_name
+from .patch import Patcher
+from .utils import snapshot_copy
+
+
+class CheckpointChangeLogger(ChangeLogger):
+
+    """
+    Wraps a change logger to save the full state of the entities along with every
+    `every` changes of an entity, in the `checkpoint` field of the change record.
+    `state_at` rebuilds the state of an entity at any time from the closest checkpoint,
+    applying the changes logged after it or reverting the ones logged before it, so its
+    cost depends on the distance to a checkpoint and not on the length of the history.
+
+    The wrapped logger should return change records as dicts, like the MemoryChangeLogger,
+    and support the `entity_id` argument in `history`.
+
+    The number of changes since the last checkpoint is read from the log the first time an
+    entity is logged, and counted in memory after that, so the checkpoints are kept across
+    restarts. Several processes logging changes of the same entity count them separately,
+    so the distance between its checkpoints can exceed `every`.
+    """
+
+    def __init__(self, change_logger, comparator, every=100, patcher=None, entity_id=None):
+        """
+        Parameters:
+          - change_logger (ChangeLogger): The logger the records are written to
+          - comparator (object): Converts the entities to dict, like the Tracker's comparator
+          - every (int, optional): Number of changes of an entity between checkpoints
+          - patcher (Patcher, optional): Applies the diffs. Use one with the DiffHelper
+                that calculated them
+          - entity_id (callable, optional): Returns the id of a logged entity, the same
+                the wrapped logger uses. Defaults to its `id` attribute
+        """
+        self.change_logger = change_logger
+        self.comparator = comparator
+        self.every = every
+        self.patcher = patcher or Patcher()
+
+        self._entity_id = entity_id or (lambda entity: getattr(entity, 'id', None))
+        self._counts = Counter()
+
+    def _checkpoint(self, entity, changes, kwargs):
+        if kwargs.get('deleted') or changes is None:
+            return kwargs
+
+        key = (entity_type_name(entity), self._entity_id(entity))
+
+        # created records have the full state in their diff
+        if kwargs.get('created'):
+            self._counts[key] = 0
+            return kwargs
+
+        if key not in self._counts:
+            self._counts[key] = self._logged_since_checkpoint(*key)
+
+        self._counts[key] += 1
+
+        if self._counts[key] >= self.every:
+            self._counts[key] = 0
+            return dict(kwargs, checkpoint=snapshot_copy(self.comparator.entity_to_dict(entity)))
+
+        return kwargs
+
+    def _logged_since_checkpoint(self, entity_type, entity_id):
+        """
+        Counts the records of an entity logged after its last checkpoint, up to `every`
+        """
+        records = self.change_logger.history(entity_type, limit=self.every, entity_id=entity_id)
+
+        return next((i for i, record in enumerate(records) if self._is_full_state(record)), len(records))
+
+    def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
+        kwargs = self._checkpoint(entity_type, changes, dict(kwargs, created=created, deleted=deleted))
+        self.change_logger.log(entity_type, changes, **kwargs)
+
+    def log_many(self, entries):
+        entries = [
+            (entity_type, changes, self._checkpoint(entity_type, changes, dict(kwargs)))
+            for entity_type, changes, kwargs in entries
+        ]
+
+        if hasattr(self.change_logger, 'log_many'):
+            self.change_logger.log_many(entries)
+        else:
+            for entity_type, changes, kwargs in entries:
+                self.change_logger.log(entity_type, changes, **kwargs)
+
+    def last_change(self, entity_type, *args, **kwargs):
+        return self.change_logger.last_change(entity_type, *args, **kwargs)
+
+    def first_change(self, entity_type, *args, **kwargs):
+        return self.change_logger.first_change(entity_type, *args, **kwargs)
+
+    def history(self, entity_type, *args, **kwargs):
+        return self.change_logger.history(entity_type, *args, **kwargs)
+
+    def _records(self, entity_type, entity_id, **kwargs):
+        """
+        Returns the records up to the closest checkpoint (or created record) included. If
+        there's none in the first `every` records, reads the whole range
+        """
+        records = self.change_logger.history(entity_type, limit=self.every, entity_id=entity_id, **kwargs)
+
+        if len(records) == self.every and not any(self._is_full_state(r) for r in records):
+            records = self.change_logger.history(entity_type, entity_id=entity_id, **kwargs)
+
+        for i, record in enumerate(records):
+            if self._is_full_state(record):
+                return records[:i + 1], True
+
+        return records, False
+
+    def _is_full_state(self, record):
+        return record.get('checkpoint') is not None or record.get('created') or record.get('deleted')
+
+    def _full_state(self, record):
+        if record.get('deleted'):
+            return None
+
+        if record.get('checkpoint') is not None:
+            return snapshot_copy(record['checkpoint'])
+
+        return self.patcher.apply({}, record['changes'])
+
+    def state_at(self, entity_type, entity_id, at):
+        """
+        Rebuilds the state of an entity with the changes logged before a time
+
+        Parameters:
+          - entity_type (type or str): The entity class or class name
+          - entity_id (object): The entity id
+          - at (datetime): The time
+
+        Returns:
+          The entity dict, or None if the entity didn't exist or was deleted at that time
+        """
+        before, before_found = self._records(entity_type, entity_id, date_to=at)
+        after, after_found = self._records(entity_type, entity_id, date_from=at, asc=True)
+
+        if not before:
+            return None
+
+        after_found = after_found and after[-1].get('checkpoint') is not None
+
+        if after_found and (not before_found or len(after) < len(before)):
+            # revert the changes logged after the time from the next checkpoint
+            state = snapshot_copy(after[-1]['checkpoint'])
+
+            for record in reversed(after):
+                if record['changes'] is not None:
+                    state = self.patcher.revert(state, record['changes'])
+
+            return state
+
+        if not before_found:
+            # a history without checkpoints, replay it from the beginning
+            state = {}
+        else:
+            state = self._full_state(before[-1])
+            before = before[:-1]
+
+            if state is None:
+                return None
+
+        for record in reversed(before):
+            if record['changes'] is not None:
+                state = self.patcher.apply(state, record['changes'])
+
+        return state
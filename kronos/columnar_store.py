@@ -0,0 +1,268 @@
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .errors import KronosError
+
+
+class ColumnarStoreError(KronosError):
+    pass
+
+
+_MISSING = object()
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _column_dtype(value):
+    if type(value) is bool:
+        return np.bool_
+    if type(value) is int and _INT64_MIN <= value <= _INT64_MAX:
+        return np.int64
+    if type(value) is float:
+        return np.float64
+
+    return object
+
+
+def _python_type(dtype):
+    return {np.bool_: bool, np.int64: int, np.float64: float}.get(dtype)
+
+
+def _object_array(values):
+    # Filling element by element, so lists and dicts are kept as single items
+    arr = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        arr[i] = v
+    return arr
+
+
+def _key_entity_type(key):
+    return key.split('-', 1)[0]
+
+
+class _Column(object):
+
+    def __init__(self, dtype, capacity):
+        self.dtype = dtype
+        self.values = np.zeros(capacity, dtype=dtype) if dtype is not object else np.empty(capacity, dtype=object)
+        self.present = np.zeros(capacity, dtype=np.bool_)
+
+    def resize(self, capacity):
+        values = np.zeros(capacity, dtype=self.values.dtype) if self.dtype is not object \
+            else np.empty(capacity, dtype=object)
+        values[:len(self.values)] = self.values
+        present = np.zeros(capacity, dtype=np.bool_)
+        present[:len(self.present)] = self.present
+
+        self.values, self.present = values, present
+
+    def accepts(self, value):
+        return self.dtype is object or type(value) is _python_type(self.dtype) and \
+            _column_dtype(value) is self.dtype
+
+    def to_object(self):
+        self.values = _object_array(self.values.tolist())
+        self.dtype = object
+
+    def set(self, row, value):
+        if value is _MISSING:
+            self.present[row] = False
+            if self.dtype is object:
+                self.values[row] = None
+            return
+
+        if not self.accepts(value):
+            self.to_object()
+
+        self.values[row] = value
+        self.present[row] = True
+
+    def get(self, row):
+        value = self.values[row]
+        return value if self.dtype is object else value.item()
+
+    def batch(self, values):
+        """
+        Builds an array comparable with this column from a list of values. Typed columns
+        are only used when every value has the column type, otherwise objects are compared
+        """
+        py_type = _python_type(self.dtype)
+
+        if py_type is not None and all(v is _MISSING or type(v) is py_type for v in values):
+            try:
+                return np.array([0 if v is _MISSING else v for v in values], dtype=self.dtype), self.values
+            except OverflowError:
+                pass
+
+        stored = self.values if self.dtype is object else _object_array(self.values.tolist())
+        return _object_array([None if v is _MISSING else v for v in values]), stored
+
+
+class _Table(object):
+
+    def __init__(self, capacity):
+        self.columns = OrderedDict()
+        self.index = {}
+        self.size = 0
+        self.capacity = capacity
+
+    def _grow(self):
+        self.capacity *= 2
+        for column in self.columns.values():
+            column.resize(self.capacity)
+
+    def _column(self, field, value):
+        column = self.columns.get(field)
+
+        if column is None:
+            column = self.columns[field] = _Column(_column_dtype(value), self.capacity)
+
+        return column
+
+    def save(self, key, value):
+        row = self.index.get(key)
+
+        if row is None:
+            if self.size == self.capacity:
+                self._grow()
+
+            row = self.index[key] = self.size
+            self.size += 1
+
+        for field, column in self.columns.items():
+            if field not in value:
+                column.set(row, _MISSING)
+
+        for field, v in value.items():
+            self._column(field, v).set(row, v)
+
+    def get(self, key):
+        row = self.index.get(key)
+
+        if row is None:
+            return None
+
+        return {field: column.get(row) for field, column in self.columns.items() if column.present[row]}
+
+    def changes(self, items):
+        keys = [key for key, _ in items]
+        rows = np.array([self.index[key] for key in keys], dtype=np.int64)
+        changed = {key: set() for key in keys}
+
+        fields = OrderedDict((f, None) for f in self.columns)
+        for _, value in items:
+            fields.update((f, None) for f in value if f not in fields)
+
+        for field in fields:
+            values = [value.get(field, _MISSING) for _, value in items]
+            batch_present = np.array([v is not _MISSING for v in values], dtype=np.bool_)
+            column = self.columns.get(field)
+
+            if column is None:
+                field_changed = batch_present
+
+            else:
+                batch, stored = column.batch(values)
+                stored_present = column.present[rows]
+                field_changed = np.where(
+                    stored_present & batch_present,
+                    stored[rows] != batch,
+                    stored_present != batch_present
+                )
+
+            for i in np.flatnonzero(field_changed):
+                changed[keys[i]].add(field)
+
+        return changed
+
+
+class ColumnarStore(object):
+
+    """
+    A snapshot store that keeps the snapshots of each entity type column-wise, with one
+    NumPy array per field and a key to row index, instead of a dict per snapshot. Integer,
+    float and boolean fields are kept in typed arrays, everything else in object arrays.
+
+    Besides the store interface, it implements `changes` to detect which snapshots changed
+    over a batch of entities comparing whole columns at once, so only the changed ones need
+    a detailed diff.
+
+    Requires numpy to be installed.
+    """
+
+    def __init__(self, entity_type_of_key=None, initial_capacity=1024, **kwargs):
+        """
+        Parameters:
+          - entity_type_of_key (callable, optional): Returns the entity type of a key, used
+                to group the snapshots in tables. Defaults to the prefix of the keys built
+                by the Tracker (`<EntityClass>-<id>`)
+          - initial_capacity (int, optional): Initial number of rows allocated per table
+        """
+        if np is None:
+            raise ColumnarStoreError("ColumnarStore requires numpy to be installed")
+
+        self._tables = {}
+        self._entity_type_of_key = entity_type_of_key or _key_entity_type
+        self._initial_capacity = initial_capacity
+
+    def _table(self, key, create=False):
+        entity_type = self._entity_type_of_key(key)
+        table = self._tables.get(entity_type)
+
+        if table is None and create:
+            table = self._tables[entity_type] = _Table(self._initial_capacity)
+
+        return table
+
+    def has_key(self, key):
+        table = self._table(key)
+        return table is not None and key in table.index
+
+    def get(self, key):
+        table = self._table(key)
+        return table.get(key) if table is not None else None
+
+    def get_many(self, keys):
+        snapshots = {}
+        for key in keys:
+            snapshot = self.get(key)
+            if snapshot is not None:
+                snapshots[key] = snapshot
+
+        return snapshots
+
+    def save(self, key, value):
+        self._table(key, create=True).save(key, value)
+
+    def save_many(self, items):
+        for key, value in items:
+            self.save(key, value)
+
+    def changes(self, items):
+        """
+        Detects which of the given entities changed compared to their snapshots
+
+        Parameters:
+          - items (iterable): (key, entity_dict) pairs with the current state of the entities
+
+        Returns:
+          A dict with the set of changed fields of every tracked key (empty when the entity
+          didn't change). Keys without a snapshot are left out
+        """
+        tables = OrderedDict()
+
+        for key, value in items:
+            table = self._table(key)
+
+            if table is not None and key in table.index:
+                tables.setdefault(id(table), (table, []))[1].append((key, value))
+
+        changed = {}
+        for table, table_items in tables.values():
+            changed.update(table.changes(table_items))
+
+        return changed
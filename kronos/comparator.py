@@ -1,73 +1,311 @@
 from collections import OrderedDict
 
+try:
+    import dataclasses
+except ImportError:
+    dataclasses = None
+
 from .errors import KronosError
 from .diff import DiffHelper
+from .field_rules import FieldRules, parse_path
 
 
 class EntityComparatorError(KronosError):
     pass
 
 
+def _slots_fields(cls):
+    fields = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+
+        fields.extend(s for s in slots if s not in ('__dict__', '__weakref__') and s not in fields)
+
+    return fields
+
+
+def _getattrs(names):
+    def convert(entity):
+        return {name: getattr(entity, name) for name in names if hasattr(entity, name)}
+    return convert
+
+
 class EntityComparator(object):
 
-    def __init__(self, comparators=None, diff_helper=None):
+    def __init__(self, comparators=None, diff_helper=None, fields=None):
+        """
+        Parameters:
+          - comparators (list, optional): Custom comparators for specific entity types. A
+                comparator has an `entity_type` (class or class name) and implements
+                `entity_to_dict` and/or `diff`. Comparators also apply to subclasses
+          - diff_helper (object, optional): The object used to calculate the diffs. Defaults
+                to a DiffHelper
+          - fields (dict, optional): Entity class to dict(include=[...], exclude=[...], ...)
+                with the fields to convert, see `register_fields`
+        """
         self._comparators = comparators or []
         self._diff_helper = diff_helper or DiffHelper()
+        self._fields = {}
 
-    def _comparator_for_entity(self, entity):
+        self._comparators_by_type = {}
         for comp in self._comparators:
-            if comp.entity_type in (entity.__class__.__name__, entity.__class__):
-                return comp
+            self._comparators_by_type.setdefault(comp.entity_type, comp)
 
-    def entity_id(self, entity):
-        return getattr(entity, 'id', None)
+        self._comparator_cache = {}
+        self._converters = {}
 
-    def entity_to_dict(self, entity, use_dict=False):
-        comp = self._comparator_for_entity(entity)
+        # number of entities converted to dict
+        self.conversions = 0
 
-        if isinstance(entity, dict):
-            d = entity
+        for entity_class, entity_fields in (fields or {}).items():
+            self.register_fields(entity_class, **entity_fields)
 
-        elif comp:
-            d = comp.entity_to_dict(entity)
+    def register_fields(self, entity_class, include=None, exclude=None, max_depth=None, max_list_size=None):
+        """
+        Sets which fields of an entity class are converted to dict. Useful for classes
+        without to_dict/as_dict methods, or to leave fields out of the snapshots and the
+        diffs. Fields can be given as paths, like `address.*` or `items[].price` (see
+        kronos.field_rules)
 
-        elif hasattr(entity, 'to_dict'):
-            d = entity.to_dict()
+        Parameters:
+          - entity_class (type): The entity class, also applies to its subclasses
+          - include (list, optional): The attributes or field paths to convert
+          - exclude (list, optional): The fields or field paths to leave out of the
+                converted dict
+          - max_depth (int, optional): Depth from which nested dicts and lists are compared
+                by fingerprint
+          - max_list_size (int, optional): Size from which lists are compared by fingerprint
+        """
+        attributes, nested_include = None, False
 
-        elif hasattr(entity, 'as_dict'):
-            d = entity.as_dict()
+        if include is not None:
+            paths = [parse_path(p) for p in include]
+            names = [path[0] for path in paths]
 
-        elif use_dict:
-            d = entity.__dict__
-            for k, v in d.items():
-                if hasattr(v, '__dict__'):
-                    d['k'] = self.entity_to_dict(v, use_dict=use_dict)
+            if '*' not in names:
+                attributes = tuple(OrderedDict.fromkeys(names))
 
-        else:
+            nested_include = attributes is None or any(len(path) > 1 for path in paths)
+
+        rules = None
+        if nested_include or exclude or max_depth is not None or max_list_size is not None:
+            rules = FieldRules(include if nested_include else None, exclude, max_depth, max_list_size)
+
+        self._fields[entity_class] = (attributes, rules)
+        self._converters.clear()
+
+    def _comparator_for_class(self, entity_class):
+        try:
+            return self._comparator_cache[entity_class]
+        except KeyError:
+            pass
+
+        comp = None
+        for klass in entity_class.__mro__:
+            comp = self._comparators_by_type.get(klass) or self._comparators_by_type.get(klass.__name__)
+            if comp:
+                break
+
+        self._comparator_cache[entity_class] = comp
+        return comp
+
+    def _comparator_for_entity(self, entity):
+        return self._comparator_for_class(entity.__class__)
+
+    def _fields_for_class(self, entity_class):
+        for klass in entity_class.__mro__:
+            if klass in self._fields:
+                return self._fields[klass]
+
+        return None, None
+
+    def _converter(self, entity_class, use_dict):
+        """
+        Resolves how to convert the instances of a class to dict. Resolved once per class
+        """
+        key = (entity_class, use_dict)
+
+        try:
+            return self._converters[key]
+        except KeyError:
+            pass
+
+        converter = self._build_converter(entity_class, use_dict)
+        _, rules = self._fields_for_class(entity_class)
+
+        if rules is not None:
+            base_converter = converter
+
+            def converter(entity):
+                return rules.apply(base_converter(entity))
+
+        self._converters[key] = converter
+        return converter
+
+    def _build_converter(self, entity_class, use_dict):
+        comp = self._comparator_for_class(entity_class)
+        include, rules = self._fields_for_class(entity_class)
+
+        if issubclass(entity_class, dict):
+            return lambda entity: entity
+
+        elif comp and hasattr(comp, 'entity_to_dict'):
+            return comp.entity_to_dict
+
+        elif include is not None:
+            return _getattrs(include)
+
+        elif hasattr(entity_class, 'to_dict'):
+            return lambda entity: entity.to_dict()
+
+        elif hasattr(entity_class, 'as_dict'):
+            return lambda entity: entity.as_dict()
+
+        elif dataclasses and dataclasses.is_dataclass(entity_class):
+            return _getattrs([f.name for f in dataclasses.fields(entity_class)])
+
+        elif issubclass(entity_class, tuple) and hasattr(entity_class, '_fields'):
+            return lambda entity: entity._asdict()
+
+        elif use_dict or rules is not None:
+            slots = _slots_fields(entity_class)
+            get_slots = _getattrs(slots)
+
+            def convert(entity):
+                d = dict(getattr(entity, '__dict__', {}))
+                if slots:
+                    d.update(get_slots(entity))
+
+                if use_dict:
+                    for k, v in d.items():
+                        if hasattr(v, '__dict__'):
+                            d[k] = self.entity_to_dict(v, use_dict=use_dict)
+
+                return d
+
+            return convert
+
+        def cant_convert(entity):
             raise EntityComparatorError(
                 "Could't convert entity to dict. Entity '{}' should implement " \
                 "at least one of to_dict/as_dict methods".format(entity.__class__.__name__)
             )
 
-        return OrderedDict(d)
+        return cant_convert
+
+    def entity_id(self, entity):
+        return getattr(entity, 'id', None)
+
+    def entity_to_dict(self, entity, use_dict=False):
+        self.conversions += 1
+        return OrderedDict(self._converter(entity.__class__, use_dict)(entity))
 
     def diff(self, entity, old_entity, **kwargs):
-        new_entity = entity
+        """
+        Calculates the diff between an entity and its old state
+
+        Parameters:
+          - entity (object): The entity or its dict
+          - old_entity (object): The old entity or its dict
+          - entity_dict (dict, optional): The entity already converted to dict. Saves
+                converting it again when the entity is also needed to find its comparator
+          - metadata (dict, optional): Extra data for the Diff
+          - trees (tuple, optional): The (new, old) hash trees of the entity dicts (see
+                kronos.utils.hash_tree), used to skip the unchanged nested dicts and lists
+        """
+        new_entity = kwargs.get('entity_dict', entity)
 
-        if not isinstance(entity, dict):
+        if not isinstance(new_entity, dict):
             new_entity = self.entity_to_dict(entity)
 
         if not isinstance(old_entity, dict):
             old_entity = self.entity_to_dict(old_entity)
 
-
         comp = self._comparator_for_entity(entity)
+        trees = kwargs.get('trees')
 
         if comp and hasattr(comp, "diff"):
             _diff = comp.diff(new_entity, old_entity, **kwargs.get('metadata', {}))
 
+        elif trees is not None and hasattr(self._diff_helper, 'tree_diff'):
+            _diff = self._diff_helper.tree_diff(new_entity, old_entity, *trees, **kwargs.get('metadata', {}))
+
         else:
             _diff = self._diff_helper.diff(new_entity, old_entity, **kwargs.get('metadata', {}))
 
         return _diff
 
+    def diff_many(self, items, **kwargs):
+        """
+        Calculates the diffs of several entities at once, with the diff helper's `diff_many`
+        when available (see ParallelDiffHelper)
+
+        Parameters:
+          - items (list): (entity, old_entity) or (entity, old_entity, entity_dict) tuples
+          - metadata (dict, optional): Extra data for the Diffs
+
+        Returns:
+          The list of diffs, in the same order as the items
+        """
+        metadata = kwargs.get('metadata', {})
+        diffs = [None] * len(items)
+        pairs, positions = [], []
+
+        for i, item in enumerate(items):
+            entity, old_entity = item[0], item[1]
+            entity_dict = item[2] if len(item) > 2 else entity
+
+            comp = self._comparator_for_entity(entity)
+
+            if comp and hasattr(comp, "diff"):
+                diffs[i] = self.diff(entity, old_entity, entity_dict=entity_dict, metadata=metadata)
+                continue
+
+            if not isinstance(entity_dict, dict):
+                entity_dict = self.entity_to_dict(entity)
+
+            if not isinstance(old_entity, dict):
+                old_entity = self.entity_to_dict(old_entity)
+
+            pairs.append((entity_dict, old_entity))
+            positions.append(i)
+
+        if hasattr(self._diff_helper, 'diff_many'):
+            pair_diffs = self._diff_helper.diff_many(pairs, **metadata)
+        else:
+            pair_diffs = [self._diff_helper.diff(new, old, **metadata) for new, old in pairs]
+
+        for i, diff in zip(positions, pair_diffs):
+            diffs[i] = diff
+
+        return diffs
+
+    def has_changes(self, entity, old_entity, **kwargs):
+        """
+        Tells if an entity changed from its old state, stopping at the first change when
+        the diff helper supports it
+
+        Parameters:
+          - entity (object): The entity or its dict
+          - old_entity (object): The old entity or its dict
+          - entity_dict (dict, optional): The entity already converted to dict
+        """
+        new_entity = kwargs.get('entity_dict', entity)
+
+        if not isinstance(new_entity, dict):
+            new_entity = self.entity_to_dict(entity)
+
+        if not isinstance(old_entity, dict):
+            old_entity = self.entity_to_dict(old_entity)
+
+        comp = self._comparator_for_entity(entity)
+
+        if comp and hasattr(comp, "diff"):
+            return not comp.diff(new_entity, old_entity).empty
+
+        if hasattr(self._diff_helper, 'has_changes'):
+            return self._diff_helper.has_changes(new_entity, old_entity)
+
+        return not self._diff_helper.diff(new_entity, old_entity).empty
@@ -4,13 +4,30 @@ class DictStore:
 
     def __init__(self, **kwargs):
         self._data = {}
+        self._fingerprints = {}
 
     def has_key(self, key):
         return key in self._data
 
     def get(self, key):
         return self._data.get(key)
-        
-    def save(self, key, value):
+
+    def get_many(self, keys):
+        return {k: self._data[k] for k in keys if k in self._data}
+
+    def get_fingerprint(self, key):
+        return self._fingerprints.get(key)
+
+    def get_fingerprints(self, keys):
+        return {k: self._fingerprints[k] for k in keys if self._fingerprints.get(k) is not None}
+
+    def save(self, key, value, fingerprint=None):
         self._data[key] = value
+        self._fingerprints[key] = fingerprint
 
+    def save_many(self, items):
+        """
+        Saves several snapshots at once. Items are (key, value) or (key, value, fingerprint) tuples
+        """
+        for item in items:
+            self.save(*item)
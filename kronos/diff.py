@@ -1,4 +1,10 @@
-from .utils import serializable_dict
+import threading
+
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+
+from .instrumentation import NULL_INSTRUMENTATION
+from .utils import ValueDigest, fingerprint, is_large_value, value_digest
 
 
 class Change(object):
@@ -10,7 +16,12 @@ class Change(object):
         self.metadata = kwargs or {}
 
     def __repr__(self):
-        return serializable_dict(self.__dict__)
+        fields = 'key={!r}, value={!r}, old_value={!r}'.format(self.key, self.value, self.old_value)
+
+        if self.metadata:
+            fields += ', metadata={!r}'.format(self.metadata)
+
+        return 'Change({})'.format(fields)
 
 
 class Diff(object):
@@ -26,9 +37,165 @@ class Diff(object):
     def empty(self):
         return not any([self.added, self.deleted, self.updated])
 
+    def __repr__(self):
+        return 'Diff(field_name={!r}, added={!r}, deleted={!r}, updated={!r})'.format(
+            self.field_name, self.added, self.deleted, self.updated
+        )
+
+
+# Key of the list elements without identity, matched by their content
+_ContentKey = namedtuple('_ContentKey', ['fingerprint', 'occurrence'])
+
+
+def _content_fingerprint(value):
+    try:
+        return fingerprint(value)
+    except TypeError:
+        return None
+
+
+ADDED = 'added'
+DELETED = 'deleted'
+UPDATED = 'updated'
+MOVED = 'moved'
+
+# A change yielded by DiffHelper.iter_changes. The path has the field names from the
+# entity root, and the keys of the list elements. For moved list elements, the path ends
+# with the new index and old_value is the old index
+PathChange = namedtuple('PathChange', ['op', 'path', 'value', 'old_value'])
+
+
+def _element_value(element, name):
+    if isinstance(element, dict):
+        return element.get(name)
+
+    return getattr(element, name, None)
+
+
+def _multiset_difference(items, other):
+    """
+    Returns the items that are not in other, in order. Duplicates are counted, so an item
+    that appears twice in items and once in other is returned once. Unhashable items are
+    compared by equality
+    """
+    remaining = Counter()
+    unhashable = []
+
+    for e in other:
+        try:
+            remaining[e] += 1
+        except TypeError:
+            unhashable.append(e)
+
+    missing = []
+    for e in items:
+        try:
+            if remaining[e]:
+                remaining[e] -= 1
+                continue
+        except TypeError:
+            if e in unhashable:
+                unhashable.remove(e)
+                continue
+
+        missing.append(e)
+
+    return missing
+
+
+def _count_changes(diff):
+    return len(diff.added) + len(diff.deleted) + sum(
+        _count_changes(change) if isinstance(change, Diff) else 1 for change in diff.updated
+    )
+
+
+def _longest_increasing_subsequence(values):
+    """
+    Returns the positions of a longest strictly increasing subsequence of values
+    """
+    tails, tails_positions = [], []
+    previous = [None] * len(values)
+
+    for i, v in enumerate(values):
+        j = bisect_left(tails, v)
+
+        if j == len(tails):
+            tails.append(v)
+            tails_positions.append(i)
+        else:
+            tails[j] = v
+            tails_positions[j] = i
+
+        previous[i] = tails_positions[j - 1] if j else None
+
+    positions = []
+    i = tails_positions[-1] if tails_positions else None
+    while i is not None:
+        positions.append(i)
+        i = previous[i]
+
+    return positions[::-1]
+
 
 class DiffHelper(object):
 
+    def __init__(self, detect_moves=False, list_keys=None, field_rules=None, large_value_size=None,
+                 keep_large_values=False, instrumentation=None):
+        """
+        Parameters:
+          - detect_moves (bool, optional): Report the elements of ordered lists of scalars
+                that changed their position. Moves are reported as updated changes with the
+                new index as key, and the old index in the `from_index` metadata
+          - list_keys (dict, optional): How to identify the elements of the lists of entities,
+                by field name. The identity can be the name of an element field, a tuple of
+                field names for a composite key, or a callable that returns the element key.
+                Lists not in list_keys use the `id` field. Elements without identity are
+                matched by their content
+          - field_rules (FieldRules, optional): The fields to compare, applied to the entity
+                dicts before diffing them (see kronos.field_rules)
+          - large_value_size (int, optional): The changes of texts and bytes longer than
+                this carry their ValueDigest instead of the full values. Values saved as
+                digests (see Tracker `large_value_size`) are always compared by digest
+          - keep_large_values (bool, optional): Keep the full new value in the changes of
+                large values, only the old value is replaced by its digest
+          - instrumentation (Instrumentation, optional): Receives the number of nodes
+                visited and of changes of every diff. See kronos.instrumentation
+        """
+        self.detect_moves = detect_moves
+        self.list_keys = list_keys or {}
+        self.field_rules = field_rules
+        self.large_value_size = large_value_size
+        self.keep_large_values = keep_large_values
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+        # nodes visited by the diff running in each thread, only counted when instrumented
+        self._visits = threading.local() if self.instrumentation.enabled else None
+
+    def _apply_rules(self, entity_dict, old_entity_dict):
+        if self.field_rules is None:
+            return entity_dict, old_entity_dict
+
+        return self.field_rules.apply(entity_dict), self.field_rules.apply(old_entity_dict)
+
+    def _compact(self, value):
+        return value_digest(value) if is_large_value(value, self.large_value_size) else value
+
+    def _values_differ(self, new_value, old_value):
+        """
+        Compares two scalar values. A value saved as a ValueDigest is compared with the
+        digest of the other value
+        """
+        if isinstance(new_value, ValueDigest) or isinstance(old_value, ValueDigest):
+            return value_digest(new_value) != value_digest(old_value)
+
+        return new_value != old_value
+
+    def _value_change(self, k, new_value, old_value):
+        if not self.keep_large_values:
+            new_value = self._compact(new_value)
+
+        return Change(k, value=new_value, old_value=self._compact(old_value))
+
     def _missing_items(self, existing_items, items):
         return [k for k in items if k not in existing_items]
 
@@ -38,91 +205,344 @@ class DiffHelper(object):
     def _list_diff(self, field_name, new_value, old_value):
         list_field_diff = Diff(field_name=field_name)
 
-        # If the list elements are dicts or entities, go for an
-        # entity diff instead of a diff of simple list of scalars
-        if self.value_is_dict_or_entity(new_value[0]):
-            new_dict = {e.get('id'): e for e in new_value}
-            old_dict = {e.get('id'): e for e in old_value}
-
-            new_ids = set(new_dict.keys())
-            old_ids = set(old_dict.keys())
+        self._count_visits(len(new_value) + len(old_value))
 
-            if new_ids or old_ids:
-                added_ids = new_ids.difference(old_ids)
-                deleted_ids = old_ids.difference(new_ids)
-                common_ids = new_ids.intersection(old_ids)
+        sample = next(iter(new_value or old_value), None)
 
-                for existing_id in common_ids:
-                    elem_diff = self.diff(new_dict.get(existing_id), old_dict.get(existing_id))
-                    if not elem_diff.empty:
-                        list_field_diff.updated.append(elem_diff)
+        # If the list elements are dicts or entities, go for an
+        # entity diff instead of a diff of simple list of scalars
+        if not isinstance(new_value, (set, frozenset)) and self.value_is_dict_or_entity(sample):
+            key_func = self._element_key_func(field_name)
+            new_elements = self._keyed_elements(new_value, key_func)
+            old_elements = self._keyed_elements(old_value, key_func)
 
-                for new_id in added_ids:
+            for key, element in new_elements.items():
+                if key not in old_elements:
                     list_field_diff.added.append(Change(
-                        new_id, value=new_dict.get(new_id), old_value=None)
+                        self._change_key(key), value=element, old_value=None)
                     )
 
-                for deleted_id in deleted_ids:
+                elif not isinstance(key, _ContentKey):
+                    elem_diff = self._diff(self._as_dict(element), self._as_dict(old_elements[key]), None, None, {})
+                    if not elem_diff.empty:
+                        list_field_diff.updated.append(Diff(field_name=key, diff=elem_diff))
+
+            for key, element in old_elements.items():
+                if key not in new_elements:
                     list_field_diff.deleted.append(Change(
-                        deleted_id, value=None, old_value=old_dict.get(deleted_id))
+                        self._change_key(key), value=None, old_value=element)
                     )
 
         else:
-            # Simple list diff where there's only add/delete
-            for nv in new_value:
-                if nv not in old_value:
-                    list_field_diff.added.append(
-                        Change(None, value=nv, old_value=None)
-                    )
-
-            for ov in old_value:
-                if ov not in new_value:
-                    list_field_diff.deleted.append(
-                        Change(None, value=None, old_value=ov)
-                    )
+            self._scalar_list_diff(list_field_diff, new_value, old_value)
 
         return list_field_diff
 
+    def _element_key_func(self, field_name):
+        identity = self.list_keys.get(field_name, 'id')
+
+        if callable(identity):
+            return identity
+
+        if isinstance(identity, (tuple, list)):
+            names = tuple(identity)
+
+            def composite_key(element):
+                key = tuple(_element_value(element, name) for name in names)
+                return None if all(v is None for v in key) else key
+
+            return composite_key
+
+        return lambda element: _element_value(element, identity)
+
+    def _keyed_elements(self, elements, key_func):
+        """
+        Maps the list elements by their key. Elements without a key get a key from
+        their content, counting the occurrences of equal elements
+        """
+        keyed = OrderedDict()
+        occurrences = Counter()
+
+        for element in elements:
+            key = key_func(element)
+
+            if key is None:
+                content = _content_fingerprint(self._as_dict(element))
+                if content is None:
+                    # elements that can't be fingerprinted never match by content
+                    key = _ContentKey(None, id(element))
+                else:
+                    key = _ContentKey(content, occurrences[content])
+                    occurrences[content] += 1
+
+            keyed[key] = element
+
+        return keyed
+
+    def _change_key(self, key):
+        return None if isinstance(key, _ContentKey) else key
+
+    def _as_dict(self, value):
+        if isinstance(value, dict):
+            return value
+        elif hasattr(value, 'to_dict'):
+            return value.to_dict()
+        elif hasattr(value, 'as_dict'):
+            return value.as_dict()
+
+        return vars(value)
+
+    def _scalar_list_diff(self, list_field_diff, new_value, old_value):
+        # Simple list diff where there's only add/delete (and moves if enabled)
+        if isinstance(new_value, (set, frozenset)) and isinstance(old_value, (set, frozenset)):
+            added = new_value - old_value
+            deleted = old_value - new_value
+
+        else:
+            added = _multiset_difference(new_value, old_value)
+            deleted = _multiset_difference(old_value, new_value)
+
+        for nv in added:
+            list_field_diff.added.append(Change(None, value=nv, old_value=None))
+
+        for ov in deleted:
+            list_field_diff.deleted.append(Change(None, value=None, old_value=ov))
+
+        if self.detect_moves and isinstance(new_value, (list, tuple)) and isinstance(old_value, (list, tuple)):
+            list_field_diff.updated.extend(self._list_moves(new_value, old_value))
+
+    def _list_moves(self, new_value, old_value):
+        """
+        Matches the elements kept in the list with their old positions, and reports as moved
+        the ones outside the longest run of elements that kept their relative order
+        """
+        old_positions = defaultdict(deque)
+
+        matched = []
+
+        try:
+            for i, ov in enumerate(old_value):
+                old_positions[ov].append(i)
+
+            for i, nv in enumerate(new_value):
+                positions = old_positions.get(nv)
+                if positions:
+                    matched.append((i, positions.popleft()))
+
+        except TypeError:
+            # moves are only detected for hashable elements
+            return []
+
+        in_order = set(_longest_increasing_subsequence([old_i for _, old_i in matched]))
+
+        return [
+            Change(new_i, value=new_value[new_i], old_value=old_value[old_i], from_index=old_i)
+            for position, (new_i, old_i) in enumerate(matched) if position not in in_order
+        ]
+
     def diff(self, entity_dict, old_entity_dict, **metadata):
         """
         Calculates the diff between two entity's dicts. When dealing
-        with nested entities or fields that are list of entities, in order
-        to calculate the diff it assumes every entity dict has an `id` field,
-        otherwise calculates the diff as if it were a simple list of scalars
+        with fields that are list of entities, the elements are matched by
+        their `id` field (or the identity configured in `list_keys`), and
+        by their content when they have no identity. Lists of scalars are
+        diffed as multisets
+
+        """
+        entity_dict, old_entity_dict = self._apply_rules(entity_dict, old_entity_dict)
+
+        if self._visits is not None:
+            return self._observed_diff(entity_dict, old_entity_dict, None, None, metadata)
+
+        return self._diff(entity_dict, old_entity_dict, None, None, metadata)
+
+    def diff_many(self, pairs, **metadata):
+        """
+        Calculates the diffs of several (entity_dict, old_entity_dict) pairs, in order
+        """
+        return [self.diff(new, old, **metadata) for new, old in pairs]
 
+    def tree_diff(self, entity_dict, old_entity_dict, tree, old_tree, **metadata):
         """
+        Same as `diff`, but skips the nested dicts and lists whose hash (see
+        kronos.utils.hash_tree) didn't change, without walking them
+
+        Parameters:
+          - entity_dict (dict): The current entity dict
+          - old_entity_dict (dict): The tracked entity dict
+          - tree (HashTree): The hash tree of entity_dict
+          - old_tree (HashTree): The hash tree of old_entity_dict
+        """
+        entity_dict, old_entity_dict = self._apply_rules(entity_dict, old_entity_dict)
+
+        if self._visits is not None:
+            return self._observed_diff(entity_dict, old_entity_dict, tree, old_tree, metadata)
+
+        return self._diff(entity_dict, old_entity_dict, tree, old_tree, metadata)
+
+    def _observed_diff(self, entity_dict, old_entity_dict, tree, old_tree, metadata):
+        self._visits.nodes = 0
+        _diff = self._diff(entity_dict, old_entity_dict, tree, old_tree, metadata)
+
+        self.instrumentation.observe('diff.nodes_visited', self._visits.nodes)
+        self.instrumentation.observe('diff.changes', _count_changes(_diff))
+
+        return _diff
+
+    def _count_visits(self, nodes):
+        # the helpers can be called outside of a diff, e.g. from a compiled schema diff,
+        # when the counter of the thread is not set yet
+        if self._visits is not None:
+            self._visits.nodes = getattr(self._visits, 'nodes', 0) + nodes
+
+    def _diff(self, entity_dict, old_entity_dict, tree, old_tree, metadata):
         new_keys = set(entity_dict.keys())
         old_keys = set(old_entity_dict.keys())
 
         existing_keys = old_keys.intersection(new_keys)
 
+        self._count_visits(len(new_keys) + len(old_keys) - len(existing_keys))
+
         _diff = Diff(**metadata)
 
         for new_field in self._missing_items(existing_keys, new_keys):
-            _diff.added.append(Change(new_field, entity_dict.get(new_field)))
+            _diff.added.append(self._value_change(new_field, entity_dict.get(new_field), None))
 
         for deleted_field in self._missing_items(existing_keys, old_keys):
-            _diff.deleted.append(Change(deleted_field, None, old_entity_dict.get(deleted_field)))
+            _diff.deleted.append(Change(deleted_field, None, self._compact(old_entity_dict.get(deleted_field))))
+
+        children = tree.children if tree is not None else None
+        old_children = old_tree.children if old_tree is not None else None
 
         for k in existing_keys:
-            new_value, old_value = entity_dict.get(k), old_entity_dict.get(k)
+            if children and old_children and k in children and k in old_children:
+                if children[k] == old_children[k]:
+                    continue
 
-            if isinstance(new_value, (list, set, tuple)):
-                list_field_diff = self._list_diff(k, new_value, old_value)
+                change = self._field_diff(
+                    k, entity_dict.get(k), old_entity_dict.get(k), trees=(children[k], old_children[k])
+                )
 
-                if not list_field_diff.empty:
-                    _diff.updated.append(list_field_diff)
+            else:
+                change = self._field_diff(k, entity_dict.get(k), old_entity_dict.get(k))
 
-            elif self.value_is_dict_or_entity(new_value):
-                sub_entity_diff = self.diff(new_value, old_value)
+            if change is not None:
+                _diff.updated.append(change)
 
-                if not sub_entity_diff.empty:
-                    _diff.updated.append(Diff(
-                        field_name=k,
-                        diff=sub_entity_diff,
-                    ))
+        return _diff
 
-            elif new_value != old_value:
-                _diff.updated.append(Change(k, value=new_value, old_value=old_value))
+    def iter_changes(self, entity_dict, old_entity_dict, path=()):
+        """
+        Yields the changes between two entity's dicts one by one as PathChange tuples,
+        without building the Diff. Nested dicts and entities are walked as their changes
+        are consumed, so stopping the iteration skips the rest of the comparison. Changes
+        come in the order of the fields of the new dict, followed by the deleted fields
+
+        Parameters:
+          - entity_dict (dict): The current entity dict
+          - old_entity_dict (dict): The tracked entity dict
+          - path (tuple, optional): Path prefix of the changes
+        """
+        entity_dict, old_entity_dict = self._apply_rules(entity_dict, old_entity_dict)
+        return self._iter_changes(entity_dict, old_entity_dict, path)
 
-        return _diff
+    def _iter_changes(self, entity_dict, old_entity_dict, path):
+        for k, new_value in entity_dict.items():
+            if k not in old_entity_dict:
+                yield PathChange(ADDED, path + (k,), self._value_change(k, new_value, None).value, None)
+                continue
+
+            old_value = old_entity_dict[k]
+
+            if new_value is old_value:
+                continue
+
+            if isinstance(new_value, (list, set, frozenset, tuple)) and \
+                    isinstance(old_value, (list, set, frozenset, tuple)):
+                for change in self._iter_list_changes(path + (k,), k, new_value, old_value):
+                    yield change
+
+            elif self.value_is_dict_or_entity(new_value) and self.value_is_dict_or_entity(old_value):
+                for change in self._iter_changes(self._as_dict(new_value), self._as_dict(old_value), path + (k,)):
+                    yield change
+
+            elif self._values_differ(new_value, old_value):
+                change = self._value_change(k, new_value, old_value)
+                yield PathChange(UPDATED, path + (k,), change.value, change.old_value)
+
+        for k, old_value in old_entity_dict.items():
+            if k not in entity_dict:
+                yield PathChange(DELETED, path + (k,), None, self._compact(old_value))
+
+    def _iter_list_changes(self, path, field_name, new_value, old_value):
+        sample = next(iter(new_value or old_value), None)
+
+        if not isinstance(new_value, (set, frozenset)) and self.value_is_dict_or_entity(sample):
+            key_func = self._element_key_func(field_name)
+            new_elements = self._keyed_elements(new_value, key_func)
+            old_elements = self._keyed_elements(old_value, key_func)
+
+            for key, element in new_elements.items():
+                if key not in old_elements:
+                    yield PathChange(ADDED, path + (self._change_key(key),), element, None)
+
+                elif not isinstance(key, _ContentKey):
+                    for change in self._iter_changes(
+                            self._as_dict(element), self._as_dict(old_elements[key]), path + (key,)):
+                        yield change
+
+            for key, element in old_elements.items():
+                if key not in new_elements:
+                    yield PathChange(DELETED, path + (self._change_key(key),), None, element)
+
+        else:
+            list_field_diff = Diff(field_name=field_name)
+            self._scalar_list_diff(list_field_diff, new_value, old_value)
+
+            for change in list_field_diff.added:
+                yield PathChange(ADDED, path, change.value, None)
+
+            for change in list_field_diff.deleted:
+                yield PathChange(DELETED, path, None, change.old_value)
+
+            for change in list_field_diff.updated:
+                yield PathChange(MOVED, path + (change.key,), change.value, change.metadata['from_index'])
+
+    def has_changes(self, entity_dict, old_entity_dict):
+        """
+        Tells if there's any change between two entity's dicts. Equal dicts are detected
+        with a single comparison, otherwise the comparison stops at the first change
+        """
+        entity_dict, old_entity_dict = self._apply_rules(entity_dict, old_entity_dict)
+
+        if entity_dict == old_entity_dict:
+            return False
+
+        return next(self._iter_changes(entity_dict, old_entity_dict, ()), None) is not None
+
+    def _field_diff(self, k, new_value, old_value, trees=None):
+        """
+        Calculates the change of a field present in both entities. Returns a Change for
+        scalar fields, a Diff for lists and nested entities, or None if there's no change
+        """
+        if isinstance(new_value, (list, set, frozenset, tuple)) and \
+                isinstance(old_value, (list, set, frozenset, tuple)):
+            list_field_diff = self._list_diff(k, new_value, old_value)
+
+            if not list_field_diff.empty:
+                return list_field_diff
+
+        elif self.value_is_dict_or_entity(new_value) and self.value_is_dict_or_entity(old_value):
+            if trees is not None and isinstance(new_value, dict) and isinstance(old_value, dict):
+                sub_entity_diff = self._diff(new_value, old_value, trees[0], trees[1], {})
+            else:
+                sub_entity_diff = self._diff(self._as_dict(new_value), self._as_dict(old_value), None, None, {})
+
+            if not sub_entity_diff.empty:
+                return Diff(
+                    field_name=k,
+                    diff=sub_entity_diff,
+                )
+
+        elif self._values_differ(new_value, old_value):
+            return self._value_change(k, new_value, old_value)
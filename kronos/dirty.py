@@ -0,0 +1,381 @@
+import weakref
+
+from collections.abc import MutableMapping, MutableSequence, MutableSet
+
+from .errors import KronosError
+
+
+_MISSING = object()
+
+# Dirty states of the tracked entities by tracker (weak references), by id(entity)
+_states = {}
+
+# Paths of the values that can't be observed (sets, other containers), by id(entity)
+_unobserved = {}
+
+
+class DirtyTrackingError(KronosError):
+    pass
+
+
+class _DirtyState(object):
+
+    __slots__ = ('key', 'paths')
+
+    def __init__(self, key):
+        self.key = key
+        self.paths = set()
+
+
+def _forget(entity_id):
+    _states.pop(entity_id, None)
+    _unobserved.pop(entity_id, None)
+
+
+def _register(entity):
+    """
+    Forgets the state of the entity when it's garbage collected. Ids are reused, so the
+    state must not outlive the entity
+    """
+    entity_id = id(entity)
+
+    if entity_id not in _states and entity_id not in _unobserved:
+        weakref.finalize(entity, _forget, entity_id)
+
+
+def _is_tracked(entity):
+    return bool(_states.get(id(entity)))
+
+
+def _mark(entity, path):
+    for state in _states.get(id(entity), {}).values():
+        state.paths.add(path)
+
+
+def _mark_unobserved(entity, path):
+    _register(entity)
+    _unobserved.setdefault(id(entity), set()).add(path)
+
+
+def _reset_unobserved(entity, path):
+    """
+    Forgets the unobserved paths under a path whose value is replaced
+    """
+    paths = _unobserved.get(id(entity))
+
+    if paths:
+        paths.difference_update([p for p in paths if p[:len(path)] == path])
+
+
+def _wrap(owner, path, value, in_list=False):
+    """
+    Wraps dicts and lists, and the dicts and lists in tuples, so their mutations mark the
+    path as dirty on the owner entity. The paths of mutable containers that can't be
+    observed are always diffed
+    """
+    if isinstance(value, (TrackedDict, TrackedList)):
+        # already observed at this path, as when tracking starts again
+        if value._owner is owner and value._path == path and \
+                (isinstance(value, TrackedList) or value._in_list == in_list):
+            return value
+
+        value = value.__copy__()
+
+    if type(value) is dict:
+        return TrackedDict(owner, path, value, in_list)
+    elif type(value) is list:
+        return TrackedList(owner, path, value)
+
+    elif isinstance(value, tuple):
+        elements = [_wrap(owner, path, e, True) for e in value]
+
+        if all(e is v for e, v in zip(elements, value)):
+            return value
+
+        return value._make(elements) if hasattr(value, '_make') else tuple(elements)
+
+    elif isinstance(value, (MutableMapping, MutableSequence, MutableSet)):
+        _mark_unobserved(owner, path)
+
+    return value
+
+
+class TrackedDict(dict):
+
+    """
+    A dict that marks its path as dirty on the owner entity when mutated. The elements of
+    lists are diffed as a whole, so dicts in lists mark the path of the list
+    """
+
+    def __init__(self, owner, path, value, in_list=False):
+        super(TrackedDict, self).__init__()
+        self._owner = owner
+        self._path = path
+        self._in_list = in_list
+        for k, v in value.items():
+            dict.__setitem__(self, k, _wrap(owner, self._child_path(k), v, in_list))
+
+    def _child_path(self, key):
+        return self._path if self._in_list else self._path + (key,)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+    def __setitem__(self, key, value):
+        path = self._child_path(key)
+        if not self._in_list:
+            _reset_unobserved(self._owner, path)
+
+        super(TrackedDict, self).__setitem__(key, _wrap(self._owner, path, value, self._in_list))
+        _mark(self._owner, path)
+
+    def __delitem__(self, key):
+        super(TrackedDict, self).__delitem__(key)
+        if not self._in_list:
+            _reset_unobserved(self._owner, self._child_path(key))
+
+        _mark(self._owner, self._child_path(key))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def _mutate(name):
+        def mutate(self, *args, **kwargs):
+            result = getattr(super(TrackedDict, self), name)(*args, **kwargs)
+            _mark(self._owner, self._path)
+            return result
+        return mutate
+
+    pop = _mutate('pop')
+    popitem = _mutate('popitem')
+    clear = _mutate('clear')
+
+    del _mutate
+
+
+class TrackedList(list):
+
+    """
+    A list that marks its path as dirty on the owner entity when mutated, or when any of
+    its elements is mutated
+    """
+
+    def __init__(self, owner, path, value):
+        super(TrackedList, self).__init__(_wrap(owner, path, v, True) for v in value)
+        self._owner = owner
+        self._path = path
+
+    def __copy__(self):
+        return list(self)
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+    def _wrap_element(self, value):
+        return _wrap(self._owner, self._path, value, True)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [self._wrap_element(v) for v in value]
+        else:
+            value = self._wrap_element(value)
+
+        super(TrackedList, self).__setitem__(index, value)
+        _mark(self._owner, self._path)
+
+    def append(self, value):
+        super(TrackedList, self).append(self._wrap_element(value))
+        _mark(self._owner, self._path)
+
+    def extend(self, values):
+        super(TrackedList, self).extend([self._wrap_element(v) for v in values])
+        _mark(self._owner, self._path)
+
+    def insert(self, index, value):
+        super(TrackedList, self).insert(index, self._wrap_element(value))
+        _mark(self._owner, self._path)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def _mutate(name):
+        def mutate(self, *args, **kwargs):
+            result = getattr(super(TrackedList, self), name)(*args, **kwargs)
+            _mark(self._owner, self._path)
+            return result
+        return mutate
+
+    __delitem__ = _mutate('__delitem__')
+    pop = _mutate('pop')
+    remove = _mutate('remove')
+    clear = _mutate('clear')
+    sort = _mutate('sort')
+    reverse = _mutate('reverse')
+    __imul__ = _mutate('__imul__')
+
+    del _mutate
+
+
+def dirty_trackable(cls):
+    """
+    Class decorator that records which attributes of the instances are assigned,
+    deleted or mutated (for dict and list attributes) while they are tracked.
+
+    Trackers only diff the touched fields of these entities, and skip the conversion and
+    the diff when nothing was touched. The entity dict keys must be the attribute names,
+    as with entities converted from their __dict__. While an instance is tracked, its dict
+    and list attributes, and the dicts and lists nested in them or in tuples, are replaced
+    by observed copies (when tracking starts and when they are assigned), so they no longer
+    share changes with other references to the original containers. Other mutable containers (sets, OrderedDict, deque...) can't be observed, so their
+    fields are diffed every time. Nested entity objects are not observed (reassign them or
+    use `mark_dirty`).
+
+    The instances must support weak references: classes with __slots__ need a
+    `__weakref__` slot.
+    """
+    if not cls.__weakrefoffset__:
+        raise DirtyTrackingError(
+            "{} instances don't support weak references, add '__weakref__' to its __slots__".format(cls.__name__)
+        )
+
+    original_setattr = cls.__setattr__
+    original_delattr = cls.__delattr__
+
+    def __setattr__(self, name, value):
+        _reset_unobserved(self, (name,))
+
+        if not _is_tracked(self):
+            original_setattr(self, name, value)
+            return
+
+        original_setattr(self, name, _wrap(self, (name,), value))
+        _mark(self, (name,))
+
+    def __delattr__(self, name):
+        original_delattr(self, name)
+        _reset_unobserved(self, (name,))
+        _mark(self, (name,))
+
+    cls.__setattr__ = __setattr__
+    cls.__delattr__ = __delattr__
+    cls._kronos_setattr = original_setattr
+    cls._kronos_dirty_trackable = True
+
+    return cls
+
+
+def is_dirty_trackable(entity):
+    return getattr(entity.__class__, '_kronos_dirty_trackable', False)
+
+
+def _attributes(entity):
+    attributes = dict(vars(entity)) if hasattr(entity, '__dict__') else {}
+
+    for cls in type(entity).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name not in ('__weakref__', '__dict__') and hasattr(entity, name):
+                attributes[name] = getattr(entity, name)
+
+    return attributes
+
+
+def _observe(entity):
+    """
+    Replaces the dict and list attributes of an entity by observed ones, and finds the
+    values that can't be observed
+    """
+    for name, value in _attributes(entity).items():
+        wrapped = _wrap(entity, (name,), value)
+
+        if wrapped is not value:
+            entity.__class__._kronos_setattr(entity, name, wrapped)
+
+
+def start_tracking(entity, key, tracker):
+    """
+    Starts recording the changes of an entity for a tracker, from a clean state
+    """
+    _register(entity)
+    _states.setdefault(id(entity), weakref.WeakKeyDictionary())[tracker] = _DirtyState(key)
+    _observe(entity)
+
+
+def dirty_state(entity, tracker):
+    """
+    Returns the tracked key and the dirty paths of an entity for a tracker, or None if the
+    tracker isn't tracking it. The paths of the values that can't be observed are always dirty
+    """
+    state = _states.get(id(entity), {}).get(tracker)
+
+    if state is None:
+        return None
+
+    return state.key, frozenset(state.paths.union(_unobserved.get(id(entity), ())))
+
+
+def mark_dirty(entity, *paths):
+    """
+    Marks paths of an entity as dirty. Paths are tuples of field names or dotted strings
+    """
+    for path in paths:
+        _mark(entity, tuple(path.split('.')) if isinstance(path, str) else tuple(path))
+
+
+def _paths_tree(paths):
+    """
+    Builds a tree with the field names of the paths, where None marks a whole subtree
+    """
+    tree = {}
+
+    # shorter paths first, so a dirty parent covers its children
+    for path in sorted(paths, key=len):
+        node = tree
+
+        for name in path[:-1]:
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+
+        else:
+            node[path[-1]] = None
+
+    return tree
+
+
+def select_paths(entity_dict, old_entity_dict, paths):
+    """
+    Returns the parts of both dicts that are in the given paths
+    """
+    return _select(entity_dict, old_entity_dict, _paths_tree(paths))
+
+
+def _select(new, old, tree):
+    new_selection, old_selection = {}, {}
+
+    for k, sub_tree in tree.items():
+        nv, ov = new.get(k, _MISSING), old.get(k, _MISSING)
+
+        if sub_tree and isinstance(nv, dict) and isinstance(ov, dict):
+            nv, ov = _select(nv, ov, sub_tree)
+
+        if nv is not _MISSING:
+            new_selection[k] = nv
+
+        if ov is not _MISSING:
+            old_selection[k] = ov
+
+    return new_selection, old_selection
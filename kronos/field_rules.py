@@ -0,0 +1,192 @@
+from .errors import KronosError
+from .utils import value_digest
+
+
+# path segment of the elements of a list
+_ITEMS = '[]'
+# path segment that matches any field
+_ANY = '*'
+
+
+class FieldRulesError(KronosError):
+    pass
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'terminal')
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+
+
+def parse_path(pattern):
+    """
+    Splits a field path pattern in its segments. Fields are separated by dots, `*` matches
+    any field and `[]` after a field matches the elements of the list in that field, e.g.
+    `address.*` or `items[].price`
+    """
+    segments = []
+
+    for part in pattern.split('.'):
+        name, items = part, 0
+        while name.endswith(_ITEMS):
+            name, items = name[:-len(_ITEMS)], items + 1
+
+        if not name or '[' in name or ']' in name:
+            raise FieldRulesError("Invalid field path '{}'".format(pattern))
+
+        segments.append(name)
+        segments.extend([_ITEMS] * items)
+
+    return segments
+
+
+def _compile(patterns):
+    root = _Node()
+
+    for pattern in patterns:
+        node = root
+        for segment in parse_path(pattern):
+            node = node.children.setdefault(segment, _Node())
+        node.terminal = True
+
+    return root
+
+
+def _match(nodes, key):
+    matched = []
+
+    for node in nodes:
+        child = node.children.get(key)
+        if child is not None:
+            matched.append(child)
+
+        child = node.children.get(_ANY)
+        if child is not None:
+            matched.append(child)
+
+    return matched
+
+
+def _items(nodes):
+    return [node.children[_ITEMS] for node in nodes if _ITEMS in node.children]
+
+
+def _as_dict(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    elif hasattr(value, 'as_dict'):
+        return value.as_dict()
+
+    return dict(vars(value))
+
+
+class FieldRules(object):
+
+    """
+    Which parts of an entity dict are kept in the snapshots and compared in the diffs.
+
+    The include and exclude field paths (see `parse_path`) are compiled once in a tree of
+    segments, so applying them only walks the fields they refer to. Excluded paths are left
+    out, and when there are include paths, only the fields they match (and their content)
+    are kept. Nested entities are converted to dict when a path goes into them.
+
+    Dicts and lists nested deeper than `max_depth` (top level fields have depth 1), and
+    lists or sets with more than `max_list_size` elements, are replaced by their
+    ValueDigest, so they are compared only by fingerprint.
+    """
+
+    def __init__(self, include=None, exclude=None, max_depth=None, max_list_size=None):
+        """
+        Parameters:
+          - include (list, optional): The field paths to keep
+          - exclude (list, optional): The field paths to leave out
+          - max_depth (int, optional): Depth from which nested dicts and lists are compared
+                by fingerprint
+          - max_list_size (int, optional): Size from which lists are compared by fingerprint
+        """
+        self._include = [_compile(include)] if include else None
+        self._exclude = [_compile(exclude)] if exclude else []
+        self.max_depth = max_depth
+        self.max_list_size = max_list_size
+        self._limits = max_depth is not None or max_list_size is not None
+
+    def apply(self, entity_dict):
+        """
+        Returns a new dict with the rules applied. The given dict is not modified
+        """
+        return self._prune(entity_dict, self._include, self._exclude, 0)
+
+    def _prune(self, value, include, exclude, depth):
+        result = {}
+
+        for k, v in value.items():
+            excluded = _match(exclude, k) if exclude else exclude
+
+            if any(node.terminal for node in excluded):
+                continue
+
+            included = include
+            if include is not None:
+                included = _match(include, k)
+
+                if not included:
+                    continue
+
+                if any(node.terminal for node in included):
+                    included = None
+                elif not self._can_descend(v, included):
+                    continue
+
+            result[k] = self._value(v, included, excluded, depth + 1)
+
+        return result
+
+    def _can_descend(self, value, include):
+        if isinstance(value, (list, tuple)):
+            return bool(_items(include))
+
+        return isinstance(value, dict) or hasattr(value, '__dict__')
+
+    def _value(self, value, include, exclude, depth):
+        if isinstance(value, dict):
+            if self.max_depth is not None and depth > self.max_depth:
+                return value_digest(value)
+
+            if include is None and not exclude and not self._limits:
+                return value
+
+            return self._prune(value, include, exclude, depth)
+
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            if (self.max_depth is not None and depth > self.max_depth) or \
+                    (self.max_list_size is not None and len(value) > self.max_list_size):
+                return value_digest(value)
+
+            if include is not None:
+                include = _items(include)
+                if any(node.terminal for node in include):
+                    include = None
+
+            if exclude:
+                exclude = _items(exclude)
+                if any(node.terminal for node in exclude):
+                    return value.__class__() if not hasattr(value, '_make') else ()
+
+            if (include is None and not exclude and not self._limits) or \
+                    isinstance(value, (set, frozenset)):
+                return value
+
+            elements = [self._value(e, include, exclude, depth + 1) for e in value]
+
+            if isinstance(value, tuple):
+                return value._make(elements) if hasattr(value, '_make') else tuple(elements)
+
+            return elements
+
+        elif (include is not None or exclude) and hasattr(value, '__dict__'):
+            return self._value(_as_dict(value), include, exclude, depth)
+
+        return value
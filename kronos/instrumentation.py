@@ -0,0 +1,212 @@
+"""
+Instrumentation hooks of the Tracker and the DiffHelper.
+
+An instrumentation receives:
+  - spans: the time spent in a phase, reported when it finishes. The Tracker reports
+    `tracker.fingerprint` and `tracker.entity_id` (building the entity key), and every call
+    to its comparator, store and change logger as `comparator.<method>`, `store.<method>`
+    and `change_logger.<method>`, e.g. `comparator.entity_to_dict`, `store.get`,
+    `comparator.diff` or `change_logger.log`
+  - counters: `entities_tracked`, `empty_diffs` and `conflicts` from the Tracker
+  - histograms: `diff.nodes_visited` (fields and list elements compared) and
+    `diff.changes` (changes in the diff) from the DiffHelper
+
+The default instrumentation does nothing, and the Tracker and the DiffHelper skip the
+extra work when it's used.
+"""
+import inspect
+import logging
+
+from functools import wraps
+from time import perf_counter
+
+
+class _NullSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation(object):
+
+    """
+    The instrumentation interface. This base class ignores everything
+    """
+
+    # instrumentations that report nothing are skipped
+    enabled = False
+
+    def span(self, name):
+        """
+        Returns a context manager that reports the time spent in it
+        """
+        return _NULL_SPAN
+
+    def increment(self, name, value=1):
+        """
+        Adds a value to a counter
+        """
+
+    def observe(self, name, value):
+        """
+        Records a value of a histogram
+        """
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class _Span(object):
+
+    __slots__ = ('_callback', '_name', '_started')
+
+    def __init__(self, callback, name):
+        self._callback = callback
+        self._name = name
+
+    def __enter__(self):
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._callback(self._name, perf_counter() - self._started, exc_type is not None)
+        return False
+
+
+class CallbackInstrumentation(Instrumentation):
+
+    """
+    Reports the spans, counters and histograms to callables. Missing callbacks are skipped
+    """
+
+    enabled = True
+
+    def __init__(self, on_span=None, on_increment=None, on_observe=None):
+        """
+        Parameters:
+          - on_span (callable, optional): Called with (name, seconds, failed) when a span
+                finishes. `failed` tells if it finished with an exception
+          - on_increment (callable, optional): Called with (name, value) for the counters
+          - on_observe (callable, optional): Called with (name, value) for the histograms
+        """
+        self._on_span = on_span
+        self._on_increment = on_increment
+        self._on_observe = on_observe
+
+    def span(self, name):
+        if self._on_span is None:
+            return _NULL_SPAN
+
+        return _Span(self._on_span, name)
+
+    def increment(self, name, value=1):
+        if self._on_increment is not None:
+            self._on_increment(name, value)
+
+    def observe(self, name, value):
+        if self._on_observe is not None:
+            self._on_observe(name, value)
+
+
+class LoggingInstrumentation(CallbackInstrumentation):
+
+    """
+    Writes the spans, counters and histograms to a logger. Nothing is measured while the
+    logger doesn't log the level
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        """
+        Parameters:
+          - logger (Logger, optional): Defaults to the `kronos` logger
+          - level (int, optional): The level of the records
+        """
+        super(LoggingInstrumentation, self).__init__(self._log_span, self._log_increment, self._log_observe)
+        self.logger = logger or logging.getLogger('kronos')
+        self.level = level
+
+    def span(self, name):
+        if not self.logger.isEnabledFor(self.level):
+            return _NULL_SPAN
+
+        return super(LoggingInstrumentation, self).span(name)
+
+    def increment(self, name, value=1):
+        if self.logger.isEnabledFor(self.level):
+            self._log_increment(name, value)
+
+    def observe(self, name, value):
+        if self.logger.isEnabledFor(self.level):
+            self._log_observe(name, value)
+
+    def _log_span(self, name, seconds, failed):
+        self.logger.log(self.level, "span %s %.6fs%s", name, seconds, ' failed' if failed else '')
+
+    def _log_increment(self, name, value):
+        self.logger.log(self.level, "counter %s +%s", name, value)
+
+    def _log_observe(self, name, value):
+        self.logger.log(self.level, "histogram %s %s", name, value)
+
+
+async def _finish_span(span, awaitable):
+    try:
+        result = await awaitable
+    except BaseException as e:
+        span.__exit__(type(e), e, e.__traceback__)
+        raise
+
+    span.__exit__(None, None, None)
+    return result
+
+
+class InstrumentedProxy(object):
+
+    """
+    Reports a span for every method call of the wrapped object, named `<prefix>.<method>`.
+    Coroutine methods are measured until they finish. Only the methods the wrapped object
+    implements are exposed, so optional methods are still detected with hasattr
+    """
+
+    def __init__(self, wrapped, instrumentation, prefix):
+        self._wrapped = wrapped
+        self._instrumentation = instrumentation
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+
+        if not callable(attr):
+            return attr
+
+        instrumentation = self._instrumentation
+        span_name = '{}.{}'.format(self._prefix, name)
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            span = instrumentation.span(span_name)
+            span.__enter__()
+
+            try:
+                result = attr(*args, **kwargs)
+            except BaseException as e:
+                span.__exit__(type(e), e, e.__traceback__)
+                raise
+
+            if inspect.isawaitable(result):
+                return _finish_span(span, result)
+
+            span.__exit__(None, None, None)
+            return result
+
+        # later calls don't go through __getattr__
+        self.__dict__[name] = call
+        return call
@@ -0,0 +1,202 @@
+import threading
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import count
+
+from .change_logger import ChangeLogger, EntityRef
+
+
+def entity_type_name(entity_type):
+    """
+    Returns the type name of an entity type given as a class, a class name or an instance
+    """
+    if isinstance(entity_type, str):
+        return entity_type
+
+    if isinstance(entity_type, type):
+        return entity_type.__name__
+
+    if isinstance(entity_type, EntityRef):
+        return entity_type.type_name
+
+    return entity_type.__class__.__name__
+
+
+class _Index(object):
+
+    """
+    Change records ordered by their (created_at, sequence) position
+    """
+
+    __slots__ = ('positions', 'entries')
+
+    def __init__(self):
+        self.positions = []
+        self.entries = []
+
+    def add(self, position, entry):
+        if not self.positions or position > self.positions[-1]:
+            self.positions.append(position)
+            self.entries.append(entry)
+
+        else:
+            # only when the clock goes backwards
+            i = bisect_left(self.positions, position)
+            self.positions.insert(i, position)
+            self.entries.insert(i, entry)
+
+    def bounds(self, date_from=None, date_to=None):
+        lo = bisect_left(self.positions, (date_from,)) if date_from is not None else 0
+        hi = bisect_left(self.positions, (date_to,)) if date_to is not None else len(self.positions)
+        return lo, hi
+
+
+class MemoryChangeLogger(ChangeLogger):
+
+    """
+    A change logger that keeps the change records in memory, indexed by entity type and
+    by entity id in creation order. Range queries are resolved with binary searches and
+    only the requested records are read, the first and last change are direct lookups.
+
+    Change records are dicts with the keys: id, entity (the type name), entity_id,
+    created, deleted, created_at, changes (the Diff) and the extra logged data.
+    """
+
+    def __init__(self, entity_id=None, clock=datetime.now):
+        """
+        Parameters:
+          - entity_id (callable, optional): Returns the id of a logged entity. Defaults to
+                its `id` attribute
+          - clock (callable, optional): Returns the creation time of the records logged
+                without a `created_at`
+        """
+        self._entity_id = entity_id or (lambda entity: getattr(entity, 'id', None))
+        self._clock = clock
+        self._sequence = count(1)
+        self._lock = threading.Lock()
+
+        self._by_type = {}
+        self._by_entity = {}
+
+    def __len__(self):
+        return sum(len(index.entries) for index in self._by_type.values())
+
+    def _entry(self, entity, changes, created, deleted, kwargs):
+        created_at = kwargs.pop('created_at', None) or self._clock()
+
+        return dict(
+            kwargs,
+            id=next(self._sequence),
+            entity=entity_type_name(entity),
+            entity_id=self._entity_id(entity),
+            created=created,
+            deleted=deleted,
+            created_at=created_at,
+            changes=changes,
+        )
+
+    def _add(self, entry):
+        position = (entry['created_at'], entry['id'])
+        entity = entry['entity']
+
+        if entity not in self._by_type:
+            self._by_type[entity] = _Index()
+
+        if (entity, entry['entity_id']) not in self._by_entity:
+            self._by_entity[(entity, entry['entity_id'])] = _Index()
+
+        self._by_type[entity].add(position, entry)
+        self._by_entity[(entity, entry['entity_id'])].add(position, entry)
+
+    def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
+        with self._lock:
+            self._add(self._entry(entity_type, changes, created, deleted, kwargs))
+
+    def log_many(self, entries):
+        with self._lock:
+            for entity_type, changes, kwargs in entries:
+                kwargs = dict(kwargs)
+                created = kwargs.pop('created', False)
+                deleted = kwargs.pop('deleted', False)
+                self._add(self._entry(entity_type, changes, created, deleted, kwargs))
+
+    def _index(self, entity_type, entity_id=None):
+        name = entity_type_name(entity_type)
+
+        if entity_id is None:
+            return self._by_type.get(name)
+
+        return self._by_entity.get((name, entity_id))
+
+    def last_change(self, entity_type, entity_id=None):
+        index = self._index(entity_type, entity_id)
+        return index.entries[-1] if index and index.entries else None
+
+    def first_change(self, entity_type, entity_id=None):
+        index = self._index(entity_type, entity_id)
+        return index.entries[0] if index and index.entries else None
+
+    def history(self, entity_type, limit=None, date_from=None, date_to=None, asc=False, desc=True,
+                entity_id=None):
+        """
+        Returns the change records of an entity type, or of a single entity
+
+        Parameters:
+          - entity_type (type or str): The entity class or class name
+          - limit (int, optional): Maximum number of records
+          - date_from (datetime, optional): Only records created at or after this time
+          - date_to (datetime, optional): Only records created before this time
+          - asc (bool, optional): Oldest records first. Newest first by default
+          - entity_id (object, optional): Only the records of the entity with this id
+        """
+        with self._lock:
+            index = self._index(entity_type, entity_id)
+
+            if not index:
+                return []
+
+            lo, hi = index.bounds(date_from, date_to)
+            return self._slice(index, lo, hi, limit, asc)
+
+    def _slice(self, index, lo, hi, limit, asc):
+        if asc:
+            return index.entries[lo:hi if limit is None else min(hi, lo + limit)]
+
+        lo = lo if limit is None else max(lo, hi - limit)
+        return index.entries[lo:hi][::-1]
+
+    def page(self, entity_type, cursor=None, size=100, date_from=None, date_to=None, asc=False,
+             entity_id=None):
+        """
+        Returns a page of change records and the cursor of the next page. Unlike offsets,
+        cursors aren't affected by the records logged between pages
+
+        Parameters:
+          - cursor (object, optional): The cursor returned with the previous page
+          - size (int, optional): Maximum number of records in the page
+
+          The other parameters are the same as in `history`
+
+        Returns:
+          A (records, next cursor) tuple. The cursor is None on the last page
+        """
+        with self._lock:
+            index = self._index(entity_type, entity_id)
+
+            if not index:
+                return [], None
+
+            lo, hi = index.bounds(date_from, date_to)
+
+            if cursor is not None:
+                if asc:
+                    lo = max(lo, bisect_right(index.positions, cursor))
+                else:
+                    hi = min(hi, bisect_left(index.positions, cursor))
+
+            entries = self._slice(index, lo, hi, size, asc)
+            has_more = hi - lo > len(entries)
+            next_cursor = (entries[-1]['created_at'], entries[-1]['id']) if entries and has_more else None
+
+            return entries, next_cursor
@@ -0,0 +1,170 @@
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .diff import Diff, DiffHelper
+
+
+def _estimate_size(entity_dict):
+    """
+    A cheap estimate of the work to diff a dict: its fields plus the size of its
+    collection fields
+    """
+    return sum(
+        1 + len(v) if isinstance(v, (list, tuple, set, frozenset, dict)) else 1
+        for v in entity_dict.values()
+    )
+
+
+def _diff_chunk(config, payload):
+    """
+    Runs in the worker processes. Diffs a pickled list of (new, old) pairs
+    """
+    helper = DiffHelper(**config)
+    return [helper.diff(new, old) for new, old in pickle.loads(payload)]
+
+
+class ParallelDiffHelper(DiffHelper):
+
+    """
+    A DiffHelper that calculates the diffs of batches of entities (`diff_many`) in a
+    process pool, so they run in parallel on several cores. Single diffs run in the
+    current process.
+
+    The pairs of dicts are grouped in chunks of about `chunk_size` (the number of fields
+    plus the elements of the collection fields), and each chunk is sent to the workers as
+    a single pickle. Dicts bigger than a chunk are split by their fields. Batches smaller
+    than `min_batch_size` are diffed in the current process.
+
+    The dicts, the `list_keys` and the diffs must be picklable. Use it as the diff helper
+    of the EntityComparator, so the Tracker batch methods use it. The instrumentation only
+    receives the diffs calculated in the current process.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=20000, min_batch_size=100, executor=None, **kwargs):
+        """
+        Parameters:
+          - max_workers (int, optional): Number of worker processes. Defaults to the number
+                of processors
+          - chunk_size (int, optional): Estimated size of the work sent at once to a worker
+          - min_batch_size (int, optional): Smaller batches are diffed in the current process
+          - executor (Executor, optional): The process pool to use, instead of creating one
+          - kwargs: The DiffHelper arguments
+        """
+        super(ParallelDiffHelper, self).__init__(**kwargs)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.min_batch_size = min_batch_size
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._config = dict(
+            detect_moves=self.detect_moves,
+            list_keys=self.list_keys,
+            large_value_size=self.large_value_size,
+            keep_large_values=self.keep_large_values,
+        )
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        return self._executor
+
+    def close(self):
+        """
+        Shuts down the process pool, if it was created by the helper
+        """
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _parts(self, new, old):
+        """
+        Splits a pair of dicts by their fields, in parts of about chunk_size
+        """
+        if _estimate_size(new) + _estimate_size(old) <= self.chunk_size or len(new) < 2:
+            return [(new, old)]
+
+        parts, part_new, part_old, size = [], {}, {}, 0
+
+        # the added and deleted fields go with the first part
+        part_new.update((k, v) for k, v in new.items() if k not in old)
+        part_old.update((k, v) for k, v in old.items() if k not in new)
+
+        for k, v in new.items():
+            if k not in old:
+                continue
+
+            part_new[k], part_old[k] = v, old[k]
+            size += _estimate_size({0: v}) + _estimate_size({0: old[k]})
+
+            if size >= self.chunk_size:
+                parts.append((part_new, part_old))
+                part_new, part_old, size = {}, {}, 0
+
+        if part_new or part_old:
+            parts.append((part_new, part_old))
+
+        return parts
+
+    def _chunks(self, pairs):
+        """
+        Groups the pairs (or their parts) in chunks. Returns the pickled chunks and the
+        position of the pair of every diff the chunks will return
+        """
+        chunks, positions = [], []
+        chunk, size = [], 0
+
+        for i, (new, old) in enumerate(pairs):
+            for part in self._parts(new, old):
+                chunk.append(part)
+                positions.append(i)
+                size += _estimate_size(part[0]) + _estimate_size(part[1])
+
+                if size >= self.chunk_size:
+                    chunks.append(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+                    chunk, size = [], 0
+
+        if chunk:
+            chunks.append(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+
+        return chunks, positions
+
+    def diff_many(self, pairs, **metadata):
+        """
+        Calculates the diffs of several pairs of entity's dicts in the process pool
+
+        Parameters:
+          - pairs (iterable): (entity_dict, old_entity_dict) pairs
+          - metadata (dict, optional): Extra data for every Diff
+
+        Returns:
+          The list of diffs, in the same order as the pairs
+        """
+        pairs = list(pairs)
+
+        if len(pairs) < self.min_batch_size or self.max_workers == 1:
+            return super(ParallelDiffHelper, self).diff_many(pairs, **metadata)
+
+        # the field rules are applied before sending the dicts, so less data is sent
+        pairs = [self._apply_rules(new, old) for new, old in pairs]
+
+        chunks, positions = self._chunks(pairs)
+        diffs = [Diff(**metadata) for _ in pairs]
+        position = iter(positions)
+
+        for chunk_diffs in self.executor.map(_diff_chunk, [self._config] * len(chunks), chunks):
+            for part_diff in chunk_diffs:
+                diff = diffs[next(position)]
+                diff.added.extend(part_diff.added)
+                diff.deleted.extend(part_diff.deleted)
+                diff.updated.extend(part_diff.updated)
+
+        return diffs
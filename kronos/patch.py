@@ -0,0 +1,170 @@
+from .diff import Change, Diff, DiffHelper, _ContentKey, _content_fingerprint
+from .errors import KronosError
+from .utils import snapshot_copy
+
+
+class PatchError(KronosError):
+    pass
+
+
+def invert_diff(diff):
+    """
+    Returns the diff that undoes the given one: added and deleted fields are swapped and
+    the updated values go back to their old values
+    """
+    inverted = Diff(field_name=diff.field_name, **diff.metadata)
+
+    for change in diff.added:
+        inverted.deleted.append(Change(change.key, value=None, old_value=change.value, **change.metadata))
+
+    for change in diff.deleted:
+        inverted.added.append(Change(change.key, value=change.old_value, old_value=None, **change.metadata))
+
+    for change in diff.updated:
+        if isinstance(change, Diff):
+            inverted.updated.append(invert_diff(change))
+
+        elif 'from_index' in change.metadata:
+            # a moved list element
+            metadata = dict(change.metadata, from_index=change.key)
+            inverted.updated.append(Change(change.metadata['from_index'], change.old_value, change.value, **metadata))
+
+        else:
+            inverted.updated.append(Change(change.key, value=change.old_value, old_value=change.value, **change.metadata))
+
+    return inverted
+
+
+class Patcher(object):
+
+    """
+    Applies diffs to entity dicts, to get the state after a change from the state before
+    it (`apply`), or the state before a change from the state after it (`revert`).
+
+    The elements of lists of entities are matched by their identity like in the
+    DiffHelper, so use the same list keys. The position of the elements added to a list
+    is not part of the diffs, they are appended at the end. Moves are only reapplied when
+    the diffs were calculated with `detect_moves`.
+    """
+
+    def __init__(self, diff_helper=None):
+        """
+        Parameters:
+          - diff_helper (DiffHelper, optional): The helper that calculated the diffs, used
+                to match the elements of lists of entities
+        """
+        self._diff_helper = diff_helper or DiffHelper()
+
+    def apply(self, entity_dict, diff):
+        """
+        Returns a new entity dict with the diff applied. The given dict is not modified
+
+        Parameters:
+          - entity_dict (dict): The state before the change
+          - diff (Diff): The change
+        """
+        result = dict(entity_dict)
+
+        for change in diff.added:
+            result[change.key] = snapshot_copy(change.value)
+
+        for change in diff.deleted:
+            result.pop(change.key, None)
+
+        for change in diff.updated:
+            if isinstance(change, Diff):
+                result[change.field_name] = self._apply_nested(
+                    change.field_name, result.get(change.field_name), change
+                )
+            else:
+                result[change.key] = snapshot_copy(change.value)
+
+        return result
+
+    def revert(self, entity_dict, diff):
+        """
+        Returns a new entity dict with the diff undone. The given dict is not modified
+
+        Parameters:
+          - entity_dict (dict): The state after the change
+          - diff (Diff): The change
+        """
+        return self.apply(entity_dict, invert_diff(diff))
+
+    def _apply_nested(self, field_name, value, diff):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return self._apply_list(field_name, value, diff)
+
+        if value is None:
+            raise PatchError("Can't apply the changes of field '{}', it has no value".format(field_name))
+
+        return self.apply(self._diff_helper._as_dict(value), diff)
+
+    def _is_entity_list(self, value, diff):
+        elements = list(value[:1]) if isinstance(value, (list, tuple)) else list(value)[:1]
+        elements += [c.value for c in diff.added[:1]] + [c.old_value for c in diff.deleted[:1]]
+
+        return any(self._diff_helper.value_is_dict_or_entity(e) for e in elements) or \
+            any(isinstance(c, Diff) for c in diff.updated)
+
+    def _apply_list(self, field_name, value, diff):
+        if isinstance(value, (set, frozenset)):
+            result = set(value)
+            result.difference_update(c.old_value for c in diff.deleted)
+            result.update(c.value for c in diff.added)
+            return value.__class__(result)
+
+        if self._is_entity_list(value, diff):
+            result = self._apply_entity_list(field_name, value, diff)
+        else:
+            result = self._apply_scalar_list(value, diff)
+
+        return value.__class__(result) if isinstance(value, tuple) else result
+
+    def _apply_entity_list(self, field_name, value, diff):
+        helper = self._diff_helper
+        key_func = helper._element_key_func(field_name)
+        elements = helper._keyed_elements(value, key_func)
+
+        for change in diff.deleted:
+            key = change.key
+
+            if key is None:
+                old_value = helper._as_dict(change.old_value)
+                content = _content_fingerprint(old_value)
+                key = next((
+                    k for k in reversed(elements)
+                    if isinstance(k, _ContentKey) and k.fingerprint == content and
+                    (content is not None or helper._as_dict(elements[k]) == old_value)
+                ), None)
+
+            elements.pop(key, None)
+
+        for change in diff.updated:
+            if change.field_name not in elements:
+                raise PatchError("Element '{}' of field '{}' not found".format(change.field_name, field_name))
+
+            elements[change.field_name] = self.apply(helper._as_dict(elements[change.field_name]), change)
+
+        result = list(elements.values())
+        result.extend(snapshot_copy(change.value) for change in diff.added)
+
+        return result
+
+    def _apply_scalar_list(self, value, diff):
+        result = list(value)
+
+        for change in diff.deleted:
+            if change.old_value in result:
+                result.remove(change.old_value)
+
+        result.extend(change.value for change in diff.added)
+
+        moves = sorted((c for c in diff.updated if 'from_index' in c.metadata), key=lambda c: c.key)
+
+        for change in moves:
+            if change.value in result:
+                result.remove(change.value)
+                result.insert(change.key, change.value)
+
+        return result
@@ -0,0 +1,169 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from .diff import Change, Diff, DiffHelper
+
+
+SCALAR = 'scalar'
+LIST = 'list'
+ENTITY = 'entity'
+
+_SCALAR_TYPES = frozenset([str, bytes, int, float, bool, type(None), Decimal, datetime, date, time])
+
+
+def infer_schema(entity_dict):
+    """
+    Infers the schema of an entity from one of its dicts. The schema maps every field
+    to its kind: SCALAR, LIST, ENTITY (a nested object) or the schema of a nested dict
+    """
+    schema = {}
+
+    for k, v in entity_dict.items():
+        if isinstance(v, dict):
+            schema[k] = infer_schema(v)
+        elif isinstance(v, (list, set, frozenset, tuple)):
+            schema[k] = LIST
+        elif type(v) in _SCALAR_TYPES:
+            schema[k] = SCALAR
+        else:
+            schema[k] = ENTITY
+
+    return schema
+
+
+def compile_diff(schema, diff_helper=None):
+    """
+    Builds a diff function specialized for a schema. It returns the same Diff as
+    DiffHelper.diff, but knows in advance which fields are scalars, lists or nested
+    entities, so it skips the key sets and the type checks of the generic diff.
+    Dicts that don't match the schema fields are diffed with the generic diff.
+
+    The field rules of the helper are applied to the entity dicts before comparing them
+    with the schema, so the schema has the fields left by the rules. Scalar changes of
+    large values carry their digests as with the helper `large_value_size`.
+
+    Parameters:
+      - schema (dict): The fields of the entity and their kind, see `infer_schema`
+      - diff_helper (DiffHelper, optional): The helper used for lists, nested entities
+            and dicts that don't match the schema
+
+    Returns:
+      A function with the same signature as DiffHelper.diff
+    """
+    diff_helper = diff_helper or DiffHelper()
+    return _compile(schema, diff_helper, diff_helper.field_rules is not None, diff_helper.diff)
+
+
+def _nested_diff(diff_helper):
+    # the field rules paths start at the entity root, nested dicts are diffed as they are
+    return lambda new, old, **metadata: diff_helper._diff(new, old, None, None, metadata)
+
+
+def _compile(schema, diff_helper, apply_rules, generic_diff):
+    namespace = dict(
+        Change=Change,
+        Diff=Diff,
+        SCALAR_TYPES=_SCALAR_TYPES,
+        keys=frozenset(schema),
+        generic_diff=generic_diff,
+        apply_rules=diff_helper._apply_rules,
+        field_diff=diff_helper._field_diff,
+        value_change=diff_helper._value_change,
+    )
+
+    lines = ['def diff(new, old, **metadata):']
+
+    if apply_rules:
+        lines.extend([
+            '    entity_dict, old_entity_dict = new, old',
+            '    new, old = apply_rules(new, old)',
+            '    if new.keys() != keys or old.keys() != keys:',
+            '        return generic_diff(entity_dict, old_entity_dict, **metadata)',
+        ])
+
+    else:
+        lines.extend([
+            '    if new.keys() != keys or old.keys() != keys:',
+            '        return generic_diff(new, old, **metadata)',
+        ])
+
+    lines.extend([
+        '    _diff = Diff(**metadata)',
+        '    updated = _diff.updated',
+    ])
+
+    if diff_helper.large_value_size is None:
+        scalar_change = 'Change(f{0}, value=nv, old_value=ov)'
+    else:
+        scalar_change = 'value_change(f{0}, nv, ov)'
+
+    for i, (field, kind) in enumerate(schema.items()):
+        namespace['f{}'.format(i)] = field
+        lines.append('    nv, ov = new[f{0}], old[f{0}]'.format(i))
+
+        if kind == SCALAR:
+            lines.extend([
+                '    if nv != ov:',
+                '        if type(nv) in SCALAR_TYPES and type(ov) in SCALAR_TYPES:',
+                '            updated.append({})'.format(scalar_change.format(i)),
+                '        else:',
+                '            change = field_diff(f{0}, nv, ov)'.format(i),
+                '            if change is not None:',
+                '                updated.append(change)',
+            ])
+
+        elif isinstance(kind, dict):
+            namespace['diff{}'.format(i)] = _compile(kind, diff_helper, False, _nested_diff(diff_helper))
+            lines.extend([
+                '    if nv != ov:',
+                '        if isinstance(nv, dict) and isinstance(ov, dict):',
+                '            sub_diff = diff{0}(nv, ov)'.format(i),
+                '            if not sub_diff.empty:',
+                '                updated.append(Diff(field_name=f{0}, diff=sub_diff))'.format(i),
+                '        else:',
+                '            change = field_diff(f{0}, nv, ov)'.format(i),
+                '            if change is not None:',
+                '                updated.append(change)',
+            ])
+
+        else:
+            lines.extend([
+                '    if nv != ov:',
+                '        change = field_diff(f{0}, nv, ov)'.format(i),
+                '        if change is not None:',
+                '            updated.append(change)',
+            ])
+
+    lines.append('    return _diff')
+
+    exec(compile('\n'.join(lines), '<kronos schema diff>', 'exec'), namespace)
+    return namespace['diff']
+
+
+class SchemaComparator(object):
+
+    """
+    A comparator (see EntityComparator) for an entity type with a fixed schema. Diffs are
+    calculated with a function compiled for the schema. When no schema is given, it's
+    inferred from the first entity diffed.
+    """
+
+    def __init__(self, entity_type, schema=None, diff_helper=None):
+        """
+        Parameters:
+          - entity_type (type or str): The entity class or class name
+          - schema (dict, optional): The fields of the entity and their kind, see `infer_schema`
+          - diff_helper (DiffHelper, optional): The helper used for the fields that need a
+                generic diff
+        """
+        self.entity_type = entity_type
+        self.schema = schema
+        self._diff_helper = diff_helper or DiffHelper()
+        self._diff = compile_diff(schema, self._diff_helper) if schema is not None else None
+
+    def diff(self, entity_dict, old_entity_dict, **metadata):
+        if self._diff is None:
+            self.schema = infer_schema(self._diff_helper._apply_rules(entity_dict, {})[0])
+            self._diff = compile_diff(self.schema, self._diff_helper)
+
+        return self._diff(entity_dict, old_entity_dict, **metadata)
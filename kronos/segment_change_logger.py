@@ -0,0 +1,442 @@
+import glob
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from datetime import datetime
+from itertools import count
+
+from .change_logger import ChangeLogger
+from .errors import KronosError
+from .memory_change_logger import entity_type_name
+from .serialization import decode_binary, encode_binary
+
+
+# Records are (payload length, payload crc32) headers followed by the payload
+_HEADER = struct.Struct('<II')
+
+# Index records are (created_at timestamp, record offset, type key, entity key) tuples.
+# The keys are checksums of the entity type and of the entity id (see _index_keys)
+_INDEX = struct.Struct('<dQII')
+
+# Index files start with a (magic, version) header. Indexes of another version are rebuilt
+_INDEX_HEADER = struct.Struct('<8sI')
+_INDEX_MAGIC = b'KRONOSIX'
+_INDEX_VERSION = 1
+
+
+class SegmentChangeLoggerError(KronosError):
+    pass
+
+
+def _index_keys(entity_type, entity_id):
+    """
+    Returns the type and entity keys of the index records of an entity. Different types or
+    entities can share a key, so they only tell which records can't match
+    """
+    type_key = zlib.crc32(entity_type.encode('utf-8'))
+    return type_key, zlib.crc32(encode_binary(entity_id), type_key)
+
+
+def _index_record(entry, offset):
+    return _INDEX.pack(entry['created_at'].timestamp(), offset, *_index_keys(entry['entity'], entry['entity_id']))
+
+
+def _index_header():
+    return _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION)
+
+
+def _is_valid_index(path):
+    """
+    Tells if an index file has the current header and only whole records
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(_INDEX_HEADER.size)
+    except OSError:
+        return False
+
+    return header == _index_header() and (size - _INDEX_HEADER.size) % _INDEX.size == 0
+
+
+def _scan_records(path):
+    """
+    Yields the (offset, payload) of the valid records of a segment, stopping at the first
+    incomplete or corrupted record
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+
+            length, crc = _HEADER.unpack(header)
+            payload = f.read(length)
+
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+
+            yield offset, payload
+            offset += _HEADER.size + length
+
+
+class _IndexView(object):
+
+    """
+    Binary search over the time index of a segment, read through mmap
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+
+        if self._file.read(_INDEX_HEADER.size) != _index_header():
+            self._file.close()
+            raise SegmentChangeLoggerError("Invalid index header in {}".format(path))
+
+        size = os.fstat(self._file.fileno()).st_size - _INDEX_HEADER.size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size // _INDEX.size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __getitem__(self, i):
+        return _INDEX.unpack_from(self._mmap, _INDEX_HEADER.size + i * _INDEX.size)
+
+    def bisect(self, timestamp):
+        """
+        Returns the position of the first record created at or after timestamp
+        """
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid][0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+
+class SegmentChangeLogger(ChangeLogger):
+
+    """
+    A change logger that appends the change records to segment files in a directory.
+    Segments are rotated when they reach `segment_size` bytes. Every segment has a
+    sidecar index with the creation time, the offset and keys of the entity type and id
+    of its records, read through mmap. Time range queries seek straight to the first
+    record in range, and the index entries from there are scanned for the entity type or
+    entity, so only the records that can match are read and decoded.
+
+    Records are written with a length and a checksum. When the logger is opened after a
+    crash, the incomplete records at the end of the last segment are discarded and its
+    index is rebuilt, as are the indexes of the other segments that are missing, torn or
+    have another version.
+
+    Writes are durable when log/log_many return. Concurrent writers share the fsync
+    calls: a writer that finds its records already synced by another one doesn't sync
+    again. Only one process should write to a directory.
+
+    Change records are dicts like the ones of the MemoryChangeLogger, saved with the
+    binary encoding of kronos.serialization. Creation times never go backwards, a record
+    is never older than the previous one.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, entity_id=None, clock=datetime.now):
+        """
+        Parameters:
+          - directory (str): Directory of the segment files. Created if it doesn't exist
+          - segment_size (int, optional): Size in bytes after which a new segment is started
+          - entity_id (callable, optional): Returns the id of a logged entity. Defaults to
+                its `id` attribute
+          - clock (callable, optional): Returns the creation time of the records logged
+                without a `created_at`
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self._entity_id = entity_id or (lambda entity: getattr(entity, 'id', None))
+        self._clock = clock
+
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+        self._closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _path(self, first_id, extension):
+        return os.path.join(self.directory, '{:020d}.{}'.format(first_id, extension))
+
+    def _segments(self):
+        return sorted(
+            int(os.path.basename(path)[:-4]) for path in glob.glob(os.path.join(self.directory, '*.log'))
+        )
+
+    def _rebuild_index(self, first_id):
+        """
+        Truncates the torn tail of a segment and rewrites its index. Returns the last record
+        """
+        last_entry, size = None, 0
+
+        with open(self._path(first_id, 'idx'), 'wb') as idx:
+            idx.write(_index_header())
+
+            for offset, payload in _scan_records(self._path(first_id, 'log')):
+                last_entry = decode_binary(payload)
+                idx.write(_index_record(last_entry, offset))
+                size = offset + _HEADER.size + len(payload)
+
+            idx.flush()
+            os.fsync(idx.fileno())
+
+        with open(self._path(first_id, 'log'), 'r+b') as log:
+            log.truncate(size)
+            os.fsync(log.fileno())
+
+        return last_entry, size
+
+    def _recover(self):
+        segments = self._segments()
+        last_entry, size = None, 0
+
+        for first_id in segments[:-1]:
+            # missing, torn or written by another version
+            if not _is_valid_index(self._path(first_id, 'idx')):
+                self._rebuild_index(first_id)
+
+        if segments:
+            last_entry, size = self._rebuild_index(segments[-1])
+
+            if last_entry is None and len(segments) > 1:
+                # an empty last segment, the previous one has the last record
+                last_entry = self._last_entry(segments[-2])
+
+        first_id = segments[-1] if segments else 1
+        next_id = last_entry['id'] + 1 if last_entry else first_id
+
+        self._sequence = count(next_id)
+        self._last_created_at = last_entry['created_at'] if last_entry else None
+        self._open_segment(first_id, size)
+
+    def _last_entry(self, first_id):
+        index = _IndexView(self._path(first_id, 'idx'))
+
+        try:
+            return self._read(first_id, [index[index.size - 1][1]])[0] if index.size else None
+        finally:
+            index.close()
+
+    def _open_segment(self, first_id, size=0):
+        self._log = open(self._path(first_id, 'log'), 'ab')
+        self._idx = open(self._path(first_id, 'idx'), 'ab')
+        self._size = size
+
+        if not self._idx.tell():
+            self._idx.write(_index_header())
+
+    def _rotate(self):
+        for f in (self._log, self._idx):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+        # the records of the rotated segment are synced
+        self._synced = max(self._synced, self._written)
+
+        self._open_segment(self._written_id + 1)
+
+    def _entry(self, entity, changes, created, deleted, kwargs):
+        created_at = kwargs.pop('created_at', None) or self._clock()
+
+        if self._last_created_at is not None and created_at < self._last_created_at:
+            created_at = self._last_created_at
+
+        self._last_created_at = created_at
+
+        return dict(
+            kwargs,
+            id=next(self._sequence),
+            entity=entity_type_name(entity),
+            entity_id=self._entity_id(entity),
+            created=created,
+            deleted=deleted,
+            created_at=created_at,
+            changes=changes,
+        )
+
+    def _append(self, records):
+        with self._write_lock:
+            if self._closed:
+                raise SegmentChangeLoggerError("The change logger is closed")
+
+            for entity, changes, created, deleted, kwargs in records:
+                entry = self._entry(entity, changes, created, deleted, kwargs)
+                payload = encode_binary(entry)
+
+                self._log.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+                self._log.write(payload)
+                self._idx.write(_index_record(entry, self._size))
+
+                self._size += _HEADER.size + len(payload)
+                self._written += 1
+                self._written_id = entry['id']
+
+                if self._size >= self.segment_size:
+                    self._rotate()
+
+            position = self._written
+
+        self._sync(position)
+
+    def _sync(self, position):
+        """
+        Group commit: syncs every record written so far, unless another writer already did
+        """
+        with self._sync_lock:
+            if self._synced >= position:
+                return
+
+            with self._write_lock:
+                if self._closed:
+                    # closing syncs every record
+                    return
+
+                self._log.flush()
+                self._idx.flush()
+                target = self._written
+
+                # the segment can be rotated and closed while syncing
+                fds = [os.dup(self._log.fileno()), os.dup(self._idx.fileno())]
+
+            try:
+                for fd in fds:
+                    os.fsync(fd)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+            self._synced = max(self._synced, target)
+
+    def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
+        self._append([(entity_type, changes, created, deleted, kwargs)])
+
+    def log_many(self, entries):
+        records = []
+        for entity_type, changes, kwargs in entries:
+            kwargs = dict(kwargs)
+            created = kwargs.pop('created', False)
+            deleted = kwargs.pop('deleted', False)
+            records.append((entity_type, changes, created, deleted, kwargs))
+
+        self._append(records)
+
+    def close(self):
+        with self._write_lock:
+            if self._closed:
+                return
+
+            self._closed = True
+
+            for f in (self._log, self._idx):
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+    def _read(self, first_id, offsets):
+        entries = []
+
+        with open(self._path(first_id, 'log'), 'rb') as log:
+            for offset in offsets:
+                log.seek(offset)
+                length, _ = _HEADER.unpack(log.read(_HEADER.size))
+                entries.append(decode_binary(log.read(length)))
+
+        return entries
+
+    def _scan(self, date_from=None, date_to=None, asc=True, type_key=None, entity_key=None):
+        """
+        Yields the records created in the time range, in creation order or in reverse. When
+        keys are given, the records whose index keys don't match are skipped without
+        reading them
+        """
+        with self._write_lock:
+            if not self._closed:
+                self._log.flush()
+                self._idx.flush()
+
+        segments = self._segments()
+        if not asc:
+            segments.reverse()
+
+        for first_id in segments:
+            index = _IndexView(self._path(first_id, 'idx'))
+
+            try:
+                if not index.size:
+                    continue
+
+                lo = index.bisect(date_from.timestamp()) if date_from is not None else 0
+                hi = index.bisect(date_to.timestamp()) if date_to is not None else index.size
+                positions = range(lo, hi) if asc else range(hi - 1, lo - 1, -1)
+
+                with open(self._path(first_id, 'log'), 'rb') as log:
+                    for i in positions:
+                        _, offset, record_type_key, record_entity_key = index[i]
+
+                        if (type_key is not None and record_type_key != type_key) or \
+                                (entity_key is not None and record_entity_key != entity_key):
+                            continue
+
+                        log.seek(offset)
+                        length, _ = _HEADER.unpack(log.read(_HEADER.size))
+                        yield decode_binary(log.read(length))
+
+            finally:
+                index.close()
+
+    def _query(self, entity_type, entity_id=None, limit=None, date_from=None, date_to=None, asc=False):
+        name = entity_type_name(entity_type)
+        entries = []
+
+        if limit is not None and limit <= 0:
+            return entries
+
+        type_key, entity_key = _index_keys(name, entity_id)
+        if entity_id is None:
+            entity_key = None
+
+        for entry in self._scan(date_from, date_to, asc, type_key, entity_key):
+            if entry['entity'] != name or (entity_id is not None and entry['entity_id'] != entity_id):
+                continue
+
+            entries.append(entry)
+
+            if limit is not None and len(entries) >= limit:
+                break
+
+        return entries
+
+    def last_change(self, entity_type, entity_id=None):
+        entries = self._query(entity_type, entity_id, limit=1)
+        return entries[0] if entries else None
+
+    def first_change(self, entity_type, entity_id=None):
+        entries = self._query(entity_type, entity_id, limit=1, asc=True)
+        return entries[0] if entries else None
+
+    def history(self, entity_type, limit=None, date_from=None, date_to=None, asc=False, desc=True,
+                entity_id=None):
+        """
+        Returns the change records of an entity type, or of a single entity. See
+        MemoryChangeLogger.history. Only the segments and records in the time range are read
+        """
+        return self._query(entity_type, entity_id, limit, date_from, date_to, asc)
@@ -0,0 +1,493 @@
+"""
+Versioned encodings of diffs and change records, in JSON and in a compact binary form.
+
+Besides the JSON types, both encodings keep tuples, sets, bytes, Decimal, datetime,
+date and time values, and Diff, Change and ValueDigest objects. Other objects are encoded as the
+dict of their to_dict/as_dict/__dict__ (or their repr), so they are decoded as dicts.
+"""
+import json
+import struct
+
+from base64 import b64decode, b64encode
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from .diff import Change, Diff
+from .errors import KronosError
+from .utils import ValueDigest
+
+
+VERSION = 1
+
+_MAGIC = b'KRD'
+_HEADER = _MAGIC + bytes([VERSION])
+_DOUBLE = struct.Struct('<d')
+
+# the key of the typed values in the JSON encoding
+_TYPE = '$t'
+
+
+class SerializationError(KronosError):
+    pass
+
+
+def _object_dict(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    elif hasattr(value, 'as_dict'):
+        return value.as_dict()
+    elif hasattr(value, '__dict__'):
+        return vars(value)
+
+    return None
+
+
+# JSON
+
+def _is_plain_dict(value):
+    return _TYPE not in value and all(isinstance(k, str) for k in value)
+
+
+def _typed(value):
+    """
+    Returns the type name of a value JSON can't represent, and the content to encode as
+    its `v`. Returns None for other values
+    """
+    if isinstance(value, dict):
+        return 'dict', [[k, v] for k, v in value.items()]
+    elif isinstance(value, Change):
+        return 'change', [value.key, value.value, value.old_value, value.metadata]
+    elif isinstance(value, Diff):
+        return 'diff', [value.field_name, value.added, value.deleted, value.updated, value.metadata]
+    elif isinstance(value, ValueDigest):
+        return 'digest', [value.digest, value.length]
+    elif isinstance(value, tuple):
+        return 'tuple', list(value)
+    elif isinstance(value, frozenset):
+        return 'frozenset', list(value)
+    elif isinstance(value, set):
+        return 'set', list(value)
+    elif isinstance(value, Decimal):
+        return 'decimal', str(value)
+    elif isinstance(value, datetime):
+        return 'datetime', value.isoformat()
+    elif isinstance(value, date):
+        return 'date', value.isoformat()
+    elif isinstance(value, time):
+        return 'time', value.isoformat()
+    elif isinstance(value, (bytes, bytearray)):
+        return 'bytes', b64encode(value).decode('ascii')
+
+    return None
+
+
+def _to_json(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+
+    elif isinstance(value, list):
+        return [_to_json(v) for v in value]
+
+    elif isinstance(value, dict) and _is_plain_dict(value):
+        return {k: _to_json(v) for k, v in value.items()}
+
+    typed = _typed(value)
+    if typed is not None:
+        return {_TYPE: typed[0], 'v': _to_json(typed[1])}
+
+    object_dict = _object_dict(value)
+    return _to_json(object_dict) if object_dict is not None else repr(value)
+
+
+def _iter_json(value):
+    """
+    Yields the same JSON text as encoding `_to_json(value)`, in chunks, without building
+    the converted value
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        yield _json_encoder.encode(value)
+
+    elif isinstance(value, list):
+        yield '['
+        for i, v in enumerate(value):
+            if i:
+                yield ','
+            yield from _iter_json(v)
+        yield ']'
+
+    elif isinstance(value, dict) and _is_plain_dict(value):
+        yield '{'
+        for i, (k, v) in enumerate(value.items()):
+            yield '{}{}:'.format(',' if i else '', _json_encoder.encode(k))
+            yield from _iter_json(v)
+        yield '}'
+
+    else:
+        typed = _typed(value)
+
+        if typed is not None:
+            yield '{{"{}":{},"v":'.format(_TYPE, _json_encoder.encode(typed[0]))
+            yield from _iter_json(typed[1])
+            yield '}'
+
+        else:
+            object_dict = _object_dict(value)
+            yield from _iter_json(object_dict if object_dict is not None else repr(value))
+
+
+def _diff(field_name, added, deleted, updated, metadata):
+    diff = Diff(field_name=field_name, **metadata)
+    diff.added, diff.deleted, diff.updated = added, deleted, updated
+    return diff
+
+
+_FROM_JSON = {
+    'dict': lambda v: {_from_json(k): _from_json(e) for k, e in v},
+    'change': lambda v: Change(_from_json(v[0]), _from_json(v[1]), _from_json(v[2]), **_from_json(v[3])),
+    'diff': lambda v: _diff(
+        _from_json(v[0]),
+        [_from_json(c) for c in v[1]],
+        [_from_json(c) for c in v[2]],
+        [_from_json(c) for c in v[3]],
+        _from_json(v[4]),
+    ),
+    'digest': lambda v: ValueDigest(v[0], v[1]),
+    'tuple': lambda v: tuple(_from_json(e) for e in v),
+    'frozenset': lambda v: frozenset(_from_json(e) for e in v),
+    'set': lambda v: set(_from_json(e) for e in v),
+    'decimal': Decimal,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time.fromisoformat,
+    'bytes': b64decode,
+}
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+
+    elif isinstance(value, dict):
+        if _TYPE in value:
+            return _FROM_JSON[value[_TYPE]](value['v'])
+        return {k: _from_json(v) for k, v in value.items()}
+
+    return value
+
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def encode_json(value):
+    """
+    Encodes a diff (or any change record value) to a JSON string
+    """
+    return _json_encoder.encode([VERSION, _to_json(value)])
+
+
+def decode_json(data):
+    """
+    Decodes a value encoded with `encode_json`
+    """
+    version, value = json.loads(data)
+
+    if version != VERSION:
+        raise SerializationError("Unsupported encoding version {}".format(version))
+
+    return _from_json(value)
+
+
+class JSONWriter(object):
+
+    """
+    Writes values to a text stream, one JSON encoded value per line. The JSON text is
+    written in chunks as the value is walked, without converting it first
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, value):
+        self.stream.write('[{},'.format(VERSION))
+        for chunk in _iter_json(value):
+            self.stream.write(chunk)
+        self.stream.write(']\n')
+
+
+class JSONReader(object):
+
+    """
+    Iterates the values of a text stream written by a JSONWriter
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        for line in self.stream:
+            if line.strip():
+                yield decode_json(line)
+
+
+# Binary
+
+def _write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_bytes(out, tag, data):
+    out.append(tag)
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write(out, value):
+    if value is None:
+        out.append(0x4e)  # N
+    elif value is True:
+        out.append(0x54)  # T
+    elif value is False:
+        out.append(0x46)  # F
+
+    elif isinstance(value, int):
+        out.append(0x69)  # i, zigzag varint
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+    elif isinstance(value, float):
+        out.append(0x66)  # f
+        out += _DOUBLE.pack(value)
+
+    elif isinstance(value, str):
+        _write_bytes(out, 0x73, value.encode('utf-8'))  # s
+
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        if isinstance(value, list):
+            out.append(0x6c)  # l
+        elif isinstance(value, tuple):
+            out.append(0x74)  # t
+        elif isinstance(value, frozenset):
+            out.append(0x5a)  # Z
+        else:
+            out.append(0x53)  # S
+
+        _write_varint(out, len(value))
+        for v in value:
+            _write(out, v)
+
+    elif isinstance(value, dict):
+        out.append(0x64)  # d
+        _write_varint(out, len(value))
+        for k, v in value.items():
+            _write(out, k)
+            _write(out, v)
+
+    elif isinstance(value, Change):
+        out.append(0x43)  # C
+        _write(out, value.key)
+        _write(out, value.value)
+        _write(out, value.old_value)
+        _write(out, value.metadata)
+
+    elif isinstance(value, Diff):
+        out.append(0x44)  # D
+        _write(out, value.field_name)
+        for changes in (value.added, value.deleted, value.updated):
+            _write_varint(out, len(changes))
+            for change in changes:
+                _write(out, change)
+        _write(out, value.metadata)
+
+    elif isinstance(value, ValueDigest):
+        out.append(0x56)  # V
+        _write(out, value.digest)
+        _write(out, value.length)
+
+    elif isinstance(value, (bytes, bytearray)):
+        _write_bytes(out, 0x62, value)  # b
+    elif isinstance(value, Decimal):
+        _write_bytes(out, 0x4d, str(value).encode('ascii'))  # M
+    elif isinstance(value, datetime):
+        _write_bytes(out, 0x41, value.isoformat().encode('ascii'))  # A
+    elif isinstance(value, date):
+        _write_bytes(out, 0x61, value.isoformat().encode('ascii'))  # a
+    elif isinstance(value, time):
+        _write_bytes(out, 0x68, value.isoformat().encode('ascii'))  # h
+
+    else:
+        object_dict = _object_dict(value)
+        _write(out, object_dict if object_dict is not None else repr(value))
+
+
+class _Decoder(object):
+
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def varint(self):
+        data, pos = self.data, self.pos
+        n = shift = 0
+
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+
+        self.pos = pos
+        return n
+
+    def raw(self):
+        length = self.varint()
+        start = self.pos
+        self.pos += length
+        return bytes(self.data[start:self.pos])
+
+    def collection(self):
+        return [self.value() for _ in range(self.varint())]
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+
+        try:
+            return _READERS[tag](self)
+        except KeyError:
+            raise SerializationError("Unknown value tag {!r}".format(chr(tag)))
+
+    def diff(self):
+        field_name = self.value()
+        added, deleted, updated = self.collection(), self.collection(), self.collection()
+        return _diff(field_name, added, deleted, updated, self.value())
+
+    def change(self):
+        key, value, old_value, metadata = self.value(), self.value(), self.value(), self.value()
+        return Change(key, value, old_value, **metadata)
+
+    def double(self):
+        value = _DOUBLE.unpack_from(self.data, self.pos)[0]
+        self.pos += _DOUBLE.size
+        return value
+
+    def dict(self):
+        return {self.value(): self.value() for _ in range(self.varint())}
+
+    def int(self):
+        n = self.varint()
+        return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+_READERS = {
+    0x4e: lambda d: None,
+    0x54: lambda d: True,
+    0x46: lambda d: False,
+    0x69: _Decoder.int,
+    0x66: _Decoder.double,
+    0x73: lambda d: d.raw().decode('utf-8'),
+    0x6c: _Decoder.collection,
+    0x74: lambda d: tuple(d.collection()),
+    0x5a: lambda d: frozenset(d.collection()),
+    0x53: lambda d: set(d.collection()),
+    0x64: _Decoder.dict,
+    0x43: _Decoder.change,
+    0x44: _Decoder.diff,
+    0x56: lambda d: ValueDigest(d.value(), d.value()),
+    0x62: _Decoder.raw,
+    0x4d: lambda d: Decimal(d.raw().decode('ascii')),
+    0x41: lambda d: datetime.fromisoformat(d.raw().decode('ascii')),
+    0x61: lambda d: date.fromisoformat(d.raw().decode('ascii')),
+    0x68: lambda d: time.fromisoformat(d.raw().decode('ascii')),
+}
+
+
+def _check_header(header):
+    if len(header) < len(_HEADER) or header[:len(_MAGIC)] != _MAGIC:
+        raise SerializationError("Not a kronos binary encoding")
+
+    if header[len(_MAGIC)] != VERSION:
+        raise SerializationError("Unsupported encoding version {}".format(header[len(_MAGIC)]))
+
+
+def encode_binary(value):
+    """
+    Encodes a diff (or any change record value) to bytes
+    """
+    out = bytearray(_HEADER)
+    _write(out, value)
+    return bytes(out)
+
+
+def decode_binary(data):
+    """
+    Decodes a value encoded with `encode_binary`
+    """
+    data = memoryview(data)
+    _check_header(data[:len(_HEADER)])
+    return _Decoder(data, len(_HEADER)).value()
+
+
+class BinaryWriter(object):
+
+    """
+    Writes values to a binary stream, after a header with the encoding version. Each value
+    is written with its length, so readers don't need to read ahead
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.write(_HEADER)
+
+    def write(self, value):
+        out = bytearray()
+        _write(out, value)
+
+        length = bytearray()
+        _write_varint(length, len(out))
+
+        self.stream.write(length)
+        self.stream.write(out)
+
+
+class BinaryReader(object):
+
+    """
+    Iterates the values of a binary stream written by a BinaryWriter
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        _check_header(stream.read(len(_HEADER)))
+
+    def _length(self):
+        n = shift = 0
+
+        while True:
+            b = self.stream.read(1)
+            if not b:
+                if shift:
+                    raise SerializationError("Truncated stream")
+                return None
+
+            n |= (b[0] & 0x7f) << shift
+            if b[0] < 0x80:
+                return n
+            shift += 7
+
+    def __iter__(self):
+        while True:
+            length = self._length()
+            if length is None:
+                return
+
+            data = self.stream.read(length)
+            if len(data) < length:
+                raise SerializationError("Truncated stream")
+
+            yield _Decoder(data).value()
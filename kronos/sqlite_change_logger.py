@@ -0,0 +1,182 @@
+from datetime import datetime
+
+from .change_logger import ChangeLogger
+from .memory_change_logger import entity_type_name
+from .serialization import decode_binary, encode_binary
+from .sqlite_store import SQLiteConnectionMixin
+
+
+_COLUMNS = 'id, entity, entity_id, created, deleted, created_at, changes, data'
+
+
+class SQLiteChangeLogger(SQLiteConnectionMixin, ChangeLogger):
+
+    """
+    A change logger backed by a SQLite database file. The change records are indexed by
+    entity type and by entity id in creation order, so history queries are filtered,
+    sorted and limited by SQLite and their cost depends on the records they return, not
+    on the size of the log. The database runs in WAL mode, so queries don't block the
+    writers.
+
+    Change records are dicts like the ones of the MemoryChangeLogger. The diffs and the
+    extra logged data are saved with the binary encoding of kronos.serialization.
+
+    Creation times are saved as POSIX timestamps, which are in UTC: naive datetimes are
+    taken as local times. They are read back as naive local times, or as aware datetimes
+    in `timezone` when it's given, so aware times keep their instant but not their offset.
+    """
+
+    def __init__(self, path, table='kronos_changes', timeout=30.0, entity_id=None, clock=datetime.now,
+                 timezone=None):
+        """
+        Parameters:
+          - path (str): Path of the database file
+          - table (str, optional): Name of the table where changes are saved
+          - timeout (float, optional): Seconds to wait for a lock held by another process
+          - entity_id (callable, optional): Returns the id of a logged entity. Defaults to
+                its `id` attribute
+          - clock (callable, optional): Returns the creation time of the records logged
+                without a `created_at`
+          - timezone (tzinfo, optional): Time zone of the creation times of the records
+                read. Defaults to naive local times
+        """
+        self._init_connection(path, timeout)
+        self.table = table
+        self._entity_id = entity_id or (lambda entity: getattr(entity, 'id', None))
+        self._clock = clock
+        self._timezone = timezone
+
+        self._sql_insert = (
+            'INSERT INTO {} (entity, entity_id, created, deleted, created_at, changes, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)'.format(table)
+        )
+
+        with self._connection as connection:
+            # entity_id has no type so ids keep their type
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'id INTEGER PRIMARY KEY, entity TEXT NOT NULL, entity_id, created INTEGER NOT NULL, '
+                'deleted INTEGER NOT NULL, created_at REAL NOT NULL, changes BLOB, data BLOB)'.format(table)
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_entity ON {0} (entity, created_at)'.format(table)
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_entity_id ON {0} (entity, entity_id, created_at)'.format(table)
+            )
+
+    def _dumps(self, value):
+        return encode_binary(value)
+
+    def _loads(self, value):
+        return decode_binary(value)
+
+    def _entity_id_value(self, entity_id):
+        if entity_id is None or isinstance(entity_id, (str, int, float, bytes)):
+            return entity_id
+
+        return str(entity_id)
+
+    def _row(self, entity, changes, created, deleted, kwargs):
+        created_at = kwargs.pop('created_at', None) or self._clock()
+
+        return (
+            entity_type_name(entity),
+            self._entity_id_value(self._entity_id(entity)),
+            bool(created),
+            bool(deleted),
+            created_at.timestamp(),
+            self._dumps(changes) if changes is not None else None,
+            self._dumps(kwargs) if kwargs else None,
+        )
+
+    def _entry(self, row):
+        _id, entity, entity_id, created, deleted, created_at, changes, data = row
+
+        return dict(
+            self._loads(data) if data is not None else {},
+            id=_id,
+            entity=entity,
+            entity_id=entity_id,
+            created=bool(created),
+            deleted=bool(deleted),
+            created_at=datetime.fromtimestamp(created_at, self._timezone),
+            changes=self._loads(changes) if changes is not None else None,
+        )
+
+    def log(self, entity_type, changes, created=False, deleted=False, **kwargs):
+        with self._connection as connection:
+            connection.execute(self._sql_insert, self._row(entity_type, changes, created, deleted, kwargs))
+
+    def log_many(self, entries):
+        """
+        Logs several changes in a single transaction
+        """
+        rows = []
+        for entity_type, changes, kwargs in entries:
+            kwargs = dict(kwargs)
+            created = kwargs.pop('created', False)
+            deleted = kwargs.pop('deleted', False)
+            rows.append(self._row(entity_type, changes, created, deleted, kwargs))
+
+        with self._connection as connection:
+            connection.executemany(self._sql_insert, rows)
+
+    def _query(self, entity_type, entity_id=None, limit=None, date_from=None, date_to=None, asc=False,
+               cursor=None):
+        conditions = ['entity = ?']
+        params = [entity_type_name(entity_type)]
+
+        if entity_id is not None:
+            conditions.append('entity_id = ?')
+            params.append(self._entity_id_value(entity_id))
+
+        if date_from is not None:
+            conditions.append('created_at >= ?')
+            params.append(date_from.timestamp())
+
+        if date_to is not None:
+            conditions.append('created_at < ?')
+            params.append(date_to.timestamp())
+
+        if cursor is not None:
+            conditions.append('(created_at {0} ? OR (created_at = ? AND id {0} ?))'.format('>' if asc else '<'))
+            params.extend([cursor[0], cursor[0], cursor[1]])
+
+        order = 'ASC' if asc else 'DESC'
+        sql = 'SELECT {} FROM {} WHERE {} ORDER BY created_at {}, id {}'.format(
+            _COLUMNS, self.table, ' AND '.join(conditions), order, order
+        )
+
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return self._connection.execute(sql, params).fetchall()
+
+    def last_change(self, entity_type, entity_id=None):
+        rows = self._query(entity_type, entity_id, limit=1)
+        return self._entry(rows[0]) if rows else None
+
+    def first_change(self, entity_type, entity_id=None):
+        rows = self._query(entity_type, entity_id, limit=1, asc=True)
+        return self._entry(rows[0]) if rows else None
+
+    def history(self, entity_type, limit=None, date_from=None, date_to=None, asc=False, desc=True,
+                entity_id=None):
+        """
+        Returns the change records of an entity type, or of a single entity. See
+        MemoryChangeLogger.history
+        """
+        return [self._entry(row) for row in self._query(entity_type, entity_id, limit, date_from, date_to, asc)]
+
+    def page(self, entity_type, cursor=None, size=100, date_from=None, date_to=None, asc=False,
+             entity_id=None):
+        """
+        Returns a page of change records and the cursor of the next page. See
+        MemoryChangeLogger.page
+        """
+        rows = self._query(entity_type, entity_id, size + 1, date_from, date_to, asc, cursor)
+        next_cursor = (rows[size - 1][5], rows[size - 1][0]) if len(rows) > size else None
+
+        return [self._entry(row) for row in rows[:size]], next_cursor
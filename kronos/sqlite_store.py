@@ -0,0 +1,149 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+
+# Max number of parameters per query, below SQLite's SQLITE_MAX_VARIABLE_NUMBER
+_BATCH_SIZE = 500
+
+
+def sqlite_connect(path, timeout=30.0):
+    """
+    Opens a connection to a SQLite database in WAL mode, so several processes can read
+    while another one writes
+    """
+    connection = sqlite3.connect(path, timeout=timeout)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+class SQLiteConnectionMixin(object):
+
+    """
+    Keeps one connection per process and thread, since SQLite connections can't be
+    shared across threads or forked processes
+    """
+
+    def _init_connection(self, path, timeout):
+        self.path = path
+        self._timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._local.connection = sqlite_connect(self.path, self._timeout)
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+
+        self._local.connection = None
+
+
+class SQLiteStore(SQLiteConnectionMixin):
+
+    """
+    A snapshot store backed by a SQLite database file. Snapshots survive restarts and
+    are shared by every process using the same file, so an entity tracked in one process
+    can have its changes logged from another one.
+
+    Snapshots are pickled, so the file should only be shared between trusted processes.
+    """
+
+    def __init__(self, path, table='kronos_snapshots', timeout=30.0, **kwargs):
+        """
+        Parameters:
+          - path (str): Path of the database file
+          - table (str, optional): Name of the table where snapshots are saved
+          - timeout (float, optional): Seconds to wait for a lock held by another process
+        """
+        self._init_connection(path, timeout)
+        self.table = table
+
+        self._sql_has_key = 'SELECT 1 FROM {} WHERE key = ?'.format(table)
+        self._sql_get = 'SELECT value FROM {} WHERE key = ?'.format(table)
+        self._sql_get_fingerprint = 'SELECT fingerprint FROM {} WHERE key = ?'.format(table)
+        self._sql_get_many = 'SELECT key, value FROM {} WHERE key IN ({{}})'.format(table)
+        self._sql_get_fingerprints = 'SELECT key, fingerprint FROM {} WHERE key IN ({{}})'.format(table)
+        self._sql_save = 'INSERT OR REPLACE INTO {} (key, fingerprint, value) VALUES (?, ?, ?)'.format(table)
+
+        with self._connection as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} '
+                '(key TEXT PRIMARY KEY, fingerprint TEXT, value BLOB NOT NULL) WITHOUT ROWID'.format(table)
+            )
+
+    def _dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _loads(self, value):
+        return pickle.loads(value)
+
+    def _dump_fingerprint(self, fingerprint):
+        # hash trees (see Tracker's merkle option) are pickled, digests stored as text
+        if fingerprint is None or isinstance(fingerprint, str):
+            return fingerprint
+
+        return self._dumps(fingerprint)
+
+    def _load_fingerprint(self, fingerprint):
+        return self._loads(fingerprint) if isinstance(fingerprint, bytes) else fingerprint
+
+    def _select_many(self, sql, keys):
+        keys = {str(k): k for k in keys}
+        str_keys = list(keys)
+        rows = []
+
+        for i in range(0, len(str_keys), _BATCH_SIZE):
+            batch = str_keys[i:i + _BATCH_SIZE]
+            query = sql.format(','.join('?' * len(batch)))
+            rows.extend((keys[key], value) for key, value in self._connection.execute(query, batch))
+
+        return rows
+
+    def has_key(self, key):
+        return self._connection.execute(self._sql_has_key, (str(key),)).fetchone() is not None
+
+    def get(self, key):
+        row = self._connection.execute(self._sql_get, (str(key),)).fetchone()
+        return self._loads(row[0]) if row else None
+
+    def get_many(self, keys):
+        return {key: self._loads(value) for key, value in self._select_many(self._sql_get_many, keys)}
+
+    def get_fingerprint(self, key):
+        row = self._connection.execute(self._sql_get_fingerprint, (str(key),)).fetchone()
+        return self._load_fingerprint(row[0]) if row else None
+
+    def get_fingerprints(self, keys):
+        return {
+            key: self._load_fingerprint(fingerprint) for key, fingerprint in self._select_many(self._sql_get_fingerprints, keys)
+            if fingerprint is not None
+        }
+
+    def save(self, key, value, fingerprint=None):
+        with self._connection as connection:
+            connection.execute(self._sql_save, (str(key), self._dump_fingerprint(fingerprint), self._dumps(value)))
+
+    def save_many(self, items):
+        """
+        Saves several snapshots in a single transaction. Items are (key, value) or
+        (key, value, fingerprint) tuples
+        """
+        rows = (
+            (str(item[0]), self._dump_fingerprint(item[2] if len(item) > 2 else None), self._dumps(item[1]))
+            for item in items
+        )
+
+        with self._connection as connection:
+            connection.executemany(self._sql_save, rows)
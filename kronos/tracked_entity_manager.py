@@ -3,9 +3,9 @@ from .tracker import Tracker
 
 class TrackedEntityManager(Tracker):
 
-    def __init__(self, entity_manager, comparator, change_logger, store=None):
+    def __init__(self, entity_manager, comparator, change_logger, store=None, **tracker_kwargs):
         self.manager = entity_manager
-        super(TrackedEntityManager, self).__init__(comparator, change_logger, store)
+        super(TrackedEntityManager, self).__init__(comparator, change_logger, store, **tracker_kwargs)
 
     def get_by_id(self, _id):
         entity = self.manager.get_by_id(_id)
@@ -20,14 +20,32 @@ class TrackedEntityManager(Tracker):
     def get_many(self, query):
         for r in self.manager.get_many(query):
             self.track_entity(r)
-            yield entity
+            yield r
 
     def save(self, entity, **log_data):
         self.log_changes(entity, **log_data)
         saved_entity = self.manager.save(entity)
         return saved_entity
 
+    def save_many(self, entities, **log_data):
+        entities = list(entities)
+        self.log_changes_many(entities, **log_data)
+
+        if hasattr(self.manager, 'save_many'):
+            return self.manager.save_many(entities)
+
+        return [self.manager.save(entity) for entity in entities]
+
     def delete(self, entity, **log_data):
         self.log_changes(entity, deleted=True, **log_data)
         saved_entity = self.manager.delete(entity)
         return saved_entity
+
+    def delete_many(self, entities, **log_data):
+        entities = list(entities)
+        self.log_changes_many(entities, deleted=True, **log_data)
+
+        if hasattr(self.manager, 'delete_many'):
+            return self.manager.delete_many(entities)
+
+        return [self.manager.delete(entity) for entity in entities]
@@ -1,24 +1,51 @@
-import json
-
-from hashlib import sha1
+import inspect
 
+from .diff import Diff
+from .dirty import dirty_state, is_dirty_trackable, select_paths, start_tracking
 from .errors import KronosError
 from .dict_store import DictStore
+from .instrumentation import NULL_INSTRUMENTATION, InstrumentedProxy
+from .utils import HashTree, fingerprint, hash_tree, snapshot_copy
 
 
 class EntityConflictError(KronosError):
     pass
 
 
+_MISSING = object()
+
+
+def _same_state(tracked_entity, entity_dict):
+    """
+    Compares a tracked snapshot with an entity dict regardless of the order of their fields
+    (OrderedDicts only compare equal with the same order)
+    """
+    return dict(tracked_entity) == dict(entity_dict)
+
+
+def _accepts_argument(func, name):
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+
+    return any(p.name == name or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
 class Tracker(object):
 
     """
     This class allows you to track the state of a given entity. By recording the state in
     a given moment, later on we can get the changes of the current state compared to the
     originally tracked state and keep a record of those change by logging them
+
+    Entities of classes decorated with `kronos.dirty.dirty_trackable` record which fields
+    are touched after being tracked, so only those fields are diffed, and untouched
+    entities are neither converted nor diffed
     """
 
-    def __init__(self, comparator, change_logger, store=None):
+    def __init__(self, comparator, change_logger, store=None, merkle=False, large_value_size=None,
+                 instrumentation=None, fingerprints=False):
         """
         Builds a tracker
 
@@ -31,31 +58,261 @@ class Tracker(object):
           - change_logger (object): The object in charge of keeping a record
                 of the entity's changes. The logger should implement:
                   - log (required): The method that stores the change records for the entity
+                  - log_many (optional): Stores the change records of several entities at once
 
           - store (object, optional): The backend used to store the entities snapshots
                 used for comparisson. The store should implement:
                   - has_key (required): Method to check for existence of a key
                   - get (required): Method to retrieve the value of a key
                   - save (required): Method to save a key/value pair
+                  - get_many (optional): Method to retrieve the values of several keys at once
+                  - save_many (optional): Method to save several key/value pairs at once
+                  - get_fingerprint (optional): Method to retrieve the content fingerprint
+                        saved along with a snapshot. Stores implementing it should accept
+                        a `fingerprint` argument on save and (key, value, fingerprint)
+                        items on save_many
+                  - get_fingerprints (optional): Method to retrieve the fingerprints of
+                        several keys at once
+                  - changes (optional): Method that, given (key, entity_dict) pairs, returns
+                        the set of changed fields of every tracked key. Used by the batch
+                        methods to only diff the entities that changed
+
+          - merkle (bool, optional): Save a hash of every nested dict and list along with
+                the snapshots (needs a store with fingerprints, implies `fingerprints`), so the diffs skip the
+                nested values that didn't change. The comparator's diff should accept a
+                `trees` argument, like the EntityComparator
+
+          - large_value_size (int, optional): Texts and bytes longer than this are saved in
+                the snapshots as their ValueDigest (digest and length). The DiffHelper
+                compares them by digest. Use the same size as its `large_value_size` so
+                the diffs carry the digests too
+
+          - instrumentation (Instrumentation, optional): Receives the time spent in each
+                phase (conversion, key building, store calls, diffs and change logs) and
+                the tracker counters. See kronos.instrumentation
+
+          - fingerprints (bool, optional): Save a content fingerprint along with the
+                snapshots (needs a store with fingerprints), so unchanged entities are
+                detected without diffing them. Hashing the whole entity on every track
+                and log is only worth it when most logs find no changes and the
+                entities have no large texts or bytes
         """
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
         self.comparator = comparator
         self.change_logger = change_logger
         self._store = store or DictStore()
 
-    def _entity_id(self, entity, entity_dict):
+        if self.instrumentation.enabled:
+            self.comparator = InstrumentedProxy(comparator, self.instrumentation, 'comparator')
+            self.change_logger = InstrumentedProxy(change_logger, self.instrumentation, 'change_logger')
+            self._store = InstrumentedProxy(self._store, self.instrumentation, 'store')
+        self._use_fingerprints = (fingerprints or merkle) and hasattr(self._store, 'get_fingerprint')
+        self._merkle = merkle and self._use_fingerprints
+        self._large_value_size = large_value_size
+
+        # comparators that take the converted entity don't need to convert it again
+        self._diff_takes_entity_dict = _accepts_argument(getattr(self.comparator, 'diff', None), 'entity_dict')
+
+    def _entity_id(self, entity, entity_dict, entity_fingerprint=None):
         _id = None
 
-        if getattr(self.comparator, 'entity_id'):
+        if getattr(self.comparator, 'entity_id', None):
             _id = self.comparator.entity_id(entity)
 
         if not _id:
-            auto_generated_id = sha1(json.dumps(entity_dict).encode()).hexdigest()
-            _id = getattr(entity, 'id', auto_generated_id)
+            _id = getattr(entity, 'id', _MISSING)
+
+            if _id is _MISSING:
+                # the content fingerprint, reused when it was already calculated
+                if isinstance(entity_fingerprint, HashTree):
+                    _id = entity_fingerprint.digest
+                else:
+                    _id = entity_fingerprint or fingerprint(entity_dict)
 
         return _id
 
-    def _build_entity_key(self, entity, entity_dict):
-        return "{}-{}".format(entity.__class__.__name__, self._entity_id(entity, entity_dict))
+    def _build_entity_key(self, entity, entity_dict, entity_fingerprint=None):
+        return "{}-{}".format(
+            entity.__class__.__name__, self._entity_id(entity, entity_dict, entity_fingerprint)
+        )
+
+    def _fingerprint(self, entity_dict):
+        if not self._use_fingerprints:
+            return None
+
+        try:
+            return hash_tree(entity_dict) if self._merkle else fingerprint(entity_dict)
+        except TypeError:
+            # entities with values that can't be fingerprinted are always diffed
+            return None
+
+    def _snapshot_copy(self, entity_dict):
+        return snapshot_copy(entity_dict, self._large_value_size)
+
+    def _snapshot_item(self, key, entity_dict, entity_fingerprint):
+        if self._use_fingerprints:
+            return key, self._snapshot_copy(entity_dict), entity_fingerprint
+
+        return key, self._snapshot_copy(entity_dict)
+
+    def _store_get_many(self, keys):
+        if hasattr(self._store, 'get_many'):
+            return self._store.get_many(keys)
+
+        snapshots = {}
+        for key in keys:
+            snapshot = self._store.get(key)
+            if snapshot is not None:
+                snapshots[key] = snapshot
+
+        return snapshots
+
+    def _store_get_fingerprints(self, keys):
+        if not self._use_fingerprints:
+            return {}
+
+        if hasattr(self._store, 'get_fingerprints'):
+            return self._store.get_fingerprints(keys)
+
+        fingerprints = {}
+        for key in keys:
+            entity_fingerprint = self._store.get_fingerprint(key)
+            if entity_fingerprint is not None:
+                fingerprints[key] = entity_fingerprint
+
+        return fingerprints
+
+    def _store_save(self, key, entity_dict, entity_fingerprint):
+        if self._use_fingerprints:
+            self._store.save(key, self._snapshot_copy(entity_dict), fingerprint=entity_fingerprint)
+
+        else:
+            self._store.save(key, self._snapshot_copy(entity_dict))
+
+    def _store_save_many(self, items):
+        if hasattr(self._store, 'save_many'):
+            self._store.save_many(items)
+
+        else:
+            for item in items:
+                if len(item) > 2:
+                    self._store.save(item[0], item[1], fingerprint=item[2])
+                else:
+                    self._store.save(*item)
+
+    def _unchanged_keys(self, snapshots):
+        """
+        Returns the keys of the snapshots that are known to be unchanged, either by
+        their fingerprints or by the store's bulk change detection, and the stored
+        fingerprints by key
+        """
+        if hasattr(self._store, 'changes'):
+            changed = self._store.changes([(key, entity_dict) for _, key, entity_dict, _ in snapshots])
+            return set(key for key, fields in changed.items() if not fields), {}
+
+        fingerprints = self._store_get_fingerprints([key for _, key, _, _ in snapshots])
+
+        unchanged = set(
+            key for _, key, _, entity_fingerprint in snapshots
+            if key in fingerprints and fingerprints[key] == entity_fingerprint
+        )
+
+        return unchanged, fingerprints
+
+    def _is_tracked_unchanged(self, entity_key, entity_fingerprint):
+        """
+        Uses the stored fingerprint to tell if the tracked snapshot is equal to the
+        current state without comparing them. Returns None when it can't tell
+        """
+        if entity_fingerprint is None:
+            return None
+
+        stored_fingerprint = self._store.get_fingerprint(entity_key)
+
+        if stored_fingerprint is None:
+            return None
+
+        return stored_fingerprint == entity_fingerprint
+
+    def _tracked_diff(self, entity, entity_dict, tracked_entity, entity_fingerprint=None, stored_fingerprint=None):
+        """
+        Diffs the entity against its tracked snapshot, reusing the entity dict when the
+        comparator takes it, and skipping the unchanged nested values when both have
+        hash trees
+        """
+        kwargs = {}
+
+        if self._diff_takes_entity_dict:
+            kwargs['entity_dict'] = entity_dict
+
+        if isinstance(entity_fingerprint, HashTree) and isinstance(stored_fingerprint, HashTree):
+            kwargs['trees'] = (entity_fingerprint, stored_fingerprint)
+
+        return self.comparator.diff(entity, tracked_entity, **kwargs)
+
+    def _diff_item(self, entity, entity_dict, tracked_entity, entity_fingerprint, stored_fingerprint, paths=None):
+        """
+        Returns the _tracked_diffs item of an entity. When the dirty `paths` are given, only
+        those are compared, as in _dirty_entity_diff
+        """
+        if not paths:
+            return entity, entity_dict, tracked_entity, entity_fingerprint, stored_fingerprint
+
+        entity_dict, tracked_entity = select_paths(entity_dict, tracked_entity, paths)
+
+        return entity if self._diff_takes_entity_dict else entity_dict, entity_dict, tracked_entity, None, None
+
+    def _tracked_diffs(self, items):
+        """
+        Diffs several entities against their tracked snapshots. Items are (entity,
+        entity_dict, tracked_entity, fingerprint, stored_fingerprint) tuples. The diffs are
+        calculated at once when the comparator implements `diff_many`
+        """
+        if not hasattr(self.comparator, 'diff_many') or self._merkle:
+            return [self._tracked_diff(*item) for item in items]
+
+        return self.comparator.diff_many([
+            (entity, tracked_entity, entity_dict) if self._diff_takes_entity_dict else (entity, tracked_entity)
+            for entity, entity_dict, tracked_entity, _, _ in items
+        ])
+
+    def _count_empty_diffs(self, diffs):
+        if self.instrumentation.enabled:
+            empty = sum(1 for diff in diffs if getattr(diff, 'empty', False))
+            if empty:
+                self.instrumentation.increment('empty_diffs', empty)
+
+    def _start_dirty_tracking(self, entity, entity_key):
+        if is_dirty_trackable(entity):
+            start_tracking(entity, entity_key, self)
+
+    def _dirty_state(self, entity):
+        return dirty_state(entity, self) if is_dirty_trackable(entity) else None
+
+    def _log_many(self, entries):
+        if hasattr(self.change_logger, 'log_many'):
+            self.change_logger.log_many(entries)
+
+        else:
+            for entity, changes, log_kwargs in entries:
+                self.change_logger.log(entity, changes, **log_kwargs)
+
+    def _snapshot(self, entity):
+        """
+        Converts the entity and returns an (entity, key, entity_dict, fingerprint) tuple
+        """
+        entity_dict = self.comparator.entity_to_dict(entity)
+
+        with self.instrumentation.span('tracker.fingerprint'):
+            entity_fingerprint = self._fingerprint(entity_dict)
+
+        with self.instrumentation.span('tracker.entity_id'):
+            entity_key = self._build_entity_key(entity, entity_dict, entity_fingerprint)
+
+        return entity, entity_key, entity_dict, entity_fingerprint
+
+    def _snapshots(self, entities):
+        return [self._snapshot(entity) for entity in entities]
 
     def track_entity(self, entity, override=False):
         """
@@ -68,18 +325,61 @@ class Tracker(object):
           - override (bool): Skip any checks for a current snapshot of the entity and
                              override it with the current one
         """
-        entity_dict = self.comparator.entity_to_dict(entity)
+        self._track_snapshot(self._snapshot(entity), override=override)
 
-        entity_key = self._build_entity_key(entity, entity_dict)
+    def _track_snapshot(self, snapshot, override=False):
+        entity, entity_key, entity_dict, entity_fingerprint = snapshot
 
         if not override and self._store.has_key(entity_key):
-            if self._store.get(entity_key) != entity_dict:
+            unchanged = self._is_tracked_unchanged(entity_key, entity_fingerprint)
+
+            if unchanged is None:
+                # the snapshot might have been evicted after checking for it
+                tracked_entity = self._store.get(entity_key)
+                unchanged = tracked_entity is None or _same_state(tracked_entity, entity_dict)
+
+            if not unchanged:
+                self.instrumentation.increment('conflicts')
                 raise EntityConflictError(
                     "The entity is already been tracked and has changes. " \
                     "Save it to track those changes or log the current changes first"
                 )
 
-        self._store.save(entity_key, entity_dict)
+        self._store_save(entity_key, entity_dict, entity_fingerprint)
+        self._start_dirty_tracking(entity, entity_key)
+        self.instrumentation.increment('entities_tracked')
+
+    def track_many(self, entities, override=False):
+        """
+        Start tracking the state of several entities at once. Works like `track_entity`
+        but fetches and saves all the snapshots in a single call when the store
+        supports `get_many`/`save_many`
+
+        Parameters:
+          - entities (iterable): The entities to keep track of
+          - override (bool): Skip any checks for current snapshots of the entities and
+                             override them with the current ones
+        """
+        snapshots = self._snapshots(entities)
+
+        if not override:
+            unchanged, _ = self._unchanged_keys(snapshots)
+            tracked = self._store_get_many([key for _, key, _, _ in snapshots if key not in unchanged])
+
+            for _, key, entity_dict, _ in snapshots:
+                if key in tracked and not _same_state(tracked[key], entity_dict):
+                    self.instrumentation.increment('conflicts')
+                    raise EntityConflictError(
+                        "The entity is already been tracked and has changes. " \
+                        "Save it to track those changes or log the current changes first"
+                    )
+
+        self._store_save_many([self._snapshot_item(*snapshot[1:]) for snapshot in snapshots])
+
+        for entity, key, _, _ in snapshots:
+            self._start_dirty_tracking(entity, key)
+
+        self.instrumentation.increment('entities_tracked', len(snapshots))
 
     def get_entity_diff(self, entity):
         """
@@ -92,16 +392,83 @@ class Tracker(object):
         Returns:
           A Diff object
         """
+        state = self._dirty_state(entity)
+
+        if state is not None and not state[1]:
+            # untouched dirty trackable entities don't need to be converted
+            return Diff()
+
+        return self._snapshot_diff(self._snapshot(entity), state[1] if state else None)
+
+    def _snapshot_diff(self, snapshot, paths=None):
+        """
+        Calculates the diff of a snapshot against the tracked one. When the dirty `paths`
+        are given, only those are compared
+        """
         diff = None
+        entity, entity_key, entity_dict, entity_fingerprint = snapshot
 
-        entity_dict = self.comparator.entity_to_dict(entity)
-        tracked_entity = self._store.get(self._build_entity_key(entity, entity_dict))
+        if paths:
+            return self._dirty_entity_diff(entity, entity_key, entity_dict, paths)
+
+        stored_fingerprint = None
+        if entity_fingerprint is not None:
+            stored_fingerprint = self._store.get_fingerprint(entity_key)
+
+            if stored_fingerprint is not None and stored_fingerprint == entity_fingerprint:
+                return Diff()
+
+        tracked_entity = self._store.get(entity_key)
 
         if tracked_entity:
-            diff = self.comparator.diff(entity, tracked_entity)
+            diff = self._tracked_diff(entity, entity_dict, tracked_entity, entity_fingerprint, stored_fingerprint)
 
         return diff
 
+    def has_changes(self, entity):
+        """
+        Tells if the entity changed since it was tracked, without building the diff. The
+        check stops at the first change, and unchanged entities are detected by their
+        fingerprint when the store saves them
+
+        Parameters:
+          - entity (object): The entity to check
+
+        Returns:
+          True or False, or None if the entity is not tracked
+        """
+        state = self._dirty_state(entity)
+
+        if state is not None and not state[1]:
+            return False
+
+        entity, entity_key, entity_dict, entity_fingerprint = self._snapshot(entity)
+
+        if entity_fingerprint is not None and self._store.get_fingerprint(entity_key) == entity_fingerprint:
+            return False
+
+        tracked_entity = self._store.get(entity_key)
+
+        if tracked_entity is None:
+            return None
+
+        if state is not None:
+            entity_dict, tracked_entity = select_paths(entity_dict, tracked_entity, state[1])
+
+        if hasattr(self.comparator, 'has_changes'):
+            return self.comparator.has_changes(entity, tracked_entity, entity_dict=entity_dict)
+
+        return not self._tracked_diff(entity, entity_dict, tracked_entity).empty
+
+    def _dirty_entity_diff(self, entity, entity_key, entity_dict, paths):
+        """
+        Calculates the diff of a dirty trackable entity, only comparing the touched paths
+        """
+        tracked_entity = self._store.get(entity_key)
+
+        if tracked_entity:
+            return self._tracked_diff(*self._diff_item(entity, entity_dict, tracked_entity, None, None, paths))
+
     def log_changes(self, entity, created=False, deleted=False, **log_data):
         """
         Given an entity, logs any existing changes between the current state
@@ -133,11 +500,119 @@ class Tracker(object):
             self.change_logger.log(entity, None, deleted=deleted, **log_data)
 
         else:
-            diff = self.get_entity_diff(entity)
+            state = self._dirty_state(entity)
+
+            if state is not None and not state[1]:
+                # untouched dirty trackable entities don't need to be converted
+                diff = Diff()
+                self._count_empty_diffs([diff])
+                self.change_logger.log(entity, diff, **log_data)
+                return diff
+
+            snapshot = self._snapshot(entity)
+            diff = self._snapshot_diff(snapshot, state[1] if state else None)
+            self._count_empty_diffs([diff])
 
             if diff:
                 self.change_logger.log(entity, diff, **log_data)
-                # update the tracked entity with the latest state
-                self.track_entity(entity, override=True)
+
+                if not getattr(diff, 'empty', False):
+                    # update the tracked entity with the latest state
+                    self._track_snapshot(snapshot, override=True)
+
+                elif state is not None:
+                    self._start_dirty_tracking(entity, snapshot[1])
 
         return diff
+
+    def log_changes_many(self, entities, created=False, deleted=False, **log_data):
+        """
+        Given several entities, logs any existing changes between their current state
+        and the previously tracked snapshots. Works like `log_changes` but reads and
+        updates the snapshots and logs the changes in batches when the store and the
+        change logger support it
+
+        Parameters:
+          - entities (iterable): The entities to log changes for
+          - created (bool, optional): If the entities are been created
+          - deleted (bool, optional): If the entities are been deleted
+          - log_data (dict, optional): An extra metadata to be included in the change logs
+
+        Returns:
+          A list with the Diff object of each entity, in the same order as the given entities
+        """
+        entities = list(entities)
+        diffs = [None] * len(entities)
+        entries = []
+
+        if created:
+            for i, entity in enumerate(entities):
+                diffs[i] = self.comparator.diff(entity, {})
+                entries.append((entity, diffs[i], dict(log_data, created=created)))
+
+            self._log_many(entries)
+
+        elif deleted:
+            entries = [(entity, None, dict(log_data, deleted=deleted)) for entity in entities]
+            self._log_many(entries)
+
+        else:
+            states = [self._dirty_state(entity) for entity in entities]
+
+            # untouched dirty trackable entities don't need to be converted
+            untouched = set(i for i, state in enumerate(states) if state is not None and not state[1])
+            positions = [i for i in range(len(entities)) if i not in untouched]
+
+            snapshots = self._snapshots(entities[i] for i in positions)
+            unchanged, fingerprints = self._unchanged_keys(snapshots)
+            tracked = self._store_get_many([key for _, key, _, _ in snapshots if key not in unchanged])
+            updated = []
+
+            snapshots = dict(zip(positions, snapshots))
+
+            changed = [
+                i for i in positions
+                if snapshots[i][1] not in unchanged and tracked.get(snapshots[i][1])
+            ]
+            changed_diffs = self._tracked_diffs([
+                self._diff_item(
+                    entities[i], snapshots[i][2], tracked[snapshots[i][1]], snapshots[i][3],
+                    fingerprints.get(snapshots[i][1]), states[i][1] if states[i] else None
+                )
+                for i in changed
+            ])
+            changed_diffs = dict(zip(changed, changed_diffs))
+
+            for i, entity in enumerate(entities):
+                if i in untouched:
+                    diffs[i] = Diff()
+                    entries.append((entity, diffs[i], dict(log_data)))
+                    continue
+
+                _, key, entity_dict, entity_fingerprint = snapshots[i]
+
+                if key in unchanged:
+                    diffs[i] = Diff()
+                    entries.append((entity, diffs[i], dict(log_data)))
+                    self._start_dirty_tracking(entity, key)
+                    continue
+
+                if i in changed_diffs:
+                    diffs[i] = changed_diffs[i]
+                    entries.append((entity, diffs[i], dict(log_data)))
+
+                    if not getattr(diffs[i], 'empty', False):
+                        updated.append(self._snapshot_item(key, entity_dict, entity_fingerprint))
+
+                    self._start_dirty_tracking(entity, key)
+
+            self._count_empty_diffs(diffs)
+
+            if entries:
+                self._log_many(entries)
+
+            if updated:
+                # update the tracked entities with their latest state
+                self._store_save_many(updated)
+
+        return diffs
@@ -1,3 +1,8 @@
+from copy import copy
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from hashlib import sha1
 
 
 def serializable_dict(d):
@@ -24,3 +29,286 @@ def serializable_dict(d):
         _d[k] = _safe_value(v)
 
     return _d
+
+
+def _object_fields(value):
+    if hasattr(value, '__dict__'):
+        return vars(value)
+
+    slots = [
+        name for cls in type(value).__mro__ for name in getattr(cls, '__slots__', ())
+        if name != '__weakref__'
+    ]
+
+    return {name: getattr(value, name) for name in slots if hasattr(value, name)} if slots else None
+
+
+def _encoded(value):
+    chunks = []
+    _encode(value, chunks.append)
+
+    try:
+        return ''.join(chunks).encode('utf-8', 'surrogatepass')
+    except TypeError:
+        # bytes values are written as they are, without decoding them
+        return b''.join(
+            chunk.encode('utf-8', 'surrogatepass') if isinstance(chunk, str) else chunk for chunk in chunks
+        )
+
+
+def _encode(value, write):
+    """
+    Writes the canonical encoding of a value. Every value is tagged with its type and
+    every text and container with its length, so values of different types never get the
+    same encoding. Dicts and sets are sorted, so equal values get equal encodings
+    """
+    cls = type(value)
+
+    if cls is str:
+        write('s%d:' % len(value))
+        write(value)
+    elif cls is int:
+        write('i%d;' % value)
+    elif cls is dict:
+        _encode_dict(value, write)
+    elif cls is list or cls is tuple:
+        write('%s%d:' % ('l' if cls is list else 't', len(value)))
+        for element in value:
+            _encode(element, write)
+    elif value is None:
+        write('N')
+    elif cls is bool:
+        write('T' if value else 'F')
+    elif cls is float:
+        write('f%r;' % value)
+    else:
+        _encode_other(value, write)
+
+
+def _encode_dict(value, write):
+    write('d%d:' % len(value))
+
+    if all(type(k) is str for k in value):
+        for k in sorted(value):
+            write('s%d:' % len(k))
+            write(k)
+            _encode(value[k], write)
+    else:
+        for k, v in sorted(((_encoded(k), v) for k, v in value.items()), key=lambda item: item[0]):
+            write(k)
+            _encode(v, write)
+
+
+def _encode_other(value, write):
+    if isinstance(value, (bytes, bytearray)):
+        write('b%d:' % len(value))
+        write(value)
+    elif isinstance(value, Enum):
+        write('e')
+        _encode('{}.{}'.format(type(value).__module__, type(value).__qualname__), write)
+        _encode(value.value, write)
+    elif isinstance(value, bool):
+        write('T' if value else 'F')
+    elif isinstance(value, int):
+        write('i%d;' % value)
+    elif isinstance(value, float):
+        write('f%r;' % float(value))
+    elif isinstance(value, str):
+        _encode(str(value), write)
+    elif isinstance(value, Decimal):
+        write('M')
+        _encode(str(value), write)
+    elif isinstance(value, datetime):
+        write('A')
+        _encode(value.isoformat(), write)
+    elif isinstance(value, date):
+        write('a')
+        _encode(value.isoformat(), write)
+    elif isinstance(value, time):
+        write('h')
+        _encode(value.isoformat(), write)
+    elif isinstance(value, (ValueDigest, _TreeDigest)):
+        write('V' if isinstance(value, ValueDigest) else 'H')
+        _encode(value.digest, write)
+    elif isinstance(value, dict):
+        _encode_dict(value, write)
+    elif isinstance(value, (list, tuple)):
+        _encode(list(value) if isinstance(value, list) else tuple(value), write)
+    elif isinstance(value, (set, frozenset)):
+        write('S%d:' % len(value))
+        for element in sorted(_encoded(e) for e in value):
+            write(element)
+    else:
+        fields = _object_fields(value)
+        if fields is None:
+            raise TypeError('Can\'t fingerprint a value of type {}'.format(type(value).__name__))
+
+        write('o')
+        _encode('{}.{}'.format(type(value).__module__, type(value).__qualname__), write)
+        _encode(fields, write)
+
+
+def fingerprint(value):
+    """
+    Builds a content fingerprint of a value. Equal values have equal fingerprints,
+    so comparing fingerprints is enough to tell whether a value has changed. Raises
+    TypeError for values that can't be fingerprinted (objects without attributes)
+    """
+    return sha1(_encoded(value)).hexdigest()
+
+
+def is_large_value(value, max_value_size):
+    """
+    Tells if a value is a text or bytes longer than max_value_size
+    """
+    return max_value_size is not None and isinstance(value, (str, bytes, bytearray)) and \
+        len(value) > max_value_size
+
+
+def snapshot_copy(value, max_value_size=None):
+    """
+    Copies the containers (dicts, lists, sets, tuples) of a value so the snapshot
+    doesn't share any mutable state with the entity it was taken from. Texts and bytes
+    longer than max_value_size are replaced by their ValueDigest
+    """
+    if isinstance(value, dict):
+        copied = copy(value)
+        for k, v in value.items():
+            copied[k] = snapshot_copy(v, max_value_size)
+        return copied
+
+    elif isinstance(value, list):
+        copied = copy(value)
+        copied[:] = [snapshot_copy(e, max_value_size) for e in value]
+        return copied
+
+    elif isinstance(value, (set, frozenset)):
+        return value.__class__(snapshot_copy(e, max_value_size) for e in value)
+
+    elif isinstance(value, tuple):
+        items = [snapshot_copy(e, max_value_size) for e in value]
+        return value._make(items) if hasattr(value, '_make') else value.__class__(items)
+
+    elif is_large_value(value, max_value_size):
+        return value_digest(value)
+
+    return value
+
+
+class HashTree(object):
+
+    """
+    Content fingerprint of a dict or list, with the fingerprints of its nested dicts and
+    lists in `children` (by field name, only for dicts). Two hash trees are equal when
+    their digests are equal
+    """
+
+    __slots__ = ('digest', 'children')
+
+    def __init__(self, digest, children=None):
+        self.digest = digest
+        self.children = children or {}
+
+    def __eq__(self, other):
+        return isinstance(other, HashTree) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __getstate__(self):
+        return self.digest, self.children
+
+    def __setstate__(self, state):
+        self.digest, self.children = state
+
+    def __repr__(self):
+        return 'HashTree({!r})'.format(self.digest)
+
+
+class _TreeDigest(object):
+
+    __slots__ = ('digest',)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+
+def hash_tree(value):
+    """
+    Builds the HashTree of a dict or list. Every level is fingerprinted with the digests of
+    its nested containers in place of their content, so each value is encoded once
+    """
+    children = {}
+
+    if isinstance(value, dict):
+        content = {}
+        for k, v in value.items():
+            if isinstance(v, (dict, list, tuple)):
+                children[k] = hash_tree(v)
+                content[k] = _TreeDigest(children[k].digest)
+            else:
+                content[k] = v
+
+    else:
+        content = [
+            _TreeDigest(hash_tree(e).digest) if isinstance(e, (dict, list, tuple)) else e
+            for e in value
+        ]
+        if isinstance(value, tuple):
+            content = tuple(content)
+
+    return HashTree(fingerprint(content), children if isinstance(value, dict) else None)
+
+
+class ValueDigest(object):
+
+    """
+    Stands for a value in a snapshot or a diff that is compared only by its fingerprint,
+    instead of keeping and walking all its content. `length` is the length of the value.
+    Two value digests are equal when their digests are equal
+    """
+
+    __slots__ = ('digest', 'length')
+
+    def __init__(self, digest, length=None):
+        self.digest = digest
+        self.length = length
+
+    def __eq__(self, other):
+        return isinstance(other, ValueDigest) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __getstate__(self):
+        return self.digest, self.length
+
+    def __setstate__(self, state):
+        self.digest, self.length = state
+
+    def __repr__(self):
+        return 'ValueDigest({!r}, length={!r})'.format(self.digest, self.length)
+
+
+def value_digest(value):
+    """
+    Returns the ValueDigest of a value. Texts and bytes are hashed as they are, without
+    serializing them
+    """
+    if isinstance(value, ValueDigest):
+        return value
+
+    if isinstance(value, str):
+        digest = sha1(value.encode('utf-8', 'surrogatepass')).hexdigest()
+    elif isinstance(value, (bytes, bytearray)):
+        digest = sha1(value).hexdigest()
+    else:
+        digest = fingerprint(value)
+
+    return ValueDigest(digest, len(value) if hasattr(value, '__len__') else None)
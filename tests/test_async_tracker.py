@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from kronos.async_tracker import (
+    AsyncChangeLoggerAdapter, AsyncStoreAdapter, AsyncTracker, AsyncTrackedEntityManager
+)
+from kronos.comparator import EntityComparator
+from kronos.dict_store import DictStore
+from kronos.tracker import EntityConflictError
+from kronos.utils import ValueDigest
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class AsyncEntityManager:
+    def __init__(self, entities):
+        self.entities = {e.id: e for e in entities}
+        self.calls = []
+
+    async def get_by_id(self, _id):
+        return self.entities[_id]
+
+    async def save(self, entity):
+        self.calls.append('save')
+        await asyncio.sleep(0)
+        entity.name = 'saved'
+        return entity
+
+    async def delete(self, entity):
+        self.calls.append('delete')
+        await asyncio.sleep(0)
+        return self.entities.pop(entity.id)
+
+
+class FailingEntityManager(AsyncEntityManager):
+    async def save(self, entity):
+        await asyncio.sleep(0)
+        raise IOError('save failed')
+
+
+class SlowChangeLogger:
+    def __init__(self, calls):
+        self.calls = calls
+        self.entries = []
+
+    async def log(self, entity, changes, **kwargs):
+        self.calls.append('log')
+        await asyncio.sleep(0)
+        self.entries.append((entity, changes, kwargs))
+
+
+def test_async_tracker_with_sync_adapters():
+    change_logger = mock.MagicMock(spec=['log'])
+    tracker = AsyncTracker(
+        EntityComparator(),
+        AsyncChangeLoggerAdapter(change_logger),
+        store=AsyncStoreAdapter(DictStore()),
+    )
+    entities = [Entity(i, 'test') for i in range(3)]
+
+    async def run():
+        await tracker.track_many(entities)
+        await tracker.track_entity(entities[0])
+
+        entities[0].name = 'new name'
+
+        with pytest.raises(EntityConflictError):
+            await tracker.track_entity(entities[0])
+
+        diff = await tracker.log_changes(entities[0], user='test')
+        diffs = await tracker.log_changes_many(entities)
+
+        return diff, diffs
+
+    diff, diffs = asyncio.run(run())
+
+    assert 1 == len(diff.updated)
+    assert all(d.empty for d in diffs)
+    assert 4 == change_logger.log.call_count
+    change_logger.log.assert_any_call(entities[0], diff, user='test')
+
+
+def test_async_manager_logs_after_save():
+    entity = Entity(1, 'test')
+    manager = AsyncEntityManager([entity])
+    change_logger = SlowChangeLogger(manager.calls)
+    tracked_manager = AsyncTrackedEntityManager(manager, EntityComparator(), change_logger)
+
+    async def run():
+        loaded = await tracked_manager.get_by_id(1)
+        loaded.name = 'new name'
+        return await tracked_manager.save(loaded)
+
+    saved = asyncio.run(run())
+
+    assert saved is entity
+    assert ['save', 'log'] == manager.calls
+
+    # the logged diff is the state before saving
+    _, diff, _ = change_logger.entries[0]
+    assert 'new name' == diff.updated[0].value
+
+
+def test_async_manager_doesnt_log_failed_saves():
+    entity = Entity(1, 'test')
+    change_logger = SlowChangeLogger([])
+    tracked_manager = AsyncTrackedEntityManager(FailingEntityManager([entity]), EntityComparator(), change_logger)
+
+    async def run():
+        loaded = await tracked_manager.get_by_id(1)
+        loaded.name = 'new name'
+
+        with pytest.raises(IOError):
+            await tracked_manager.save(loaded)
+
+        with pytest.raises(IOError):
+            await tracked_manager.save_many([loaded])
+
+        return await tracked_manager.has_changes(loaded)
+
+    # the tracked snapshot is not updated either
+    assert asyncio.run(run()) is True
+    assert [] == change_logger.entries
+
+
+def test_async_manager_delete_many():
+    entities = [Entity(i, 'test') for i in range(3)]
+    manager = AsyncEntityManager(entities)
+    change_logger = SlowChangeLogger(manager.calls)
+    tracked_manager = AsyncTrackedEntityManager(manager, EntityComparator(), change_logger)
+
+    deleted = asyncio.run(tracked_manager.delete_many(entities[:2], user='test'))
+
+    assert entities[:2] == deleted
+    assert ['delete', 'delete', 'log', 'log'] == manager.calls
+    assert [(e, None, dict(user='test', deleted=True)) for e in entities[:2]] == change_logger.entries
+
+
+def test_async_has_changes():
+    tracker = AsyncTracker(EntityComparator(), SlowChangeLogger([]))
+    entity = Entity(1, 'test')
+
+    async def run():
+        results = [await tracker.has_changes(entity)]
+
+        await tracker.track_entity(entity)
+        results.append(await tracker.has_changes(entity))
+
+        entity.name = 'new name'
+        results.append(await tracker.has_changes(entity))
+
+        return results
+
+    assert [None, False, True] == asyncio.run(run())
+
+
+def test_async_manager_passes_tracker_arguments():
+    manager = AsyncEntityManager([Entity(1, 'x' * 200)])
+    store = DictStore()
+    tracked_manager = AsyncTrackedEntityManager(
+        manager, EntityComparator(), SlowChangeLogger([]), store=AsyncStoreAdapter(store, in_executor=False),
+        large_value_size=100,
+    )
+
+    asyncio.run(tracked_manager.get_by_id(1))
+
+    assert isinstance(store.get('Entity-1')['name'], ValueDigest)
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from benchmarks.suite import BASELINE_VERSION, CASES, load_baseline, regressions, run_case, save_baseline
+from kronos import columnar_store
+
+
+def result(ops_per_sec, peak_kb=100.0):
+    return dict(ops_per_sec=ops_per_sec, peak_kb=peak_kb)
+
+
+def test_run_case_takes_the_median_round():
+    calls = []
+
+    def setup():
+        return lambda: calls.append(1)
+
+    case_result = run_case(setup, iterations=10, warmup=2, memory_iterations=3, rounds=3)
+
+    assert 2 + 10 * 3 + 3 == len(calls)
+    assert 3 == len(case_result['round_ops_per_sec'])
+    assert sorted(case_result['round_ops_per_sec'])[1] == case_result['ops_per_sec']
+    assert run_case(lambda: None, 10, 2, 3) is None
+
+
+def test_columnar_store_case_is_skipped_without_numpy():
+    with mock.patch.object(columnar_store, 'np', None):
+        assert run_case(dict(CASES)['store/columnar'], 10, 2, 3) is None
+
+
+def test_regressions():
+    baseline = dict(diff=result(1000), store=result(1000), logger=result(1000, peak_kb=100))
+    results = dict(
+        diff=result(800),
+        store=result(700),
+        logger=result(1000, peak_kb=200),
+        new=result(1),
+    )
+
+    found = regressions(results, baseline, 0.25)
+
+    assert 2 == len(found)
+    assert found[0].startswith('logger: peak memory')
+    assert found[1].startswith('store: 700.0 ops/sec')
+
+
+def test_small_memory_growth_is_noise():
+    assert [] == regressions(dict(diff=result(1000, peak_kb=2)), dict(diff=result(1000, peak_kb=1)), 0.25)
+
+
+def test_save_and_load_baseline(tmpdir):
+    path = str(tmpdir.join('baseline.json'))
+    results = dict(diff=dict(result(1000), rounds=5))
+
+    save_baseline(path, results)
+
+    assert results == load_baseline(path)
+
+    with open(path) as f:
+        baseline = json.load(f)
+    baseline['version'] = BASELINE_VERSION + 1
+    with open(path, 'w') as f:
+        json.dump(baseline, f)
+
+    with pytest.raises(ValueError):
+        load_baseline(path)
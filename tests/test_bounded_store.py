@@ -0,0 +1,83 @@
+try:
+    from unittest import mock
+except:
+    import mock
+
+from kronos.bounded_store import BoundedStore
+from kronos.comparator import EntityComparator
+from kronos.tracker import Tracker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def to_dict(self):
+        return self.__dict__
+
+
+def test_lru_eviction_by_entries():
+    store = BoundedStore(max_entries=2)
+
+    store.save('a', dict(id=1))
+    store.save('b', dict(id=2))
+    store.get('a')
+    store.save('c', dict(id=3))
+
+    assert store.has_key('a')
+    assert not store.has_key('b')
+    assert store.has_key('c')
+    assert store.get('b') is None
+
+    assert dict(entries=2, size_bytes=0, hits=1, misses=1, evictions=1, expirations=0) == store.stats
+
+
+def test_eviction_by_bytes():
+    store = BoundedStore(max_bytes=2000)
+
+    for i in range(10):
+        store.save(i, dict(id=i, text='x' * 300))
+
+    assert 0 < store.stats['size_bytes'] <= 2000
+    assert store.stats['evictions'] > 0
+    assert store.has_key(9)
+    assert not store.has_key(0)
+
+
+def test_ttl_expiration():
+    clock = Clock()
+    store = BoundedStore(ttl=10, clock=clock)
+
+    store.save('a', dict(id=1), fingerprint='fp')
+    clock.now = 5
+    assert 'fp' == store.get_fingerprint('a')
+    assert dict(id=1) == store.get('a')
+
+    clock.now = 10
+    assert store.get_fingerprint('a') is None
+    assert store.get('a') is None
+    assert 1 == store.stats['expirations']
+    assert 0 == store.stats['entries']
+
+
+def test_evicted_snapshot_is_not_tracked():
+    clock = Clock()
+    tracker = Tracker(EntityComparator(), mock.MagicMock(), store=BoundedStore(ttl=10, clock=clock))
+    entity = Entity(1, 'test')
+
+    tracker.track_entity(entity)
+    entity.name = 'new name'
+    clock.now = 10
+
+    assert tracker.get_entity_diff(entity) is None
+    tracker.track_entity(entity)
+    assert tracker.get_entity_diff(entity).empty
@@ -0,0 +1,247 @@
+import gc
+import subprocess
+import sys
+import threading
+import weakref
+
+import pytest
+
+from datetime import datetime
+
+from kronos.buffered_change_logger import BufferedChangeLogger, ChangeLoggerQueueFull, ChangeLoggerWriteError
+from kronos.memory_change_logger import MemoryChangeLogger
+from kronos.sqlite_change_logger import SQLiteChangeLogger
+
+
+class ListChangeLogger:
+    def __init__(self, release=None):
+        self.entries = []
+        self.batches = []
+        self.release = release
+
+    def log_many(self, entries):
+        if self.release:
+            self.release.wait()
+
+        self.batches.append(len(entries))
+        self.entries.extend(entries)
+
+    def history(self, entity_type, limit=None):
+        return [e for e in self.entries if e[0] == entity_type][:limit]
+
+
+def test_batches_by_size():
+    change_logger = ListChangeLogger()
+    logger = BufferedChangeLogger(change_logger, batch_size=10, flush_interval=60)
+
+    for i in range(25):
+        logger.log('Entity', i, user='test')
+
+    assert logger.flush(timeout=5)
+    assert [10, 10, 5] == change_logger.batches
+    assert ('Entity', 3) == change_logger.entries[3][:2]
+    assert 'test' == change_logger.entries[3][2]['user']
+
+    stats = logger.stats
+    assert 25 == stats['logged']
+    assert 0 == stats['queue_depth']
+    assert 3 == stats['batches']
+
+    logger.close()
+
+
+def test_batches_by_time_window():
+    change_logger = ListChangeLogger()
+    logger = BufferedChangeLogger(change_logger, batch_size=100, flush_interval=0.01)
+
+    logger.log_many([('Entity', i, {}) for i in range(3)])
+    logger.close(timeout=5)
+
+    assert [3] == change_logger.batches
+
+
+def test_queries_flush_the_queue():
+    logger = BufferedChangeLogger(ListChangeLogger(), flush_interval=60)
+    logger.log('Entity', 1)
+    logger.log('Other', 2)
+
+    assert [('Entity', 1)] == [e[:2] for e in logger.history('Entity', limit=5)]
+    logger.close()
+
+
+@pytest.mark.parametrize('on_full', [BufferedChangeLogger.RAISE, BufferedChangeLogger.BLOCK])
+def test_full_queue_raises(on_full):
+    release = threading.Event()
+    logger = BufferedChangeLogger(
+        ListChangeLogger(release), max_queue_size=2, batch_size=1, flush_interval=0,
+        on_full=on_full, block_timeout=0.05,
+    )
+
+    logger.log('Entity', 0)
+    # wait for the first record to be in flight
+    while logger.stats['in_flight'] != 1:
+        pass
+
+    logger.log('Entity', 1)
+    logger.log('Entity', 2)
+
+    with pytest.raises(ChangeLoggerQueueFull):
+        logger.log('Entity', 3)
+
+    release.set()
+    logger.close()
+
+
+def test_full_queue_drops_oldest():
+    release = threading.Event()
+    change_logger = ListChangeLogger(release)
+    logger = BufferedChangeLogger(
+        change_logger, max_queue_size=2, batch_size=1, flush_interval=0,
+        on_full=BufferedChangeLogger.DROP_OLDEST,
+    )
+
+    logger.log('Entity', 0)
+    while logger.stats['in_flight'] != 1:
+        pass
+
+    for i in range(1, 5):
+        logger.log('Entity', i)
+
+    assert 2 == logger.stats['dropped']
+
+    release.set()
+    logger.close()
+
+    assert [0, 3, 4] == [changes for _, changes, _ in change_logger.entries]
+
+
+class FailingChangeLogger(ListChangeLogger):
+    def __init__(self, failures):
+        super(FailingChangeLogger, self).__init__()
+        self.failures = failures
+
+    def log_many(self, entries):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('write failed')
+
+        super(FailingChangeLogger, self).log_many(entries)
+
+
+def test_failed_batches_are_retried():
+    change_logger = FailingChangeLogger(failures=2)
+    logger = BufferedChangeLogger(change_logger, flush_interval=0, retry_interval=0)
+
+    logger.log('Entity', 1)
+    assert logger.flush(timeout=5)
+
+    assert [('Entity', 1)] == [e[:2] for e in change_logger.entries]
+    assert 2 == logger.stats['errors']
+    assert 0 == logger.stats['failed']
+    logger.close()
+
+
+def test_flush_and_close_raise_when_records_are_given_up():
+    change_logger = FailingChangeLogger(failures=2)
+    logger = BufferedChangeLogger(change_logger, flush_interval=0, max_retries=1, retry_interval=0)
+
+    logger.log_many([('Entity', i, {}) for i in range(3)])
+
+    with pytest.raises(ChangeLoggerWriteError):
+        logger.flush(timeout=5)
+
+    assert 3 == logger.stats['failed']
+    # the failure is reported once
+    assert logger.flush(timeout=5)
+
+    change_logger.failures = 2
+    logger.log('Entity', 3)
+
+    with pytest.raises(ChangeLoggerWriteError):
+        logger.close(timeout=5)
+
+    assert [] == change_logger.entries
+
+
+def test_records_keep_the_time_they_were_logged_at():
+    times = iter([datetime(2020, 1, 1), datetime(2020, 1, 2)])
+    memory_logger = MemoryChangeLogger(clock=lambda: datetime(2030, 1, 1))
+    logger = BufferedChangeLogger(memory_logger, flush_interval=60, clock=lambda: next(times))
+
+    logger.log('Entity', 1)
+    logger.log_many([('Entity', 2, {}), ('Entity', 3, {})])
+    logger.close(timeout=5)
+
+    entries = memory_logger.history('Entity', asc=True)
+    assert [datetime(2020, 1, 1), datetime(2020, 1, 2), datetime(2020, 1, 2)] == [e['created_at'] for e in entries]
+
+
+def test_raise_policy_checks_room_for_the_whole_batch():
+    release = threading.Event()
+    change_logger = ListChangeLogger(release)
+    logger = BufferedChangeLogger(
+        change_logger, max_queue_size=2, batch_size=1, flush_interval=0, on_full=BufferedChangeLogger.RAISE,
+    )
+
+    logger.log('Entity', 0)
+    while logger.stats['in_flight'] != 1:
+        pass
+
+    logger.log('Entity', 1)
+
+    with pytest.raises(ChangeLoggerQueueFull):
+        logger.log_many([('Entity', 2, {}), ('Entity', 3, {})])
+
+    assert 1 == logger.stats['queue_depth']
+
+    release.set()
+    logger.close()
+
+    assert [0, 1] == [changes for _, changes, _ in change_logger.entries]
+
+
+class Entity:
+    def __init__(self, id):
+        self.id = id
+
+
+class BlockingMemoryChangeLogger(MemoryChangeLogger):
+    def __init__(self, release):
+        super(BlockingMemoryChangeLogger, self).__init__()
+        self.release = release
+
+    def log_many(self, entries):
+        self.release.wait()
+        super(BlockingMemoryChangeLogger, self).log_many(entries)
+
+
+def test_queued_records_dont_keep_the_entities():
+    release = threading.Event()
+    memory_logger = BlockingMemoryChangeLogger(release)
+    logger = BufferedChangeLogger(memory_logger, flush_interval=0)
+
+    entity = Entity(1)
+    entity_ref = weakref.ref(entity)
+    logger.log(entity, None)
+    del entity
+    gc.collect()
+
+    assert entity_ref() is None
+
+    release.set()
+    logger.close(timeout=5)
+
+    assert 1 == memory_logger.last_change(Entity)['entity_id']
+
+
+def test_open_loggers_are_flushed_at_exit(tmpdir):
+    path = str(tmpdir.join('changes.db'))
+    script = (
+        'from kronos.buffered_change_logger import BufferedChangeLogger\n'
+        'from kronos.sqlite_change_logger import SQLiteChangeLogger\n'
+        'logger = BufferedChangeLogger(SQLiteChangeLogger({!r}), flush_interval=60)\n'
+        'logger.log_many([("Entity", i, {{}}) for i in range(10)])\n'
+    ).format(path)
+    subprocess.check_call([sys.executable, '-c', script])
+
+    assert 10 == len(SQLiteChangeLogger(path).history('Entity'))
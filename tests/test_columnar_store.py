@@ -0,0 +1,103 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from kronos.columnar_store import ColumnarStore
+from kronos.comparator import EntityComparator
+from kronos.tracker import Tracker
+
+
+class Entity:
+    def __init__(self, id, name, age, tags=None):
+        self.id = id
+        self.name = name
+        self.age = age
+        self.tags = tags or []
+
+    def to_dict(self):
+        return self.__dict__
+
+
+def test_save_and_get():
+    store = ColumnarStore(initial_capacity=2)
+
+    for i in range(5):
+        store.save('Entity-{}'.format(i), dict(id=i, name='test {}'.format(i), score=i / 2., tags=['a']))
+
+    assert store.has_key('Entity-3')
+    assert not store.has_key('Entity-10')
+    assert not store.has_key('Other-3')
+    assert store.get('Entity-10') is None
+
+    snapshot = store.get('Entity-3')
+    assert dict(id=3, name='test 3', score=1.5, tags=['a']) == snapshot
+    assert int is type(snapshot['id'])
+
+    # a value that doesn't fit in the column type turns it into an object column
+    store.save('Entity-1', dict(id='one', name='test 1'))
+    assert dict(id='one', name='test 1') == store.get('Entity-1')
+    assert dict(id=3, name='test 3', score=1.5, tags=['a']) == store.get('Entity-3')
+
+
+def test_changes():
+    store = ColumnarStore()
+    store.save_many([('Entity-{}'.format(i), dict(id=i, name='test', age=30, tags=['a'])) for i in range(4)])
+
+    changes = store.changes([
+        ('Entity-0', dict(id=0, name='test', age=30, tags=['a'])),
+        ('Entity-1', dict(id=1, name='test', age=31, tags=['a'])),
+        ('Entity-2', dict(id=2, name='test', age=30.5, tags=['a', 'b'])),
+        ('Entity-3', dict(id=3, name='test', tags=['a'], color='red')),
+        ('Entity-4', dict(id=4, name='test', age=30, tags=['a'])),
+    ])
+
+    assert dict(
+        {'Entity-0': set()},
+        **{'Entity-1': {'age'}, 'Entity-2': {'age', 'tags'}, 'Entity-3': {'age', 'color'}}
+    ) == changes
+
+
+def test_tracker_only_diffs_changed_rows():
+    entities = [Entity(i, 'test {}'.format(i), 30, ['tag']) for i in range(10)]
+    comparator = mock.MagicMock(wraps=EntityComparator())
+    tracker = Tracker(comparator, mock.MagicMock(), store=ColumnarStore())
+
+    tracker.track_many(entities)
+
+    entities[4].tags.append('new tag')
+    entities[7].age = 40
+    diffs = tracker.log_changes_many(entities)
+
+    comparator.diff_many.assert_called_once()
+    assert 2 == len(comparator.diff_many.call_args[0][0])
+    assert [4, 7] == [i for i, d in enumerate(diffs) if not d.empty]
+    assert all(d.empty for d in tracker.log_changes_many(entities))
+
+
+def test_tracking_entities_with_fields_in_other_order():
+    class Person:
+        def __init__(self, id, name, age, nick=None):
+            self.id = id
+            if nick is not None:
+                self.nick = nick
+            self.name = name
+            self.age = age
+
+        def to_dict(self):
+            return self.__dict__
+
+    tracker = Tracker(EntityComparator(), mock.MagicMock(), store=ColumnarStore())
+
+    tracker.track_entity(Person(1, 'test', 30))
+    tracker.track_entity(Person(2, 'other', 40, nick='o'))
+    tracker.track_entity(Person(2, 'other', 40, nick='o'))
+
+    assert tracker.get_entity_diff(Person(2, 'other', 40, nick='o')).empty
+    assert type(tracker._store.get('Person-2')) is dict
+
+    tracker.track_many([Person(2, 'other', 40, nick='o')])
@@ -131,3 +131,67 @@ def test_diff_with_comparators(entity, dummy_comparator):
     ec.diff(new_entity, old_entity)
     dummy_comparator.entity_to_dict.assert_called()
     dummy_comparator.diff.assert_called()
+
+
+def test_entity_to_dict_with_comparators_for_subclasses(entity, dummy_comparator):
+    class SubEntity(Entity):
+        pass
+
+    ec = EntityComparator(comparators=[dummy_comparator])
+    ec.entity_to_dict(SubEntity(**entity.__dict__))
+
+    dummy_comparator.entity_to_dict.assert_called_once()
+
+
+def test_entity_to_dict_dataclasses_and_namedtuples():
+    from collections import namedtuple
+    from dataclasses import dataclass
+
+    @dataclass
+    class Point:
+        x: int
+        y: int
+
+    NamedPoint = namedtuple('NamedPoint', ['x', 'y'])
+
+    ec = EntityComparator()
+
+    assert OrderedDict(x=1, y=2) == ec.entity_to_dict(Point(1, 2))
+    assert OrderedDict(x=1, y=2) == ec.entity_to_dict(NamedPoint(1, 2))
+
+
+def test_entity_to_dict_use_dict():
+    class Address:
+        __slots__ = ('city',)
+
+        def __init__(self, city):
+            self.city = city
+
+    class Person:
+        def __init__(self, name, address):
+            self.name = name
+            self.address = address
+
+    ec = EntityComparator()
+    person = Person('test', Person('nested', 'address'))
+
+    assert dict(name='test', address=dict(name='nested', address='address')) == ec.entity_to_dict(person, use_dict=True)
+    # the entity is left untouched
+    assert isinstance(person.address, Person)
+
+    assert dict(city='test city') == ec.entity_to_dict(Address('test city'), use_dict=True)
+
+
+def test_entity_to_dict_with_registered_fields(entity):
+    class Plain:
+        def __init__(self):
+            self.a, self.b, self.c = 1, 2, 3
+
+    ec = EntityComparator(fields={Plain: dict(include=['a', 'c'])})
+    assert OrderedDict(a=1, c=3) == ec.entity_to_dict(Plain())
+
+    ec.register_fields(Plain, exclude=['b'])
+    assert OrderedDict(a=1, c=3) == ec.entity_to_dict(Plain())
+
+    ec.register_fields(Entity, exclude=['address', 'age'])
+    assert {'address', 'age'}.isdisjoint(ec.entity_to_dict(entity))
@@ -1,6 +1,7 @@
 import pytest
 
-from kronos.diff import DiffHelper, Diff, Change
+from kronos.diff import DiffHelper, Diff, Change, PathChange
+from kronos.utils import ValueDigest, value_digest
 
 
 @pytest.fixture
@@ -390,3 +391,199 @@ def test_deleted_entity_in_list_field(entity):
             )
         ]
     )
+
+
+def test_fingerprint(entity):
+    from collections import OrderedDict
+    from kronos.utils import fingerprint
+
+    new_entity, old_entity = clone_entity(entity)
+    reordered = OrderedDict(reversed(list(old_entity.items())))
+
+    assert fingerprint(new_entity) == fingerprint(reordered)
+
+    new_entity['address']['city'] = 'new city'
+    assert fingerprint(new_entity) != fingerprint(old_entity)
+
+
+def test_duplicated_elements_in_list_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['tags'] = ["tag1", "tag2", "tag1", [1, 2]]
+    new_entity['tags'] = ["tag2", "tag1", "tag2", "tag3", [1, 2], [3]]
+
+    diff = DiffHelper().diff(new_entity, old_entity)
+
+    assert 1 == len(diff.updated)
+    assert ['tag2', 'tag3', [3]] == [c.value for c in diff.updated[0].added]
+    assert ['tag1'] == [c.old_value for c in diff.updated[0].deleted]
+
+
+def test_set_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['tags'] = {"tag1", "tag2"}
+    new_entity['tags'] = {"tag2", "tag3"}
+
+    diff = DiffHelper().diff(new_entity, old_entity)
+
+    assert_diff(
+        diff.updated[0],
+        action='added',
+        expected_field_name='tags',
+        changes=[dict(expected_key=None, expected_value='tag3', expected_old_value=None)]
+    )
+    assert_diff(
+        diff.updated[0],
+        action='deleted',
+        expected_field_name='tags',
+        changes=[dict(expected_key=None, expected_value=None, expected_old_value='tag1')]
+    )
+
+
+def test_emptied_list_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['tags'] = ["tag1"]
+    new_entity['tags'] = []
+
+    diff = DiffHelper().diff(new_entity, old_entity)
+
+    assert ['tag1'] == [c.old_value for c in diff.updated[0].deleted]
+
+
+def test_moved_elements_in_list_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['tags'] = ["a", "b", "c", "d"]
+    new_entity['tags'] = ["b", "c", "a", "d"]
+
+    assert DiffHelper().diff(new_entity, old_entity).empty
+
+    diff = DiffHelper(detect_moves=True).diff(new_entity, old_entity)
+
+    assert 1 == len(diff.updated[0].updated)
+    moved = diff.updated[0].updated[0]
+    assert_change(moved, 2, 'a', 'a')
+    assert 0 == moved.metadata['from_index']
+
+
+def test_entities_without_id_in_list_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['addresses'] = [dict(city='a'), dict(city='b'), dict(city='b')]
+    new_entity['addresses'] = [dict(city='b'), dict(city='c'), dict(city='a')]
+
+    diff = DiffHelper().diff(new_entity, old_entity)
+
+    assert 1 == len(diff.updated)
+    assert not diff.updated[0].updated
+    assert_diff(
+        diff.updated[0],
+        action='added',
+        changes=[dict(expected_key=None, expected_value=dict(city='c'), expected_old_value=None)]
+    )
+    assert_diff(
+        diff.updated[0],
+        action='deleted',
+        changes=[dict(expected_key=None, expected_value=None, expected_old_value=dict(city='b'))]
+    )
+
+
+def test_configured_keys_in_list_field(entity):
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['items'] = [dict(order=1, sku='a', qty=1), dict(order=1, sku='b', qty=1)]
+    new_entity['items'] = [dict(order=1, sku='a', qty=2), dict(order=2, sku='b', qty=1)]
+
+    diff = DiffHelper(list_keys=dict(items=('order', 'sku'))).diff(new_entity, old_entity)
+    items_diff = diff.updated[0]
+
+    assert [(1, 'a')] == [d.field_name for d in items_diff.updated]
+    assert_change(items_diff.updated[0].updated[0], 'qty', 2, 1)
+    assert [(2, 'b')] == [c.key for c in items_diff.added]
+    assert [(1, 'b')] == [c.key for c in items_diff.deleted]
+
+    diff = DiffHelper(list_keys=dict(items=lambda e: e['sku'])).diff(new_entity, old_entity)
+    assert ['a', 'b'] == sorted(d.field_name for d in diff.updated[0].updated)
+
+
+def test_objects_in_list_field(entity):
+    class Item:
+        def __init__(self, id, value):
+            self.id = id
+            self.value = value
+
+    new_entity, old_entity = clone_entity(entity)
+
+    old_entity['items'] = [Item(1, 'a'), Item(2, 'b')]
+    new_entity['items'] = [Item(1, 'new a'), Item(3, 'c')]
+
+    diff = DiffHelper().diff(new_entity, old_entity)
+    items_diff = diff.updated[0]
+
+    assert 1 == items_diff.updated[0].field_name
+    assert_change(items_diff.updated[0].updated[0], 'value', 'new a', 'a')
+    assert [3] == [c.key for c in items_diff.added]
+    assert [2] == [c.key for c in items_diff.deleted]
+
+
+def test_iter_changes(entity):
+    new_entity, old_entity = clone_entity(entity)
+    new_entity['age'] = 31
+    new_entity['address']['city'] = 'new city'
+    new_entity['tags'] = ['a']
+    new_entity['items'] = [dict(id=1, price=15), dict(id=3, price=30)]
+    old_entity['tags'] = ['b']
+    old_entity['items'] = [dict(id=1, price=10), dict(id=2, price=20)]
+    del new_entity['profession']
+
+    changes = list(DiffHelper().iter_changes(new_entity, old_entity))
+
+    assert [
+        PathChange('updated', ('age',), 31, 30),
+        PathChange('updated', ('address', 'city'), 'new city', 'test city'),
+        PathChange('added', ('tags',), 'a', None),
+        PathChange('deleted', ('tags',), None, 'b'),
+        PathChange('updated', ('items', 1, 'price'), 15, 10),
+        PathChange('added', ('items', 3), dict(id=3, price=30), None),
+        PathChange('deleted', ('items', 2), None, dict(id=2, price=20)),
+        PathChange('deleted', ('profession',), None, 'programmer'),
+    ] == changes
+
+
+def test_has_changes(entity):
+    new_entity, old_entity = clone_entity(entity)
+    helper = DiffHelper()
+
+    assert not helper.has_changes(new_entity, old_entity)
+
+    new_entity['tags'], old_entity['tags'] = ['a', 'b'], ['b', 'a']
+    assert not helper.has_changes(new_entity, old_entity)
+
+    new_entity['address']['zip'] = 'new zip'
+    assert helper.has_changes(new_entity, old_entity)
+
+
+def test_large_values_are_compared_and_logged_by_digest(entity):
+    new_entity, old_entity = clone_entity(entity)
+    old_entity['body'] = 'a' * 1000
+    new_entity['body'] = 'b' * 1000
+    new_entity['data'] = b'\x00' * 2000
+
+    diff = DiffHelper(large_value_size=100).diff(new_entity, old_entity)
+    updated = diff.updated[0]
+
+    assert (value_digest('b' * 1000), value_digest('a' * 1000)) == (updated.value, updated.old_value)
+    assert 1000 == updated.old_value.length
+    assert value_digest(b'\x00' * 2000) == diff.added[0].value
+
+    diff = DiffHelper(large_value_size=100, keep_large_values=True).diff(new_entity, old_entity)
+    assert 'b' * 1000 == diff.updated[0].value
+    assert isinstance(diff.updated[0].old_value, ValueDigest)
+
+    # snapshots with digests are compared by digest
+    old_entity['body'] = value_digest('b' * 1000)
+    del new_entity['data']
+    assert DiffHelper().diff(new_entity, old_entity).empty
+    assert not DiffHelper().has_changes(new_entity, old_entity)
@@ -0,0 +1,234 @@
+import pickle
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from kronos.comparator import EntityComparator
+from collections import OrderedDict, namedtuple
+
+from kronos.dirty import DirtyTrackingError, dirty_state, dirty_trackable, mark_dirty, select_paths
+from kronos.tracker import Tracker
+
+
+@dirty_trackable
+class Entity:
+    def __init__(self, id, name, address, tags):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.tags = tags
+
+    def to_dict(self):
+        return self.__dict__
+
+
+@pytest.fixture
+def entity():
+    return Entity(1, 'test', dict(city='test city', geo=dict(lat=1, lng=2)), ['a'])
+
+
+@pytest.fixture
+def tracker():
+    return Tracker(mock.MagicMock(wraps=EntityComparator()), mock.MagicMock())
+
+
+def test_records_touched_paths(entity, tracker):
+    entity.name = 'not tracked yet'
+    assert dirty_state(entity, tracker) is None
+
+    tracker.track_entity(entity)
+    assert ('Entity-1', frozenset()) == dirty_state(entity, tracker)
+
+    entity.name = 'new name'
+    entity.address['geo']['lat'] = 3
+    entity.tags.append('b')
+    mark_dirty(entity, 'address.zip')
+
+    assert {('name',), ('address', 'geo', 'lat'), ('tags',), ('address', 'zip')} == dirty_state(entity, tracker)[1]
+
+
+def test_untouched_entity_is_not_converted(entity, tracker):
+    tracker.track_entity(entity)
+    tracker.comparator.reset_mock()
+
+    assert tracker.log_changes(entity).empty
+    assert tracker.log_changes_many([entity])[0].empty
+
+    assert not tracker.comparator.entity_to_dict.called
+    assert not tracker.comparator.diff.called
+
+
+def test_only_touched_paths_are_diffed(entity, tracker):
+    tracker.track_entity(entity)
+
+    entity.address['geo']['lat'] = 3
+    entity.tags.append('b')
+
+    diff = tracker.log_changes(entity)
+
+    _, old_entity = tracker.comparator.diff.call_args[0]
+    new_entity = tracker.comparator.diff.call_args[1]['entity_dict']
+    assert dict(address=dict(geo=dict(lat=3)), tags=['a', 'b']) == new_entity
+    assert dict(address=dict(geo=dict(lat=1)), tags=['a']) == old_entity
+
+    assert ['address', 'tags'] == sorted(d.field_name for d in diff.updated)
+
+    # the snapshot is updated and the entity is clean again
+    assert frozenset() == dirty_state(entity, tracker)[1]
+    assert tracker.get_entity_diff(entity).empty
+
+
+def test_batches_only_diff_touched_paths(entity, tracker):
+    other = Entity(2, 'other', dict(city='other city'), [])
+    tracker.track_many([entity, other])
+
+    entity.address['geo']['lat'] = 3
+    other.name = 'new name'
+
+    diffs = tracker.log_changes_many([entity, other])
+
+    (_, old_entity, new_entity), (_, other_old, other_new) = tracker.comparator.diff_many.call_args[0][0]
+    assert dict(address=dict(geo=dict(lat=3))) == new_entity
+    assert dict(address=dict(geo=dict(lat=1))) == old_entity
+    assert dict(name='new name') == other_new
+    assert dict(name='other') == other_old
+
+    assert ['address'] == [d.field_name for d in diffs[0].updated]
+    assert ['name'] == [c.key for c in diffs[1].updated]
+
+
+def test_observed_containers_are_plain_in_snapshots(entity):
+    data = pickle.loads(pickle.dumps(entity.address))
+
+    assert type(data) is dict
+    assert type(data['geo']) is dict
+
+
+def test_mutated_dict_in_a_list(entity, tracker):
+    entity.tags = [dict(id=1, name='a')]
+    tracker.track_entity(entity)
+
+    entity.tags[0]['name'] = 'b'
+    assert {('tags',)} == dirty_state(entity, tracker)[1]
+
+    diff = tracker.log_changes(entity)
+    assert ['tags'] == [d.field_name for d in diff.updated]
+
+    entity.tags.append(dict(id=2, name='c'))
+    tracker.log_changes(entity)
+
+    entity.tags[1]['name'] = 'd'
+    assert {('tags',)} == dirty_state(entity, tracker)[1]
+    assert not tracker.log_changes(entity).empty
+
+
+def test_mutated_dict_in_a_tuple(entity, tracker):
+    Pair = namedtuple('Pair', ['first', 'second'])
+    entity.address = dict(pair=Pair(dict(id=1, a=1), dict(id=2, a=1)))
+    tracker.track_entity(entity)
+
+    entity.address['pair'].first['a'] = 2
+
+    assert {('address', 'pair')} == dirty_state(entity, tracker)[1]
+    assert isinstance(entity.address['pair'], Pair)
+    assert not tracker.log_changes(entity).empty
+
+
+@pytest.mark.parametrize('value', [set(['a']), OrderedDict(a=1)])
+def test_unobservable_values_are_always_diffed(entity, tracker, value):
+    entity.address = dict(city='test city', labels=value)
+    tracker.track_entity(entity)
+
+    assert {('address', 'labels')} == dirty_state(entity, tracker)[1]
+    assert tracker.log_changes(entity).empty
+
+    if isinstance(value, set):
+        entity.address['labels'].add('b')
+    else:
+        entity.address['labels']['b'] = 2
+
+    diff = tracker.log_changes(entity)
+    assert ['address'] == [d.field_name for d in diff.updated]
+
+
+def test_replaced_unobservable_values_are_observed_again(entity, tracker):
+    entity.address = dict(city='test city', labels=set(['a']))
+    tracker.track_entity(entity)
+
+    entity.address = dict(city='new city')
+    tracker.log_changes(entity)
+    assert frozenset() == dirty_state(entity, tracker)[1]
+
+    entity.address['labels'] = set(['a'])
+    del entity.address['labels']
+    tracker.log_changes(entity)
+    assert frozenset() == dirty_state(entity, tracker)[1]
+
+
+def test_state_is_kept_per_tracker(entity, tracker):
+    other_tracker = Tracker(EntityComparator(), mock.MagicMock())
+    tracker.track_entity(entity)
+
+    entity.name = 'new name'
+
+    assert dirty_state(entity, other_tracker) is None
+    assert other_tracker.log_changes(entity) is None
+    assert not other_tracker.change_logger.log.called
+
+    other_tracker.track_entity(entity)
+    assert ['name'] == [c.key for c in tracker.log_changes(entity).updated]
+    assert frozenset() == dirty_state(entity, tracker)[1]
+    assert other_tracker.log_changes(entity).empty
+
+
+def test_containers_are_observed_only_while_tracked(entity, tracker):
+    address = dict(city='test city')
+    entity.address = address
+    address['zip'] = '1234'
+
+    assert entity.address is address
+
+    tracker.track_entity(entity)
+    entity.address['city'] = 'new city'
+
+    assert {('address', 'city')} == dirty_state(entity, tracker)[1]
+
+
+def test_slots_entities_need_weak_references():
+    with pytest.raises(DirtyTrackingError):
+        @dirty_trackable
+        class SlotsEntity(object):
+            __slots__ = ('id', 'name')
+
+    @dirty_trackable
+    class WeakSlotsEntity(object):
+        __slots__ = ('id', 'name', '__weakref__')
+
+        def __init__(self, id, name):
+            self.id = id
+            self.name = name
+
+        def to_dict(self):
+            return dict(id=self.id, name=self.name)
+
+    entity = WeakSlotsEntity(1, 'test')
+    tracker = Tracker(EntityComparator(), mock.MagicMock())
+    tracker.track_entity(entity)
+
+    entity.name = 'new name'
+    assert ['name'] == [c.key for c in tracker.log_changes(entity).updated]
+
+
+def test_select_paths():
+    new, old = select_paths(
+        dict(a=1, b=dict(c=1, d=2), e=dict(f=1)),
+        dict(a=2, b=dict(c=1, d=3), g=1),
+        [('b', 'd'), ('e', 'f'), ('g',), ('b',)]
+    )
+
+    assert dict(b=dict(c=1, d=2), e=dict(f=1)) == new
+    assert dict(b=dict(c=1, d=3), g=1) == old
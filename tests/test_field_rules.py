@@ -0,0 +1,122 @@
+import pytest
+
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.field_rules import FieldRules, FieldRulesError, parse_path
+from kronos.utils import ValueDigest, value_digest
+
+
+class Address:
+    def __init__(self, city, zip):
+        self.city = city
+        self.zip = zip
+
+
+class Order:
+    def __init__(self, id, items, address, cache=None):
+        self.id = id
+        self.items = items
+        self.address = address
+        self.cache = cache
+        self.updated_at = 1
+
+
+@pytest.fixture
+def order_dict():
+    return dict(
+        id=1,
+        updated_at=10,
+        address=dict(city='city', zip='1000', geo=dict(lat=1, lng=2)),
+        items=[dict(id=1, price=10, name='a'), dict(id=2, price=20, name='b')],
+        tags=['a', 'b', 'c'],
+    )
+
+
+def test_parse_path():
+    assert ['items', '[]', 'price'] == parse_path('items[].price')
+    assert ['address', '*'] == parse_path('address.*')
+
+    for pattern in ['', 'address.', 'items[0]', 'a..b']:
+        with pytest.raises(FieldRulesError):
+            parse_path(pattern)
+
+
+def test_exclude_paths(order_dict):
+    rules = FieldRules(exclude=['updated_at', 'address.geo', 'items[].price'])
+    result = rules.apply(order_dict)
+
+    assert 'updated_at' not in result
+    assert dict(city='city', zip='1000') == result['address']
+    assert [dict(id=1, name='a'), dict(id=2, name='b')] == result['items']
+    # the given dict is not modified
+    assert 10 == order_dict['items'][0]['price']
+    assert order_dict['tags'] is result['tags']
+
+
+def test_include_paths(order_dict):
+    result = FieldRules(include=['id', 'address.*', 'items[].price']).apply(order_dict)
+
+    assert dict(
+        id=1,
+        address=order_dict['address'],
+        items=[dict(price=10), dict(price=20)],
+    ) == result
+
+    assert dict(address=dict(geo=dict(lat=1))) == FieldRules(include=['*.geo.lat']).apply(order_dict)
+    assert order_dict['items'] == FieldRules(include=['items[]']).apply(order_dict)['items']
+    assert [] == FieldRules(exclude=['items[]']).apply(order_dict)['items']
+
+
+def test_depth_and_list_size_limits(order_dict):
+    result = FieldRules(max_depth=1).apply(order_dict)
+
+    assert ValueDigest(value_digest(order_dict['address']['geo']).digest) == result['address']['geo']
+    assert all(isinstance(item, ValueDigest) for item in result['items'])
+
+    result = FieldRules(max_list_size=2).apply(order_dict)
+
+    assert order_dict['items'] == result['items']
+    assert 3 == result['tags'].length
+
+
+def test_list_size_limit_in_list_elements():
+    entity_dict = {'a': [{'b': list(range(10))}]}
+
+    result = FieldRules(max_list_size=3).apply(entity_dict)
+
+    assert value_digest(list(range(10))) == result['a'][0]['b']
+    assert list(range(10)) == entity_dict['a'][0]['b']
+
+
+def test_diff_compares_cut_values_by_fingerprint(order_dict):
+    helper = DiffHelper(field_rules=FieldRules(exclude=['updated_at'], max_list_size=2))
+
+    new_dict = dict(order_dict, updated_at=20, tags=['a', 'b', 'c', 'd'])
+    diff = helper.diff(new_dict, order_dict)
+
+    assert ['tags'] == [c.key for c in diff.updated]
+    assert (4, 3) == (diff.updated[0].value.length, diff.updated[0].old_value.length)
+
+    assert helper.diff(dict(order_dict, updated_at=20), order_dict).empty
+    assert not helper.has_changes(dict(order_dict, updated_at=20), order_dict)
+    assert [] == list(helper.iter_changes(dict(order_dict, updated_at=20), order_dict))
+
+
+def test_registered_field_paths():
+    comparator = EntityComparator()
+    comparator.register_fields(Order, exclude=['cache', 'updated_at', 'address.zip'], max_list_size=10)
+
+    order = Order(1, [dict(id=1, price=10)], Address('city', '1000'), cache=list(range(100)))
+    order_dict = comparator.entity_to_dict(order)
+
+    assert dict(id=1, items=[dict(id=1, price=10)], address=dict(city='city')) == order_dict
+
+    order.address.zip = '2000'
+    order.updated_at = 2
+    assert comparator.diff(order, order_dict).empty
+
+    order.items = [dict(id=1, price=20)]
+    assert ['items'] == [c.field_name for c in comparator.diff(order, order_dict).updated]
+
+    comparator.register_fields(Order, include=['id', 'items[].price'])
+    assert dict(id=1, items=[dict(price=20)]) == comparator.entity_to_dict(order)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+from collections import Counter
+
+import pytest
+
+from kronos.async_tracker import AsyncTracker
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.instrumentation import (
+    NULL_INSTRUMENTATION, CallbackInstrumentation, InstrumentedProxy, LoggingInstrumentation,
+)
+from kronos.memory_change_logger import MemoryChangeLogger
+from kronos.schema import compile_diff, infer_schema
+from kronos.tracker import EntityConflictError, Tracker
+
+
+class Entity:
+    def __init__(self, id, name, tags):
+        self.id = id
+        self.name = name
+        self.tags = tags
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class Recorder(object):
+    def __init__(self):
+        self.spans = Counter()
+        self.counters = Counter()
+        self.histograms = {}
+
+    def instrumentation(self):
+        return CallbackInstrumentation(
+            on_span=lambda name, seconds, failed: self.spans.update([name]),
+            on_increment=lambda name, value: self.counters.update({name: value}),
+            on_observe=lambda name, value: self.histograms.setdefault(name, []).append(value),
+        )
+
+
+def test_default_instrumentation_wraps_nothing():
+    comparator = EntityComparator()
+    tracker = Tracker(comparator, MemoryChangeLogger())
+
+    assert tracker.instrumentation is NULL_INSTRUMENTATION
+    assert tracker.comparator is comparator
+    assert DiffHelper()._visits is None
+
+
+def test_tracker_reports_phases_and_counters():
+    recorder = Recorder()
+    instrumentation = recorder.instrumentation()
+    comparator = EntityComparator(diff_helper=DiffHelper(instrumentation=instrumentation))
+    tracker = Tracker(comparator, MemoryChangeLogger(), instrumentation=instrumentation, fingerprints=True)
+
+    entities = [Entity(i, 'test', ['a', 'b']) for i in range(3)]
+    tracker.track_many(entities)
+
+    entities[0].tags = ['a', 'c']
+    tracker.log_changes_many(entities)
+    tracker.log_changes(entities[1])
+
+    entities[2].name = 'new name'
+    with pytest.raises(EntityConflictError):
+        tracker.track_entity(entities[2])
+
+    assert dict(entities_tracked=3, empty_diffs=3, conflicts=1) == recorder.counters
+
+    for name in ['comparator.entity_to_dict', 'tracker.fingerprint', 'tracker.entity_id', 'store.get_many',
+                 'store.get_fingerprint', 'store.save_many', 'comparator.diff_many', 'change_logger.log',
+                 'change_logger.log_many']:
+        assert recorder.spans[name] > 0, name
+
+    # fields + tags elements, the changes are the added and deleted tag
+    assert [3 + 4] == recorder.histograms['diff.nodes_visited']
+    assert [2] == recorder.histograms['diff.changes']
+
+
+def test_compiled_diff_with_instrumented_helper():
+    recorder = Recorder()
+    helper = DiffHelper(instrumentation=recorder.instrumentation())
+    old = dict(id=1, name='test', tags=['a', 'b'], address=dict(city='x', lines=['1']))
+    new = dict(id=1, name='test', tags=['a', 'c'], address=dict(city='x', lines=['2']))
+
+    diff = compile_diff(infer_schema(old), helper)(new, old)
+
+    assert 2 == len(diff.updated)
+    helper.diff(new, old)
+    # only the nodes of the last diff: fields, tags elements, address fields and lines elements
+    assert [4 + 4 + 2 + 2] == recorder.histograms['diff.nodes_visited']
+
+
+def test_async_tracker_spans_last_until_coroutines_finish():
+    spans = []
+
+    class SlowStore(object):
+        def __init__(self):
+            self.data = {}
+
+        async def has_key(self, key):
+            return key in self.data
+
+        async def get(self, key):
+            await asyncio.sleep(0.01)
+            return self.data.get(key)
+
+        async def save(self, key, value):
+            self.data[key] = value
+
+    instrumentation = CallbackInstrumentation(on_span=lambda name, seconds, failed: spans.append((name, seconds)))
+
+    class AsyncLogger(object):
+        async def log(self, *args, **kwargs):
+            pass
+
+    async def run():
+        tracker = AsyncTracker(EntityComparator(), AsyncLogger(), store=SlowStore(), instrumentation=instrumentation)
+        entity = Entity(1, 'test', [])
+        await tracker.track_entity(entity)
+        entity.name = 'new name'
+        return await tracker.log_changes(entity)
+
+    assert not asyncio.run(run()).empty
+    assert [s for name, s in spans if name == 'store.get'][0] >= 0.01
+
+
+def test_proxy_keeps_optional_methods_detection():
+    proxy = InstrumentedProxy(MemoryChangeLogger(), CallbackInstrumentation(), 'change_logger')
+
+    assert hasattr(proxy, 'log_many')
+    assert not hasattr(proxy, 'get_many')
+
+
+def test_logging_instrumentation(caplog):
+    logger = logging.getLogger('kronos.test')
+    instrumentation = LoggingInstrumentation(logger)
+    tracker = Tracker(EntityComparator(), MemoryChangeLogger(), instrumentation=instrumentation)
+
+    with caplog.at_level(logging.INFO, logger='kronos.test'):
+        tracker.track_entity(Entity(1, 'test', []))
+    assert not caplog.records
+
+    with caplog.at_level(logging.DEBUG, logger='kronos.test'):
+        tracker.track_entity(Entity(2, 'test', []))
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert 'counter entities_tracked +1' in messages
+    assert any(m.startswith('span store.save ') for m in messages)
@@ -0,0 +1,114 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from kronos.comparator import EntityComparator
+from kronos.memory_change_logger import MemoryChangeLogger
+from kronos.tracker import Tracker
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(minutes=1)
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def change_logger(clock):
+    change_logger = MemoryChangeLogger(clock=clock)
+
+    for i in range(10):
+        change_logger.log(Entity(i % 2, 'test'), None, n=i)
+
+    return change_logger
+
+
+def test_first_and_last_change(change_logger):
+    assert 0 == change_logger.first_change(Entity)['n']
+    assert 9 == change_logger.last_change('Entity')['n']
+    assert 8 == change_logger.last_change(Entity, entity_id=0)['n']
+    assert change_logger.last_change('Other') is None
+
+
+def test_history(change_logger):
+    assert list(range(9, -1, -1)) == [e['n'] for e in change_logger.history(Entity)]
+    assert [0, 1, 2] == [e['n'] for e in change_logger.history(Entity, limit=3, asc=True)]
+    assert [9, 8] == [e['n'] for e in change_logger.history(Entity, limit=2)]
+    assert [9, 7, 5] == [e['n'] for e in change_logger.history(Entity, limit=3, entity_id=1)]
+
+    history = change_logger.history(
+        Entity, date_from=datetime(2020, 1, 1, 0, 3), date_to=datetime(2020, 1, 1, 0, 6), asc=True
+    )
+    assert [2, 3, 4] == [e['n'] for e in history]
+
+    assert [] == change_logger.history(Entity, date_from=datetime(2021, 1, 1))
+
+
+def test_page(change_logger):
+    pages, cursor = [], None
+
+    while True:
+        entries, cursor = change_logger.page(Entity, cursor=cursor, size=4)
+        pages.append([e['n'] for e in entries])
+
+        # records logged between pages don't shift the next ones
+        change_logger.log(Entity(5, 'new'), None, n=100)
+
+        if cursor is None:
+            break
+
+    assert [[9, 8, 7, 6], [5, 4, 3, 2], [1, 0]] == pages
+
+    entries, cursor = change_logger.page(Entity, size=3, asc=True, entity_id=0)
+    assert [0, 2, 4] == [e['n'] for e in entries]
+    entries, cursor = change_logger.page(Entity, cursor=cursor, size=3, asc=True, entity_id=0)
+    assert [6, 8] == [e['n'] for e in entries]
+    assert cursor is None
+
+
+def test_out_of_order_clock():
+    times = iter([datetime(2020, 1, 2), datetime(2020, 1, 1)])
+    change_logger = MemoryChangeLogger(clock=lambda: next(times))
+
+    change_logger.log(Entity(1, 'test'), None, n=1)
+    change_logger.log(Entity(1, 'test'), None, n=2)
+
+    assert 2 == change_logger.first_change(Entity)['n']
+    assert 1 == change_logger.last_change(Entity)['n']
+
+
+def test_tracker_logs(clock):
+    change_logger = MemoryChangeLogger(clock=clock)
+    tracker = Tracker(EntityComparator(), change_logger)
+
+    entities = [Entity(i, 'test') for i in range(3)]
+    tracker.log_changes_many(entities, created=True)
+    tracker.track_many(entities)
+
+    entities[1].name = 'new name'
+    tracker.log_changes(entities[1], user='admin')
+
+    last_change = change_logger.last_change(Entity)
+    assert 1 == last_change['entity_id']
+    assert 'admin' == last_change['user']
+    assert 'name' == last_change['changes'].updated[0].key
+
+    assert [True, False] == [e['created'] for e in change_logger.history(Entity, entity_id=1, asc=True)]
+    assert 4 == len(change_logger)
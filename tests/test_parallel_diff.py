@@ -0,0 +1,63 @@
+import pytest
+
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.parallel_diff import ParallelDiffHelper
+
+
+def changes(diff):
+    return [sorted(repr(c) for c in changes) for changes in (diff.added, diff.deleted, diff.updated)]
+
+
+def make_pairs(count, fields=10):
+    pairs = []
+    for i in range(count):
+        old = {'field_{}'.format(f): f for f in range(fields)}
+        old.update(id=i, items=[dict(id=j, price=j) for j in range(5)], tags=['a', 'b'])
+
+        new = dict(old, field_1=i, tags=['b', 'c'])
+        new['items'] = [dict(item, price=item['price'] + (i % 2)) for item in old['items']]
+        del new['field_2']
+        new['extra'] = i
+        pairs.append((new, old))
+
+    return pairs
+
+
+@pytest.fixture
+def helper():
+    with ParallelDiffHelper(max_workers=2, chunk_size=50, min_batch_size=2) as helper:
+        yield helper
+
+
+def test_diff_many_matches_serial_diffs_in_order(helper):
+    pairs = make_pairs(20)
+
+    diffs = helper.diff_many(pairs, source='test')
+    expected = DiffHelper().diff_many(pairs)
+
+    assert [changes(d) for d in expected] == [changes(d) for d in diffs]
+    assert all('test' == d.metadata['source'] for d in diffs)
+
+
+def test_big_dicts_are_split_by_field(helper):
+    pairs = make_pairs(3, fields=200)
+
+    assert len(helper._parts(*pairs[0])) > 1
+    assert [changes(d) for d in DiffHelper().diff_many(pairs)] == [changes(d) for d in helper.diff_many(pairs)]
+
+
+def test_small_batches_run_in_process():
+    helper = ParallelDiffHelper(min_batch_size=10)
+
+    assert not helper.diff_many(make_pairs(5))[0].empty
+    assert helper._executor is None
+
+
+def test_comparator_uses_helper_for_batches(helper):
+    comparator = EntityComparator(diff_helper=helper)
+    pairs = make_pairs(4)
+
+    diffs = comparator.diff_many([(new, old) for new, old in pairs])
+
+    assert [changes(comparator.diff(new, old)) for new, old in pairs] == [changes(d) for d in diffs]
@@ -0,0 +1,158 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from kronos.checkpoint_change_logger import CheckpointChangeLogger
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.memory_change_logger import MemoryChangeLogger
+from kronos.patch import Patcher
+from kronos.tracker import Tracker
+
+
+OLD = dict(
+    id=1,
+    name='test',
+    removed='field',
+    address=dict(city='city', geo=dict(lat=1, lng=2)),
+    tags=['a', 'b', 'c'],
+    labels=set(['x']),
+    items=[dict(id=1, price=10), dict(id=2, price=20), dict(name='no id')],
+)
+
+NEW = dict(
+    id=1,
+    name='new name',
+    added='field',
+    address=dict(city='city', geo=dict(lat=3, lng=2)),
+    tags=['c', 'a', 'd'],
+    labels=set(['y']),
+    items=[dict(id=1, price=15), dict(name='other'), dict(id=3, price=30)],
+)
+
+
+def normalized(entity_dict):
+    # the position of the added list elements is not part of the diffs
+    return dict(
+        entity_dict,
+        tags=sorted(entity_dict['tags']),
+        items=sorted(entity_dict['items'], key=lambda e: str(sorted(e.items()))),
+    )
+
+
+@pytest.mark.parametrize('detect_moves', [False, True])
+def test_apply_and_revert(detect_moves):
+    helper = DiffHelper(detect_moves=detect_moves)
+    patcher = Patcher(helper)
+    diff = helper.diff(NEW, OLD)
+
+    assert normalized(NEW) == normalized(patcher.apply(OLD, diff))
+    assert normalized(OLD) == normalized(patcher.revert(NEW, diff))
+
+    # the patched dicts are copies
+    assert OLD['address']['geo']['lat'] == 1
+    assert helper.diff(patcher.apply(OLD, diff), OLD).updated
+
+
+def test_moves_are_reapplied():
+    helper = DiffHelper(detect_moves=True)
+    diff = helper.diff(dict(tags=['c', 'a', 'b']), dict(tags=['a', 'b', 'c']))
+
+    assert ['c', 'a', 'b'] == Patcher(helper).apply(dict(tags=['a', 'b', 'c']), diff)['tags']
+
+
+def test_elements_without_fingerprint_are_patched():
+    helper = DiffHelper()
+    old = dict(items=[dict(name='a', value=1j), dict(name='b', value=2j)])
+    new = dict(items=[dict(name='b', value=2j)])
+    diff = helper.diff(new, old)
+
+    assert new == Patcher(helper).apply(old, diff)
+
+
+class Entity:
+    def __init__(self, id, name, age):
+        self.id = id
+        self.name = name
+        self.age = age
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(minutes=1)
+        return self.now
+
+
+def test_state_at():
+    comparator = EntityComparator()
+    memory_logger = MemoryChangeLogger(clock=Clock())
+    change_logger = CheckpointChangeLogger(memory_logger, comparator, every=5)
+    tracker = Tracker(comparator, change_logger)
+
+    entity = Entity(1, 'test', 0)
+    tracker.log_changes(entity, created=True)
+    tracker.track_entity(entity)
+
+    for age in range(1, 23):
+        entity.age = age
+        tracker.log_changes(entity)
+
+    tracker.log_changes(entity, deleted=True)
+
+    checkpoints = [r['checkpoint']['age'] for r in memory_logger.history(Entity, asc=True) if r.get('checkpoint')]
+    assert [5, 10, 15, 20] == checkpoints
+
+    # the record of each age was logged at minute age + 1
+    for age in range(23):
+        at = datetime(2020, 1, 1, 0, age + 1, 30)
+        assert dict(id=1, name='test', age=age) == change_logger.state_at(Entity, 1, at)
+
+    assert change_logger.state_at(Entity, 1, datetime(2020, 1, 1)) is None
+    assert change_logger.state_at(Entity, 1, datetime(2020, 1, 2)) is None
+
+
+def test_state_at_reads_up_to_a_checkpoint():
+    memory_logger = MemoryChangeLogger(clock=Clock())
+    change_logger = CheckpointChangeLogger(memory_logger, EntityComparator(), every=10)
+    tracker = Tracker(EntityComparator(), change_logger)
+
+    entity = Entity(1, 'test', 0)
+    tracker.track_entity(entity)
+
+    for age in range(1, 1001):
+        entity.age = age
+        tracker.log_changes(entity)
+
+    patcher = change_logger.patcher = Patcher()
+    applied = []
+    original_apply = patcher.apply
+    patcher.apply = lambda *args: applied.append(1) or original_apply(*args)
+
+    state = change_logger.state_at(Entity, 1, datetime(2020, 1, 1) + timedelta(minutes=503, seconds=30))
+
+    assert 503 == state['age']
+    assert len(applied) < 10
+
+
+def test_checkpoints_are_kept_across_restarts():
+    memory_logger = MemoryChangeLogger(clock=Clock())
+    entity = Entity(1, 'test', 0)
+
+    for ages in [range(1, 8), range(8, 14)]:
+        # a new logger, as after a restart
+        change_logger = CheckpointChangeLogger(memory_logger, EntityComparator(), every=5)
+        tracker = Tracker(EntityComparator(), change_logger)
+        tracker.track_entity(entity, override=True)
+
+        for age in ages:
+            entity.age = age
+            tracker.log_changes(entity)
+
+    checkpoints = [r['checkpoint']['age'] for r in memory_logger.history(Entity, asc=True) if r.get('checkpoint')]
+    assert [5, 10] == checkpoints
@@ -0,0 +1,111 @@
+import pytest
+
+from kronos.comparator import EntityComparator
+from kronos.diff import Change, Diff, DiffHelper
+from kronos.field_rules import FieldRules
+from kronos.schema import LIST, SCALAR, SchemaComparator, compile_diff, infer_schema
+from kronos.utils import ValueDigest
+
+
+class Entity:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def to_dict(self):
+        return self.__dict__
+
+
+@pytest.fixture
+def entity():
+    return dict(
+        id=1,
+        name='test',
+        age=30,
+        tags=['a', 'b'],
+        items=[dict(id=1, qty=1)],
+        address=dict(city='test city', zip='1234'),
+    )
+
+
+def diff_to_tuple(diff):
+    if isinstance(diff, Change):
+        return ('change', diff.key, repr(diff.value), repr(diff.old_value))
+
+    return (
+        'diff',
+        repr(diff.field_name),
+        sorted(diff_to_tuple(d) for d in diff.added),
+        sorted(diff_to_tuple(d) for d in diff.deleted),
+        sorted(diff_to_tuple(d) for d in diff.updated),
+    )
+
+
+def test_infer_schema(entity):
+    assert dict(
+        id=SCALAR, name=SCALAR, age=SCALAR, tags=LIST, items=LIST, address=dict(city=SCALAR, zip=SCALAR)
+    ) == infer_schema(entity)
+
+
+@pytest.mark.parametrize('changes', [
+    dict(),
+    dict(age=31, name='new name'),
+    dict(tags=['a', 'c']),
+    dict(items=[dict(id=1, qty=2), dict(id=2, qty=1)]),
+    dict(address=dict(city='new city', zip='1234')),
+    dict(address=dict(city='new city')),
+    dict(address=None, age=[1]),
+])
+def test_compiled_diff_matches_generic_diff(entity, changes):
+    new_entity = dict(entity, **changes)
+    compiled_diff = compile_diff(infer_schema(entity))
+
+    assert diff_to_tuple(DiffHelper().diff(new_entity, entity)) == \
+        diff_to_tuple(compiled_diff(new_entity, entity))
+
+
+def test_compiled_diff_with_other_fields(entity):
+    new_entity = dict(entity, color='red')
+    new_entity.pop('age')
+
+    diff = compile_diff(infer_schema(entity))(new_entity, entity, user='test')
+
+    assert ['color'] == [c.key for c in diff.added]
+    assert ['age'] == [c.key for c in diff.deleted]
+    assert dict(user='test') == diff.metadata
+
+
+def test_compiled_diff_with_field_rules(entity):
+    helper = DiffHelper(field_rules=FieldRules(exclude=['age', 'address.zip']))
+    schema = infer_schema(FieldRules(exclude=['age', 'address.zip']).apply(entity))
+    new_entity = dict(entity, name='new name', age=40, address=dict(city='test city', zip='4321'))
+
+    diff = compile_diff(schema, helper)(new_entity, entity)
+
+    assert diff_to_tuple(helper.diff(new_entity, entity)) == diff_to_tuple(diff)
+    assert ['name'] == [c.key for c in diff.updated]
+
+    # dicts that don't match the schema go through the generic diff with the same rules
+    diff = compile_diff(infer_schema(entity), helper)(new_entity, entity)
+    assert ['name'] == [c.key for c in diff.updated]
+
+
+def test_compiled_diff_with_large_values(entity):
+    helper = DiffHelper(large_value_size=10)
+    new_entity = dict(entity, name='a long new name')
+
+    diff = compile_diff(infer_schema(entity), helper)(new_entity, entity)
+
+    assert diff_to_tuple(helper.diff(new_entity, entity)) == diff_to_tuple(diff)
+    assert isinstance(diff.updated[0].value, ValueDigest)
+    assert 'test' == diff.updated[0].old_value
+
+
+def test_schema_comparator(entity):
+    ec = EntityComparator(comparators=[SchemaComparator(Entity)])
+    old_entity = Entity(**entity)
+    new_entity = Entity(**dict(entity, age=40))
+
+    diff = ec.diff(new_entity, old_entity)
+
+    assert isinstance(diff, Diff)
+    assert [('age', 40, 30)] == [(c.key, c.value, c.old_value) for c in diff.updated]
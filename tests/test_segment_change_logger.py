@@ -0,0 +1,135 @@
+import os
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from datetime import datetime, timedelta
+
+from kronos import segment_change_logger
+from kronos.segment_change_logger import SegmentChangeLogger, SegmentChangeLoggerError
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(minutes=1)
+        return self.now
+
+
+@pytest.fixture
+def directory(tmpdir):
+    return str(tmpdir.join('changes'))
+
+
+def log_entries(change_logger, n, start=0):
+    change_logger.log_many([(Entity(i % 2, 'test'), None, dict(n=i)) for i in range(start, start + n)])
+
+
+def test_history(directory):
+    change_logger = SegmentChangeLogger(directory, segment_size=256, clock=Clock())
+    log_entries(change_logger, 20)
+
+    assert len(os.listdir(directory)) > 4
+
+    assert list(range(19, -1, -1)) == [e['n'] for e in change_logger.history(Entity)]
+    assert [0, 1, 2] == [e['n'] for e in change_logger.history(Entity, limit=3, asc=True)]
+    assert [19, 17, 15] == [e['n'] for e in change_logger.history(Entity, limit=3, entity_id=1)]
+    assert [] == change_logger.history('Other')
+
+    history = change_logger.history(
+        Entity, date_from=datetime(2020, 1, 1, 0, 3), date_to=datetime(2020, 1, 1, 0, 13), asc=True
+    )
+    assert list(range(2, 12)) == [e['n'] for e in history]
+
+    assert 0 == change_logger.first_change(Entity)['n']
+    assert 18 == change_logger.last_change(Entity, entity_id=0)['n']
+
+
+class Other:
+    def __init__(self, id):
+        self.id = id
+
+
+def test_queries_only_decode_matching_records(directory):
+    change_logger = SegmentChangeLogger(directory, segment_size=1024, clock=Clock())
+    log_entries(change_logger, 10)
+    change_logger.log_many([(Other(i), None, dict(n=i)) for i in range(10)])
+
+    decode = mock.MagicMock(wraps=segment_change_logger.decode_binary)
+    with mock.patch.object(segment_change_logger, 'decode_binary', decode):
+        assert [9, 7, 5, 3, 1] == [e['n'] for e in change_logger.history(Entity, entity_id=1)]
+        assert 5 == decode.call_count
+
+        assert list(range(10)) == [e['n'] for e in change_logger.history(Other, asc=True)]
+        assert 15 == decode.call_count
+
+
+def test_reopen_and_torn_tail(directory):
+    change_logger = SegmentChangeLogger(directory, segment_size=256, clock=Clock())
+    log_entries(change_logger, 10)
+    change_logger.close()
+
+    with pytest.raises(SegmentChangeLoggerError):
+        change_logger.log(Entity(1, 'test'), None)
+
+    last_segment = sorted(f for f in os.listdir(directory) if f.endswith('.log'))[-1]
+    with open(os.path.join(directory, last_segment), 'ab') as f:
+        f.write(b'\x40\x00\x00\x00garbage')
+
+    change_logger = SegmentChangeLogger(directory, segment_size=256, clock=Clock())
+    assert 9 == change_logger.last_change(Entity)['n']
+
+    log_entries(change_logger, 2, start=10)
+
+    history = change_logger.history(Entity, asc=True)
+    assert list(range(12)) == [e['n'] for e in history]
+    assert list(range(1, 13)) == [e['id'] for e in history]
+
+
+@pytest.mark.parametrize('damage', ['torn', 'version'])
+def test_invalid_indexes_are_rebuilt(directory, damage):
+    change_logger = SegmentChangeLogger(directory, segment_size=256, clock=Clock())
+    log_entries(change_logger, 10)
+    change_logger.close()
+
+    first_index = os.path.join(directory, sorted(f for f in os.listdir(directory) if f.endswith('.idx'))[0])
+    with open(first_index, 'r+b') as f:
+        if damage == 'torn':
+            f.truncate(os.path.getsize(first_index) - 3)
+        else:
+            f.write(segment_change_logger._INDEX_HEADER.pack(segment_change_logger._INDEX_MAGIC, 0))
+
+    change_logger = SegmentChangeLogger(directory, segment_size=256, clock=Clock())
+
+    assert list(range(10)) == [e['n'] for e in change_logger.history(Entity, asc=True)]
+
+
+def test_concurrent_writers(directory):
+    change_logger = SegmentChangeLogger(directory, segment_size=4096)
+
+    def write(start):
+        for i in range(start, start + 50):
+            change_logger.log(Entity(i, 'test'), None, n=i)
+
+    threads = [threading.Thread(target=write, args=(i * 50,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    history = change_logger.history(Entity, asc=True)
+    assert list(range(200)) == sorted(e['n'] for e in history)
+    assert list(range(1, 201)) == [e['id'] for e in history]
@@ -0,0 +1,124 @@
+import io
+
+import pytest
+
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from kronos.diff import Change, Diff, DiffHelper
+from kronos.serialization import (
+    BinaryReader, BinaryWriter, JSONReader, JSONWriter, SerializationError,
+    decode_binary, decode_json, encode_binary, encode_json,
+)
+from kronos.utils import ValueDigest
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+OLD = dict(
+    name='test',
+    price=Decimal('10.5'),
+    created=datetime(2020, 1, 1, 10, 30),
+    tags=['a', 'b'],
+    labels=set(['x']),
+    items=[dict(id=1, price=10), dict(id=2, price=20)],
+    address=dict(city='city', geo=dict(lat=1.5, lng=-2)),
+    history=ValueDigest('a1', 3),
+)
+
+NEW = dict(
+    name='new name',
+    price=Decimal('11.0'),
+    created=datetime(2020, 1, 1, 10, 30),
+    day=date(2020, 1, 2),
+    at=time(10, 15),
+    tags=['b', 'c'],
+    labels=set(['y']),
+    items=[dict(id=1, price=15), dict(id=3, price=30, data=b'\x00\x01')],
+    address=dict(city='city', geo=dict(lat=3, lng=-2), extra={'$t': 1, 2: (3, 4)}),
+    history=ValueDigest('b2', 4),
+)
+
+
+@pytest.fixture
+def diff():
+    return DiffHelper(detect_moves=True).diff(NEW, OLD, user='admin')
+
+
+@pytest.mark.parametrize('encode, decode', [(encode_json, decode_json), (encode_binary, decode_binary)])
+def test_roundtrip(diff, encode, decode):
+    decoded = decode(encode(diff))
+
+    assert isinstance(decoded, Diff)
+    assert encode(diff) == encode(decoded)
+    assert dict(user='admin') == decoded.metadata
+    assert [(ValueDigest('b2'), 4)] == [
+        (c.value, c.value.length) for c in decoded.updated if getattr(c, 'key', None) == 'history'
+    ]
+
+    record = dict(id=1, created_at=datetime(2020, 1, 1), changes=diff, n=[1, -300, 2 ** 70, None, True])
+    assert record['n'] == decode(encode(record))['n']
+    assert datetime(2020, 1, 1) == decode(encode(record))['created_at']
+
+
+def test_objects_are_encoded_as_dicts():
+    diff = Diff()
+    diff.added.append(Change('owner', Entity(1, 'test')))
+
+    assert dict(id=1, name='test') == decode_binary(encode_binary(diff)).added[0].value
+    assert dict(id=1, name='test') == decode_json(encode_json(diff)).added[0].value
+
+
+def test_binary_is_smaller_than_json(diff):
+    assert len(encode_binary(diff)) < len(encode_json(diff).encode())
+
+
+@pytest.mark.parametrize('writer, reader, stream', [
+    (JSONWriter, JSONReader, io.StringIO),
+    (BinaryWriter, BinaryReader, io.BytesIO),
+])
+def test_streams(diff, writer, reader, stream):
+    out = stream()
+    w = writer(out)
+    for i in range(3):
+        w.write(dict(n=i, changes=diff))
+
+    out.seek(0)
+    records = list(reader(out))
+
+    assert [0, 1, 2] == [r['n'] for r in records]
+    assert encode_json(diff) == encode_json(records[2]['changes'])
+
+
+def test_json_writer_matches_encode_json(diff):
+    out = io.StringIO()
+    record = dict(changes=diff, owner=Entity(1, 'test'), n=[1.5, None, 'x'])
+    JSONWriter(out).write(record)
+
+    assert encode_json(record) + '\n' == out.getvalue()
+
+
+@pytest.mark.parametrize('encode, decode', [(encode_json, decode_json), (encode_binary, decode_binary)])
+def test_bytearray_is_encoded_as_bytes(encode, decode):
+    assert b'\x00\x01' == decode(encode(bytearray(b'\x00\x01')))
+
+
+def test_version_check(diff):
+    data = bytearray(encode_binary(diff))
+    data[3] = 99
+
+    with pytest.raises(SerializationError):
+        decode_binary(bytes(data))
+
+    with pytest.raises(SerializationError):
+        decode_json('[99, null]')
+
+
+def test_change_repr():
+    assert "Change(key='name', value='new', old_value='old')" == repr(Change('name', 'new', 'old'))
+    assert "Change(key='active', value=False, old_value=0, metadata={'from_index': 0})" == \
+        repr(Change('active', False, 0, from_index=0))
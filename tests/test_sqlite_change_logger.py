@@ -0,0 +1,101 @@
+import pytest
+
+from datetime import datetime, timedelta, timezone
+
+from kronos.comparator import EntityComparator
+from kronos.sqlite_change_logger import SQLiteChangeLogger
+from kronos.tracker import Tracker
+
+
+class Entity:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(minutes=1)
+        return self.now
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    return str(tmpdir.join('changes.db'))
+
+
+@pytest.fixture
+def change_logger(db_path):
+    change_logger = SQLiteChangeLogger(db_path, clock=Clock())
+    change_logger.log_many([(Entity(i % 2, 'test'), None, dict(n=i)) for i in range(10)])
+    return change_logger
+
+
+def test_first_and_last_change(change_logger):
+    assert 0 == change_logger.first_change(Entity)['n']
+    assert 9 == change_logger.last_change('Entity')['n']
+    assert 8 == change_logger.last_change(Entity, entity_id=0)['n']
+    assert change_logger.last_change('Other') is None
+
+
+def test_history(change_logger):
+    assert list(range(9, -1, -1)) == [e['n'] for e in change_logger.history(Entity)]
+    assert [0, 1, 2] == [e['n'] for e in change_logger.history(Entity, limit=3, asc=True)]
+    assert [9, 7, 5] == [e['n'] for e in change_logger.history(Entity, limit=3, entity_id=1)]
+
+    history = change_logger.history(
+        Entity, date_from=datetime(2020, 1, 1, 0, 3), date_to=datetime(2020, 1, 1, 0, 6), asc=True
+    )
+    assert [2, 3, 4] == [e['n'] for e in history]
+    assert datetime(2020, 1, 1, 0, 3) == history[0]['created_at']
+
+
+def test_page(change_logger):
+    pages, cursor = [], None
+
+    while True:
+        entries, cursor = change_logger.page(Entity, cursor=cursor, size=4)
+        pages.append([e['n'] for e in entries])
+
+        if cursor is None:
+            break
+
+    assert [[9, 8, 7, 6], [5, 4, 3, 2], [1, 0]] == pages
+
+
+def test_aware_creation_times(db_path):
+    created_at = datetime(2020, 1, 1, 12, tzinfo=timezone(timedelta(hours=2)))
+    SQLiteChangeLogger(db_path).log(Entity(1, 'test'), None, created_at=created_at)
+
+    # naive local times by default
+    local_at = created_at.astimezone().replace(tzinfo=None)
+    assert local_at == SQLiteChangeLogger(db_path).last_change(Entity)['created_at']
+
+    change_logger = SQLiteChangeLogger(db_path, timezone=timezone.utc)
+    read_at = change_logger.last_change(Entity)['created_at']
+
+    assert created_at == read_at
+    assert datetime(2020, 1, 1, 10, tzinfo=timezone.utc) == read_at
+    assert timezone.utc == read_at.tzinfo
+
+
+def test_tracker_logs(db_path):
+    tracker = Tracker(EntityComparator(), SQLiteChangeLogger(db_path))
+
+    entity = Entity(1, 'test')
+    tracker.track_entity(entity)
+    entity.name = 'new name'
+    tracker.log_changes(entity, user='admin')
+
+    # the log survives restarts
+    last_change = SQLiteChangeLogger(db_path).last_change(Entity, entity_id=1)
+
+    assert 'admin' == last_change['user']
+    assert 'new name' == last_change['changes'].updated[0].value
+    assert not last_change['created']
@@ -0,0 +1,99 @@
+import multiprocessing
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from collections import OrderedDict
+from decimal import Decimal
+
+from kronos.comparator import EntityComparator
+from kronos.sqlite_store import SQLiteStore
+from kronos.tracker import Tracker
+
+
+class Entity:
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
+
+    def to_dict(self):
+        return self.__dict__
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    return str(tmpdir.join('snapshots.db'))
+
+
+def test_save_and_get(db_path):
+    store = SQLiteStore(db_path)
+    snapshot = OrderedDict(id=1, name='test', price=Decimal('10.5'), tags=['a', 'b'])
+
+    assert not store.has_key('Entity-1')
+    assert store.get('Entity-1') is None
+
+    store.save('Entity-1', snapshot, fingerprint='fp')
+
+    assert store.has_key('Entity-1')
+    assert snapshot == store.get('Entity-1')
+    assert 'fp' == store.get_fingerprint('Entity-1')
+
+    store.save('Entity-1', dict(id=1))
+    assert store.get_fingerprint('Entity-1') is None
+
+
+def test_save_many_and_get_many(db_path):
+    store = SQLiteStore(db_path)
+    store.save_many([('Entity-{}'.format(i), dict(id=i), 'fp{}'.format(i)) for i in range(1200)])
+
+    keys = ['Entity-{}'.format(i) for i in range(0, 1300, 2)]
+    snapshots = store.get_many(keys)
+
+    assert 600 == len(snapshots)
+    assert dict(id=1198) == snapshots['Entity-1198']
+    assert 'fp4' == store.get_fingerprints(keys)['Entity-4']
+
+
+def test_snapshots_survive_restarts(db_path):
+    SQLiteStore(db_path).save('Entity-1', dict(id=1))
+    assert dict(id=1) == SQLiteStore(db_path).get('Entity-1')
+
+
+def _track_entity(db_path):
+    tracker = Tracker(EntityComparator(), mock.MagicMock(), store=SQLiteStore(db_path))
+    tracker.track_entity(Entity(1, 'test', Decimal('10')))
+
+
+def test_snapshots_are_shared_between_processes(db_path):
+    SQLiteStore(db_path)
+
+    process = multiprocessing.Process(target=_track_entity, args=(db_path,))
+    process.start()
+    process.join()
+
+    tracker = Tracker(EntityComparator(), mock.MagicMock(), store=SQLiteStore(db_path))
+    entity = Entity(1, 'test', Decimal('12'))
+
+    diff = tracker.log_changes(entity)
+
+    assert 1 == len(diff.updated)
+    assert Decimal('10') == diff.updated[0].old_value
+
+
+def test_merkle_tracker(db_path):
+    tracker = Tracker(EntityComparator(), mock.MagicMock(), store=SQLiteStore(db_path), merkle=True)
+    entity = Entity(1, 'test', dict(amount=10, currency='USD'))
+
+    tracker.track_entity(entity)
+    assert tracker.get_entity_diff(entity).empty
+
+    entity.price['amount'] = 20
+    diff = tracker.log_changes(entity)
+
+    assert 'price' == diff.updated[0].field_name
+    assert tracker.get_entity_diff(entity).empty
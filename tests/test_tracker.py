@@ -0,0 +1,335 @@
+import pickle
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+try:
+    from unittest import mock
+except:
+    import mock
+
+from kronos.comparator import EntityComparator
+from kronos.diff import DiffHelper
+from kronos.dict_store import DictStore
+from kronos.tracked_entity_manager import TrackedEntityManager
+from kronos.tracker import Tracker, EntityConflictError
+from kronos.utils import HashTree, ValueDigest, fingerprint, hash_tree, value_digest
+
+
+class Entity:
+    def __init__(self, id, name, age):
+        self.id = id
+        self.name = name
+        self.age = age
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class PerItemStore:
+    """A store without the optional batch methods"""
+
+    def __init__(self):
+        self._data = {}
+
+    def has_key(self, key):
+        return key in self._data
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def save(self, key, value):
+        self._data[key] = value
+
+
+@pytest.fixture
+def entities():
+    return [Entity(i, 'test {}'.format(i), 30 + i) for i in range(5)]
+
+
+@pytest.fixture
+def change_logger():
+    return mock.MagicMock(spec=['log', 'log_many'])
+
+
+def test_track_many(entities, change_logger):
+    store = mock.MagicMock(wraps=DictStore())
+    tracker = Tracker(EntityComparator(), change_logger, store=store)
+
+    tracker.track_many(entities)
+
+    store.get_many.assert_called_once()
+    store.save_many.assert_called_once()
+    assert not store.get.called
+    assert not store.save.called
+
+    for entity in entities:
+        assert tracker.get_entity_diff(entity).empty
+
+
+def test_track_many_conflict(entities, change_logger):
+    tracker = Tracker(EntityComparator(), change_logger)
+    tracker.track_many(entities)
+
+    entities[2].age = 100
+
+    with pytest.raises(EntityConflictError):
+        tracker.track_many(entities)
+
+    tracker.track_many(entities, override=True)
+    assert tracker.get_entity_diff(entities[2]).empty
+
+
+def test_log_changes_many(entities, change_logger):
+    tracker = Tracker(EntityComparator(), change_logger)
+    tracker.track_many(entities)
+
+    entities[1].age = 100
+    untracked = Entity(10, 'untracked', 20)
+
+    diffs = tracker.log_changes_many(entities + [untracked], user='test')
+
+    assert 6 == len(diffs)
+    assert diffs[-1] is None
+    assert 1 == len(diffs[1].updated)
+    assert all(d.empty for i, d in enumerate(diffs[:-1]) if i != 1)
+
+    change_logger.log_many.assert_called_once()
+    assert not change_logger.log.called
+
+    entries = change_logger.log_many.call_args[0][0]
+    assert 5 == len(entries)
+    assert (entities[1], diffs[1], dict(user='test')) == entries[1]
+
+    # snapshots are updated with the latest state
+    assert tracker.get_entity_diff(entities[1]).empty
+
+
+def test_log_changes_many_falls_back_to_per_item_calls(entities):
+    change_logger = mock.MagicMock(spec=['log'])
+    tracker = Tracker(EntityComparator(), change_logger, store=PerItemStore())
+    tracker.track_many(entities)
+
+    entities[0].name = 'new name'
+    tracker.log_changes_many(entities[:2])
+
+    assert 2 == change_logger.log.call_count
+    assert tracker.get_entity_diff(entities[0]).empty
+
+    tracker.log_changes_many(entities[:2], deleted=True)
+    change_logger.log.assert_called_with(entities[1], None, deleted=True)
+
+
+def test_unchanged_entity_skips_diff(entities, change_logger):
+    comparator = mock.MagicMock(wraps=EntityComparator())
+    tracker = Tracker(comparator, change_logger, fingerprints=True)
+    tracker.track_entity(entities[0])
+
+    diff = tracker.log_changes(entities[0])
+
+    assert diff.empty
+    assert not comparator.diff.called
+
+    entities[0].age = 100
+    diff = tracker.log_changes(entities[0])
+
+    assert not diff.empty
+    comparator.diff.assert_called_once()
+
+
+def test_unchanged_entity_skips_diff_in_batches(entities, change_logger):
+    comparator = mock.MagicMock(wraps=EntityComparator())
+    tracker = Tracker(comparator, change_logger, fingerprints=True)
+    tracker.track_many(entities)
+
+    entities[3].name = 'new name'
+    diffs = tracker.log_changes_many(entities)
+
+    comparator.diff_many.assert_called_once()
+    assert 1 == len(comparator.diff_many.call_args[0][0])
+    assert [False, False, False, True, False] == [not d.empty for d in diffs]
+
+
+def test_fingerprints_are_opt_in(entities, change_logger):
+    store = DictStore()
+    tracker = Tracker(EntityComparator(), change_logger, store=store)
+    tracker.track_entity(entities[0])
+
+    assert store.get_fingerprint('Entity-0') is None
+    assert tracker.log_changes(entities[0]).empty
+
+
+def test_tracked_snapshot_is_not_shared_with_entity(change_logger):
+    entity = Entity(1, 'test', 30)
+    entity.address = dict(city='test city')
+
+    tracker = Tracker(EntityComparator(), change_logger)
+    tracker.track_entity(entity)
+
+    entity.address['city'] = 'new city'
+
+    with pytest.raises(EntityConflictError):
+        tracker.track_entity(entity)
+
+    diff = tracker.get_entity_diff(entity)
+    assert 'address' == diff.updated[0].field_name
+
+
+def test_tracker_without_store_fingerprints(entities, change_logger):
+    tracker = Tracker(EntityComparator(), change_logger, store=PerItemStore())
+    tracker.track_entity(entities[0])
+    tracker.track_entity(entities[0])
+
+    entities[0].age = 100
+
+    with pytest.raises(EntityConflictError):
+        tracker.track_entity(entities[0])
+
+    assert not tracker.log_changes(entities[0]).empty
+
+
+def test_merkle_tracker_skips_unchanged_subtrees(change_logger):
+    entity = Entity(1, 'test', 30)
+    entity.address = dict(city='test city', geo=dict(lat=1, lng=2))
+    entity.tags = [dict(id=i, name='tag {}'.format(i)) for i in range(3)]
+
+    helper = mock.MagicMock(wraps=DiffHelper())
+    tracker = Tracker(EntityComparator(diff_helper=helper), change_logger, merkle=True)
+    tracker.track_entity(entity)
+
+    entity.address['geo']['lat'] = 10
+
+    with mock.patch.object(DiffHelper, '_list_diff', wraps=helper._list_diff) as list_diff:
+        diff = tracker.log_changes(entity)
+
+    assert not list_diff.called
+    helper.tree_diff.assert_called_once()
+
+    address_diff = diff.updated[0]
+    assert 'address' == address_diff.field_name
+    assert 'geo' == address_diff.updated[0].field_name
+    assert 10 == address_diff.updated[0].updated[0].value
+
+    entity.tags.append(dict(id=3, name='tag 3'))
+    diffs = tracker.log_changes_many([entity])
+
+    assert ['tags'] == [d.field_name for d in diffs[0].updated]
+    assert tracker.get_entity_diff(entity).empty
+
+
+def test_hash_tree():
+    tree = hash_tree(dict(a=1, b=dict(c=[1, 2]), d=[dict(e=1)]))
+
+    assert tree == hash_tree(dict(b=dict(c=[1, 2]), a=1, d=[dict(e=1)]))
+    assert tree != hash_tree(dict(a=1, b=dict(c=[2, 1]), d=[dict(e=1)]))
+    assert tree.children['b'] == hash_tree(dict(c=[1, 2]))
+    assert set(['b', 'd']) == set(tree.children)
+    assert pickle.loads(pickle.dumps(tree)).children['b'] == tree.children['b']
+
+
+@pytest.mark.parametrize('old, new', [
+    ('1.50', Decimal('1.50')),
+    ('2020-01-01', date(2020, 1, 1)),
+    ('01', b'\x01'),
+    ({'1': 'a'}, {1: 'a'}),
+    ('#' + hash_tree([1]).digest, [1]),
+])
+@pytest.mark.parametrize('merkle', [False, True])
+def test_values_of_different_types_have_different_fingerprints(change_logger, old, new, merkle):
+    entity = Entity(1, 'test', 30)
+    entity.value = old
+
+    tracker = Tracker(EntityComparator(), change_logger, merkle=merkle, fingerprints=True)
+    tracker.track_entity(entity)
+
+    entity.value = new
+
+    assert not tracker.log_changes(entity).empty
+    change_logger.log.assert_called_once()
+
+
+def test_unsupported_values_are_not_fingerprinted(change_logger):
+    entity = Entity(1, 'test', 30)
+    entity.value = object()
+
+    tracker = Tracker(EntityComparator(), change_logger, fingerprints=True)
+    tracker.track_entity(entity)
+
+    assert tracker.get_entity_diff(entity).empty
+    with pytest.raises(TypeError):
+        fingerprint(entity.value)
+
+
+@pytest.mark.parametrize('store', [DictStore, PerItemStore])
+def test_entities_are_converted_once_per_operation(entities, change_logger, store):
+    comparator = EntityComparator()
+    tracker = Tracker(comparator, change_logger, store=store())
+
+    tracker.track_entity(entities[0])
+    assert 1 == comparator.conversions
+
+    entities[0].age = 100
+    assert not tracker.log_changes(entities[0]).empty
+    assert 2 == comparator.conversions
+
+    tracker.track_many(entities[1:])
+    entities[1].age = 100
+    tracker.log_changes_many(entities[1:])
+    assert 2 + 2 * len(entities[1:]) == comparator.conversions
+
+
+def test_has_changes(entities, change_logger):
+    comparator = mock.MagicMock(wraps=EntityComparator())
+    tracker = Tracker(comparator, change_logger)
+
+    assert tracker.has_changes(entities[0]) is None
+
+    tracker.track_entity(entities[0])
+    assert tracker.has_changes(entities[0]) is False
+
+    entities[0].age = 100
+    assert tracker.has_changes(entities[0]) is True
+    assert not comparator.diff.called
+
+    tracker = Tracker(EntityComparator(), change_logger, store=PerItemStore())
+    tracker.track_entity(entities[1])
+    assert tracker.has_changes(entities[1]) is False
+    entities[1].name = 'new name'
+    assert tracker.has_changes(entities[1]) is True
+
+
+def test_large_values_are_tracked_as_digests(change_logger):
+    store = DictStore()
+    comparator = EntityComparator(diff_helper=DiffHelper(large_value_size=100))
+    tracker = Tracker(comparator, change_logger, store=store, large_value_size=100)
+
+    entity = Entity(1, 'x' * 1000, 30)
+    tracker.track_entity(entity)
+
+    snapshot = store.get(tracker._build_entity_key(entity, None))
+    assert ValueDigest(value_digest('x' * 1000).digest) == snapshot['name']
+    assert 30 == snapshot['age']
+
+    entity.age = 31
+    assert ['age'] == [c.key for c in tracker.log_changes(entity).updated]
+
+    entity.name = 'y' * 1000
+    change = tracker.log_changes(entity).updated[0]
+    assert (1000, 1000) == (change.value.length, change.old_value.length)
+    assert not tracker.has_changes(entity)
+
+
+def test_tracked_entity_manager_passes_tracker_arguments(change_logger):
+    manager = mock.MagicMock(spec=['get_by_id', 'save'])
+    manager.get_by_id.return_value = Entity(1, 'x' * 200, 30)
+    store = DictStore()
+    tracked_manager = TrackedEntityManager(manager, EntityComparator(), change_logger, store=store,
+                                           merkle=True, large_value_size=100)
+
+    tracked_manager.get_by_id(1)
+
+    snapshot = store.get('Entity-1')
+    assert isinstance(snapshot['name'], ValueDigest)
+    assert isinstance(store.get_fingerprint('Entity-1'), HashTree)